@@ -0,0 +1,94 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from tank_storage import to_epoch_us
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# (timestamp in epoch microseconds, level)
+FeedbackKey = Tuple[int, float]
+
+
+class FeedbackIndex:
+    """User "mark as normal" feedback, hashed per tank by (timestamp, level)
+
+    Recording feedback is a dict upsert, and the readings of a tank that were
+    marked normal are found with one vectorized hash join (mask) instead of
+    re-filtering the readings once per feedback entry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tanks: Dict[str, Dict[FeedbackKey, Dict[str, Any]]] = {}
+        self._normal: Dict[str, pd.MultiIndex] = {}  # per-tank keys marked normal, rebuilt on change
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._tanks.values())
+
+    @staticmethod
+    def _key(timestamp: datetime, level: float) -> FeedbackKey:
+        return to_epoch_us(timestamp), float(level)
+
+    def add(self, feedback: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Record feedback on a reading, replacing earlier feedback on the same reading
+
+        Args:
+            feedback: Dict with 'tank_id', 'timestamp', 'level' and 'is_normal'
+
+        Returns:
+            The stored feedback entry
+        """
+        key = self._key(feedback["timestamp"], feedback["level"])
+        with self._lock:
+            entries = self._tanks.setdefault(feedback["tank_id"], {})
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = dict(feedback)
+            else:
+                entry.update(feedback)
+            self._normal.pop(feedback["tank_id"], None)
+        return entry
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Get every feedback entry"""
+        with self._lock:
+            return [entry for entries in self._tanks.values() for entry in entries.values()]
+
+    def _normal_keys(self, tank_id: str) -> Optional[pd.MultiIndex]:
+        with self._lock:
+            keys = self._normal.get(tank_id)
+            if keys is None:
+                marked = [key for key, entry in self._tanks.get(tank_id, {}).items() if entry.get("is_normal", True)]
+                if not marked:
+                    return None
+                timestamps, levels = zip(*marked)
+                keys = self._normal[tank_id] = pd.MultiIndex.from_arrays(
+                    [np.array(timestamps, dtype=np.int64), np.array(levels, dtype=np.float64)]
+                )
+            return keys
+
+    def mask(self, tank_id: str, timestamps: np.ndarray, levels: np.ndarray) -> np.ndarray:
+        """
+        Find the readings of a tank that users marked as normal
+
+        Args:
+            tank_id: Tank the readings belong to
+            timestamps: Epoch microseconds of the readings
+            levels: Levels of the readings
+
+        Returns:
+            Boolean array, True where a reading was marked as normal
+        """
+        keys = self._normal_keys(tank_id)
+        if keys is None or not len(timestamps):
+            return np.zeros(len(timestamps), dtype=bool)
+        readings = pd.MultiIndex.from_arrays(
+            [np.asarray(timestamps, dtype=np.int64), np.asarray(levels, dtype=np.float64)]
+        )
+        return readings.isin(keys)
@@ -0,0 +1,501 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, Callable, List, Optional
+import joblib
+import numpy as np
+import pandas as pd
+from anomaly_feedback import FeedbackIndex
+from anomaly_jobs import AnomalyJobExecutor
+from anomaly_models import AnomalyModelRegistry, FittedModel, ModelKey
+from tank_storage import TankSeries, encode_tank_id, from_epoch_us, to_epoch_us
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+FLAGS_DIR = os.path.join("data", "anomaly_flags")
+MIN_TRAINING_POINTS = 10
+DEFAULT_FLAG_CONFIG = {
+    "score_window_days": 30,  # training window of the per-tank models readings are scored with
+    "max_sensitivity": 0.1    # highest sensitivity /api/anomalies can be asked for
+}
+FLAG_COLUMNS = ["timestamps", "levels", "scores", "versions", "user_ids"]
+SKETCH_POINTS = 101  # thresholds kept per model version, 0 to max_sensitivity (exact at multiples of 1/100th)
+
+
+def threshold_sketch(train_scores: np.ndarray, max_sensitivity: float) -> np.ndarray:
+    """Get a model's thresholds at SKETCH_POINTS sensitivities up to max_sensitivity"""
+    return np.percentile(train_scores, 100.0 * np.linspace(0.0, max_sensitivity, SKETCH_POINTS))
+
+
+def score_history(timestamps: np.ndarray, levels: np.ndarray, window_us: int, now_us: int,
+                  max_sensitivity: float) -> Dict[str, Any]:
+    """
+    Score a tank's history block by block (an AnomalyJobExecutor job)
+
+    History is split into window_us blocks ending at now_us, and each block is
+    scored with a model fitted on the block itself, as its readings would have
+    been had they been scored on arrival. The newest block's model is the
+    tank's current model.
+
+    Args:
+        timestamps: Sorted epoch microseconds of the readings
+        levels: Levels of the readings
+        window_us: Length of a block (the model training window)
+        now_us: End of the newest block
+        max_sensitivity: Highest sensitivity flags are kept for
+
+    Returns:
+        Dict with the positions, scores and model versions of the flagged
+        readings, each version's threshold sketch and fit time, and the state
+        of the current model (None if the newest block is too small to fit)
+    """
+    bounds = [len(timestamps)]
+    block_start = now_us - window_us
+    while True:
+        bounds.append(int(np.searchsorted(timestamps, block_start, side="left")))
+        if bounds[-1] == 0:
+            break
+        block_start -= window_us
+
+    positions, scores, versions, sketches, model_ids = [], [], [], [], []
+    current = None
+    for lo, hi in zip(bounds[::-1], bounds[-2::-1]):
+        if hi - lo < MIN_TRAINING_POINTS:
+            continue
+        fitted = FittedModel.fit(timestamps[lo:hi], levels[lo:hi])
+        block_scores = fitted.score_samples(levels[lo:hi])
+        keep = np.flatnonzero(block_scores < fitted.threshold(max_sensitivity))
+        positions.append(keep + lo)
+        scores.append(block_scores[keep])
+        versions.append(np.full(len(keep), len(sketches), dtype=np.int32))
+        sketches.append(threshold_sketch(fitted.train_scores, max_sensitivity))
+        model_ids.append(fitted.fitted_at)
+        if hi == len(timestamps):
+            current = fitted.state()
+
+    return {
+        "positions": np.concatenate(positions) if positions else np.empty(0, dtype=np.int64),
+        "scores": np.concatenate(scores) if scores else np.empty(0, dtype=np.float64),
+        "versions": np.concatenate(versions) if versions else np.empty(0, dtype=np.int32),
+        "sketches": sketches,
+        "model_ids": model_ids,
+        "current": current,
+    }
+
+
+class _TankFlags:
+    """Flagged readings of one tank, sorted by timestamp
+
+    scores are raw Isolation Forest scores; versions[i] indexes the threshold
+    sketch of the model that scored reading i, so its threshold at any
+    sensitivity can be derived even after the tank's model was refit. Only
+    versions that some flag still refers to (and the current one) are kept.
+    """
+
+    def __init__(self, columns: Optional[Dict[str, np.ndarray]] = None,
+                 sketches: Optional[List[np.ndarray]] = None, model_ids: Optional[List[Any]] = None):
+        self.columns = columns or {
+            "timestamps": np.empty(0, dtype=np.int64),
+            "levels": np.empty(0, dtype=np.float32),
+            "scores": np.empty(0, dtype=np.float64),
+            "versions": np.empty(0, dtype=np.int32),
+            "user_ids": np.empty(0, dtype=object),
+        }
+        self.sketches = sketches or []
+        self.model_ids = model_ids or [None] * len(self.sketches)  # fit time of each version's model
+        self.model: Optional[FittedModel] = None  # model behind the newest version
+
+    def __len__(self) -> int:
+        return len(self.columns["timestamps"])
+
+    def version(self, fitted: FittedModel, max_sensitivity: float) -> int:
+        """Get the version of a model, registering it if it is new"""
+        if fitted is not self.model:
+            self.model = fitted
+            # A model reloaded after a restart is the same version
+            if not self.model_ids or self.model_ids[-1] != fitted.fitted_at:
+                self.prune()
+                self.sketches.append(threshold_sketch(fitted.train_scores, max_sensitivity))
+                self.model_ids.append(fitted.fitted_at)
+        return len(self.sketches) - 1
+
+    def prune(self) -> None:
+        """Drop the sketches of versions no flag refers to, keeping the newest"""
+        if not self.sketches:
+            return
+        used = np.zeros(len(self.sketches), dtype=bool)
+        used[self.columns["versions"]] = True
+        used[-1] = True
+        if used.all():
+            return
+        renumber = np.cumsum(used) - 1
+        self.columns["versions"] = renumber[self.columns["versions"]].astype(np.int32)
+        self.sketches = [sketch for sketch, keep in zip(self.sketches, used) if keep]
+        self.model_ids = [model_id for model_id, keep in zip(self.model_ids, used) if keep]
+
+    def merge(self, new: Dict[str, np.ndarray]) -> None:
+        """Add flagged readings, skipping timestamps already flagged"""
+        timestamps = self.columns["timestamps"]
+        fresh = ~np.isin(new["timestamps"], timestamps)
+        if not fresh.all():
+            new = {name: values[fresh] for name, values in new.items()}
+        if not len(new["timestamps"]):
+            return
+        merged = {name: np.concatenate([self.columns[name], new[name]]) for name in FLAG_COLUMNS}
+        if len(timestamps) and new["timestamps"][0] < timestamps[-1]:
+            order = np.argsort(merged["timestamps"], kind="stable")
+            merged = {name: values[order] for name, values in merged.items()}
+        self.columns = merged
+
+    def state(self) -> Dict[str, Any]:
+        """Get what is persisted to disk"""
+        return {"columns": self.columns, "sketches": self.sketches, "model_ids": self.model_ids}
+
+
+class AnomalyFlagStore:
+    """Anomaly scores materialized on ingest, one sorted set of flags per tank
+
+    Every reading written is scored with its tank's cached model, fitted on
+    the last score_window_days. Readings that are anomalous at max_sensitivity
+    are kept with their score, so /api/anomalies becomes a binary search plus
+    a threshold filter for any sensitivity up to it. A tank's existing history
+    is scored once, when the tank is first seen (see score_history, which
+    runs in the job pool), and the flags are saved under data/anomaly_flags.
+    New readings are scored on one background thread, in write order, so
+    ingest does not wait for the forest.
+    """
+
+    def __init__(self, models: AnomalyModelRegistry, loader: Callable[[str, Optional[datetime]], TankSeries],
+                 config: Optional[Dict[str, Any]] = None, lock: Optional[threading.RLock] = None,
+                 feedback: Optional[FeedbackIndex] = None, jobs: Optional[AnomalyJobExecutor] = None,
+                 root: str = FLAGS_DIR):
+        """
+        Initialize the store
+
+        Args:
+            models: Registry the per-tank models come from
+            loader: Reads a tank's readings since a timestamp (None: full history)
+            config: Overrides for DEFAULT_FLAG_CONFIG
+            lock: Lock shared with the history writers
+            feedback: Readings users marked as normal, left out of query results
+            jobs: Process pool that histories are scored in (None: in this process)
+            root: Directory for the persisted flags
+        """
+        self.models = models
+        self.loader = loader
+        self.config = {**DEFAULT_FLAG_CONFIG, **(config or {})}
+        self.lock = lock or threading.RLock()
+        self.feedback = feedback
+        self.jobs = jobs
+        self.root = root
+        self._tanks: Dict[str, _TankFlags] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="anomaly-score")
+        self._pending: Optional[Future] = None
+        self.metrics = {"scored": 0, "flagged": 0, "backfilled_tanks": 0, "errors": 0}
+
+    @property
+    def max_sensitivity(self) -> float:
+        return float(self.config["max_sensitivity"])
+
+    def _path(self, tank_id: str) -> str:
+        return os.path.join(self.root, f"{encode_tank_id(tank_id)}.joblib")
+
+    def _key(self, tank_id: str) -> ModelKey:
+        return tank_id, None, f"{self.config['score_window_days']}d"
+
+    def _model(self, tank_id: str) -> Optional[FittedModel]:
+        """Get the tank's model, fitted on its current training window"""
+        window = self.loader(tank_id, datetime.now() - timedelta(days=self.config["score_window_days"]))
+        if len(window) < MIN_TRAINING_POINTS:
+            return None
+        return self.models.get_model(self._key(tank_id), window.timestamps, window.levels)
+
+    def _candidates(self, flags: _TankFlags, fitted: FittedModel, series: TankSeries,
+                    scores: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """Score a series (unless already scored) and keep the readings anomalous at max_sensitivity"""
+        if scores is None:
+            scores = fitted.score_samples(series.levels)
+        keep = scores < fitted.threshold(self.max_sensitivity)
+        flagged = int(keep.sum())
+        self.metrics["scored"] += len(series)
+        self.metrics["flagged"] += flagged
+        return {
+            "timestamps": series.timestamps[keep],
+            "levels": series.levels[keep].astype(np.float32),
+            "scores": scores[keep],
+            "versions": np.full(flagged, flags.version(fitted, self.max_sensitivity), dtype=np.int32),
+            "user_ids": series.user_ids[keep] if series.user_ids is not None else np.full(flagged, None, dtype=object),
+        }
+
+    def _save(self, tank_id: str) -> None:
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            path = self._path(tank_id)
+            state = {**self._tanks[tank_id].state(), "max_sensitivity": self.max_sensitivity}
+            joblib.dump(state, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.error(f"Error saving anomaly flags for tank {tank_id}: {str(e)}")
+
+    def _load(self, tank_id: str) -> Optional[_TankFlags]:
+        """Get a tank's flags from memory or disk, without scoring anything"""
+        with self.lock:
+            flags = self._tanks.get(tank_id)
+            if flags is not None:
+                return flags
+
+            path = self._path(tank_id)
+            if os.path.exists(path):
+                try:
+                    state = joblib.load(path)
+                    if "sketches" in state and state.get("max_sensitivity") != self.max_sensitivity:
+                        raise ValueError("sketched for a different max_sensitivity")
+                    if "sketches" not in state:
+                        # Saved before versions were sketched
+                        state["sketches"] = [threshold_sketch(scores, self.max_sensitivity)
+                                             for scores in state["train_scores"]]
+                    flags = _TankFlags(state["columns"], state["sketches"], state.get("model_ids"))
+                    self._tanks[tank_id] = flags
+                    return flags
+                except Exception as e:
+                    logger.warning(f"Could not load anomaly flags for tank {tank_id}, rescoring: {str(e)}")
+            return None
+
+    def _ensure(self, tank_id: str) -> Optional[_TankFlags]:
+        """
+        Get a tank's flags, loading them or scoring its whole history the first time
+
+        Must be called without holding the lock: the history is read and
+        scored outside it, like rescore(), so writers are not held up.
+        """
+        flags = self._load(tank_id)
+        if flags is not None:
+            return flags
+
+        history = self.loader(tank_id, None)
+        result = self._run(score_history, *self._job_args(history))
+        with self.lock:
+            if tank_id in self._tanks:
+                # Another thread backfilled the tank meanwhile
+                return self._tanks[tank_id]
+            flags = self._install(tank_id, history, result)
+            if flags is None:
+                return None
+            self._catch_up(tank_id, flags, history)
+        self.metrics["backfilled_tanks"] += 1
+        logger.info(f"Scored {len(history)} readings of tank {tank_id}, {len(flags)} flagged")
+        return flags
+
+    def _job_args(self, history: TankSeries) -> tuple:
+        window_us = int(self.config["score_window_days"] * 86400 * 1_000_000)
+        return history.timestamps, history.levels, window_us, to_epoch_us(datetime.now()), self.max_sensitivity
+
+    def _run(self, fn: Callable, *args) -> Any:
+        """Run a scoring job in the job pool, or in this thread without one"""
+        if self.jobs is None:
+            return fn(*args)
+        return self.jobs.submit(fn, *args).result()
+
+    def _install(self, tank_id: str, history: TankSeries, result: Dict[str, Any]) -> Optional[_TankFlags]:
+        """Replace a tank's flags with the result of score_history on its history"""
+        if result["current"] is None:
+            # Not enough recent readings to fit the tank's model
+            return None
+        positions = result["positions"]
+        flags = _TankFlags({
+            "timestamps": history.timestamps[positions],
+            "levels": history.levels[positions].astype(np.float32),
+            "scores": result["scores"],
+            "versions": result["versions"],
+            "user_ids": history.user_ids[positions] if history.user_ids is not None
+            else np.full(len(positions), None, dtype=object),
+        }, result["sketches"], result["model_ids"])
+        fitted = FittedModel.from_state(result["current"])
+        self.models.put(self._key(tank_id), fitted)
+        flags.model = fitted
+        self.metrics["scored"] += len(history)
+        self.metrics["flagged"] += len(flags)
+        flags.prune()
+        self._tanks[tank_id] = flags
+        self._save(tank_id)
+        return flags
+
+    def _catch_up(self, tank_id: str, flags: _TankFlags, history: TankSeries) -> None:
+        """Score readings stored after a history was read for scoring (call with the lock held)"""
+        if not len(history):
+            return
+        newer = self.loader(tank_id, from_epoch_us(int(history.timestamps[-1]) + 1))
+        if len(newer):
+            flags.merge(self._candidates(flags, flags.model, newer))
+            self._save(tank_id)
+
+    def _score(self, series_list: List[TankSeries]) -> None:
+        for series in series_list:
+            try:
+                if self._load(series.tank_id) is None:
+                    # A backfill reads the stored history, these readings included
+                    self._ensure(series.tank_id)
+                    continue
+                # Reading the training window, fitting on a registry miss and scoring
+                # all happen before the lock, so writers never wait on the forest
+                fitted = self._model(series.tank_id)
+                if fitted is None:
+                    continue
+                scores = fitted.score_samples(series.levels)
+                with self.lock:
+                    flags = self._tanks.get(series.tank_id)
+                    if flags is None:
+                        continue
+                    before = len(flags)
+                    flags.merge(self._candidates(flags, fitted, series, scores))
+                    if len(flags) != before:
+                        self._save(series.tank_id)
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logger.error(f"Error scoring readings of tank {series.tank_id}: {str(e)}")
+
+    def submit(self, series_list: List[TankSeries]) -> None:
+        """Queue freshly stored readings for scoring"""
+        series_list = [series for series in series_list if len(series)]
+        if series_list:
+            self._pending = self._executor.submit(self._score, series_list)
+
+    def wait(self) -> None:
+        """Wait until every reading submitted so far has been scored"""
+        pending = self._pending
+        if pending is not None:
+            pending.result()
+
+    def replace_range(self, tank_id: str, start_us: int, end_us: int, series: TankSeries) -> None:
+        """
+        Drop the flags within [start_us, end_us] of readings that are no longer stored (e.g. after retention)
+
+        Flags of readings that were kept are unchanged; readings put in their
+        place, such as downsampled means, are not scored.
+
+        Args:
+            tank_id: Tank whose history changed
+            start_us: Inclusive lower bound (epoch microseconds)
+            end_us: Inclusive upper bound (epoch microseconds)
+            series: Sorted readings now stored within the range
+        """
+        with self.lock:
+            flags = self._load(tank_id)
+            if flags is None:
+                return
+            timestamps = flags.columns["timestamps"]
+            lo = int(np.searchsorted(timestamps, start_us, side="left"))
+            hi = int(np.searchsorted(timestamps, end_us, side="right"))
+            keep = np.ones(len(timestamps), dtype=bool)
+            keep[lo:hi] = series.contains(timestamps[lo:hi], flags.columns["levels"][lo:hi])
+            if keep.all():
+                return
+            flags.columns = {name: values[keep] for name, values in flags.columns.items()}
+            flags.prune()
+            self._save(tank_id)
+
+    def invalidate(self, tank_id: str) -> None:
+        """Drop a tank's flags (e.g. after retention rewrote it) so they are rescored on next use"""
+        with self.lock:
+            self._tanks.pop(tank_id, None)
+            if os.path.exists(self._path(tank_id)):
+                os.remove(self._path(tank_id))
+
+    def rescore(self, tank_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Refit and rescore the whole history of many tanks, one job per tank
+
+        Histories are scored in parallel in the job pool without holding the
+        lock; readings stored while the jobs ran are scored on top once the
+        new flags are installed.
+
+        Args:
+            tank_ids: Tanks to rescore
+
+        Returns:
+            Per tank, the readings scored and flagged, or the error
+        """
+        histories = [self.loader(tank_id, None) for tank_id in tank_ids]
+        jobs = [self._job_args(history) for history in histories]
+        if self.jobs is None:
+            results = [score_history(*args) for args in jobs]
+        else:
+            results = self.jobs.map(score_history, jobs)
+
+        report = {}
+        with self.lock:
+            for tank_id, history, result in zip(tank_ids, histories, results):
+                if isinstance(result, Exception):
+                    self.metrics["errors"] += 1
+                    logger.error(f"Error rescoring tank {tank_id}: {str(result)}")
+                    report[tank_id] = {"error": str(result)}
+                    continue
+                flags = self._install(tank_id, history, result)
+                if flags is None:
+                    report[tank_id] = {"readings": len(history), "flagged": 0}
+                    continue
+                self._catch_up(tank_id, flags, history)
+                report[tank_id] = {"readings": len(history), "flagged": len(flags)}
+        return report
+
+    def query(self, tank_id: str, start_us: Optional[int], end_us: Optional[int],
+              sensitivity: float, user_id: Optional[str] = None) -> pd.DataFrame:
+        """
+        Get a tank's anomalies in a time range
+
+        Args:
+            tank_id: Tank to read
+            start_us: Optional inclusive lower bound (epoch microseconds)
+            end_us: Optional inclusive upper bound (epoch microseconds)
+            sensitivity: Expected proportion of anomalies, at most max_sensitivity
+            user_id: Optional owner; readings owned by other users are skipped
+
+        Returns:
+            DataFrame of the anomalies not marked as normal, with timestamp, level, is_anomaly and anomaly_score columns
+        """
+        flags = self._ensure(tank_id)
+        with self.lock:
+            if flags is None:
+                flags = _TankFlags()
+            timestamps = flags.columns["timestamps"]
+            lo = int(np.searchsorted(timestamps, start_us, side="left")) if start_us is not None else 0
+            hi = int(np.searchsorted(timestamps, end_us, side="right")) if end_us is not None else len(timestamps)
+            selected = {name: values[lo:hi] for name, values in flags.columns.items()}
+            sketches = list(flags.sketches)
+
+        # Threshold of each reading's own model, as IsolationForest would set offset_,
+        # interpolated from the sketches of just the versions in range
+        grid = np.linspace(0.0, self.max_sensitivity, SKETCH_POINTS)
+        versions, inverse = np.unique(selected["versions"], return_inverse=True)
+        thresholds = np.array([np.interp(sensitivity, grid, sketches[version]) for version in versions],
+                              dtype=np.float64)[inverse.reshape(-1)]
+        keep = selected["scores"] < thresholds
+        if user_id is not None:
+            keep &= pd.isnull(selected["user_ids"]) | (selected["user_ids"] == user_id)
+        if self.feedback is not None and keep.any():
+            # Readings marked as normal are not reported
+            positions = np.flatnonzero(keep)
+            keep[positions[self.feedback.mask(
+                tank_id, selected["timestamps"][positions], selected["levels"][positions]
+            )]] = False
+        return pd.DataFrame({
+            "timestamp": selected["timestamps"][keep].astype("datetime64[us]"),
+            "level": selected["levels"][keep].astype(np.float64),
+            "is_anomaly": np.ones(int(keep.sum()), dtype=bool),
+            "anomaly_score": selected["scores"][keep] - thresholds[keep],
+        })
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the configuration, flag counts and scoring metrics"""
+        with self.lock:
+            return {
+                "config": self.config,
+                "tanks": len(self._tanks),
+                "flags": sum(len(flags) for flags in self._tanks.values()),
+                **self.metrics,
+            }
@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_JOB_CONFIG = {
+    "workers": None  # worker processes for anomaly scoring (None: one per CPU, 0: score in-process)
+}
+
+
+class AnomalyJobExecutor:
+    """Process pool that model fitting and scoring jobs are fanned out to
+
+    Forests are fitted in worker processes, so neither the event loop nor the
+    request threads wait on the GIL while a fleet is rescored. Workers are
+    forked by start(), which must run before the API starts its background
+    threads; spawned workers would re-import main.py, which builds the whole
+    service at import time. With workers set to 0, jobs run in the calling
+    thread. Job functions and their arguments must be picklable.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """Initialize with overrides for DEFAULT_JOB_CONFIG"""
+        self.config = {**DEFAULT_JOB_CONFIG, **(config or {})}
+        workers = self.config["workers"]
+        self.workers = (os.cpu_count() or 1) if workers is None else int(workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.metrics = {"jobs": 0, "errors": 0, "last_batch_tanks": 0, "last_batch_ms": None}
+
+    def start(self) -> None:
+        """Fork the worker processes"""
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if self._pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("fork" if "fork" in methods else None)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                # A forking pool starts all of its workers with the first job
+                self._pool.submit(int).result()
+                logger.info(f"Started anomaly job pool with {self.workers} workers")
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """
+        Run a job in a worker process (in this thread if the pool is not started)
+
+        Args:
+            fn: Module-level job function
+            *args: Picklable arguments
+
+        Returns:
+            Future of the job's result
+        """
+        self.metrics["jobs"] += 1
+        if self._pool is not None:
+            return self._pool.submit(fn, *args)
+
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def map(self, fn: Callable, jobs: List[tuple]) -> List[Any]:
+        """
+        Run one job per argument tuple across the pool, in parallel
+
+        Args:
+            fn: Module-level job function
+            jobs: Argument tuples, one per job
+
+        Returns:
+            Results in job order; a failed job's result is its exception
+        """
+        started = time.perf_counter()
+        futures = [self.submit(fn, *args) for args in jobs]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                self.metrics["errors"] += 1
+                results.append(e)
+        self.metrics["last_batch_tanks"] = len(jobs)
+        self.metrics["last_batch_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return results
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the configuration, pool state and job metrics"""
+        return {"config": self.config, "workers": self.workers, "running": self._pool is not None, **self.metrics}
@@ -0,0 +1,250 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+import joblib
+import numpy as np
+from sklearn.ensemble import IsolationForest
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+MODEL_DIR = os.path.join("data", "anomaly_models")
+RANDOM_STATE = 42
+DEFAULT_MODEL_CONFIG = {
+    "refit_interval_s": 3600,   # refit models older than this
+    "refit_after_points": 100,  # ... or once this many readings arrived after the training window
+    "max_models": 256,          # fitted models kept in memory
+    "persist": True             # save rolling-window models under data/anomaly_models
+}
+
+# (tank_id or "*" for all tanks, owner or None, window such as "30d" or "<start>/<end>")
+ModelKey = Tuple[str, Optional[str], str]
+
+
+class FittedModel:
+    """An Isolation Forest fitted on one window plus its training scores
+
+    IsolationForest's contamination only sets offset_, the contamination
+    quantile of the training scores, so one fitted forest serves every
+    sensitivity: thresholds are re-derived from the stored training scores.
+    Scores depend only on the level, so they are cached per distinct level
+    and a request only scores levels not seen before.
+    """
+
+    def __init__(self, model: IsolationForest, train_scores: np.ndarray, trained_until_us: int):
+        self.model = model
+        self.train_scores = np.sort(train_scores)
+        self.trained_until_us = trained_until_us
+        self.fitted_at = time.time()
+        self._levels = np.empty(0, dtype=np.float64)  # sorted distinct levels already scored
+        self._scores = np.empty(0, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fit(cls, timestamps: np.ndarray, levels: np.ndarray) -> "FittedModel":
+        """Fit a forest on a window of readings"""
+        X = np.asarray(levels, dtype=np.float64).reshape(-1, 1)
+        model = IsolationForest(random_state=RANDOM_STATE)
+        model.fit(X)
+        scores = model.score_samples(X)
+        fitted = cls(model, scores, int(timestamps.max()))
+        fitted._remember(X[:, 0], scores)
+        return fitted
+
+    def _remember(self, levels: np.ndarray, scores: np.ndarray) -> None:
+        levels, first = np.unique(levels, return_index=True)
+        merged_levels = np.concatenate([self._levels, levels])
+        merged_scores = np.concatenate([self._scores, scores[first]])
+        merged_levels, first = np.unique(merged_levels, return_index=True)
+        self._levels = merged_levels
+        self._scores = merged_scores[first]
+
+    def threshold(self, contamination: float) -> float:
+        """Decision threshold for a contamination, as IsolationForest would set offset_"""
+        return float(np.percentile(self.train_scores, 100.0 * contamination))
+
+    def score_samples(self, levels: np.ndarray) -> np.ndarray:
+        """Score levels, running the forest only on levels without a cached score"""
+        levels = np.asarray(levels, dtype=np.float64)
+        with self._lock:
+            positions = np.searchsorted(self._levels, levels)
+            known = positions < len(self._levels)
+            known[known] = self._levels[positions[known]] == levels[known]
+            if not known.all():
+                missing = np.unique(levels[~known])
+                self._remember(missing, self.model.score_samples(missing.reshape(-1, 1)))
+                positions = np.searchsorted(self._levels, levels)
+            return self._scores[positions]
+
+    def state(self) -> Dict[str, Any]:
+        """Get what is persisted to disk"""
+        return {"model": self.model, "train_scores": self.train_scores,
+                "trained_until_us": self.trained_until_us, "fitted_at": self.fitted_at}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "FittedModel":
+        fitted = cls(state["model"], state["train_scores"], state["trained_until_us"])
+        fitted.fitted_at = state["fitted_at"]
+        return fitted
+
+
+class AnomalyModelRegistry:
+    """Fitted Isolation Forests keyed by (tank, owner, window)
+
+    The first request for a key fits a model (or loads it from disk); later
+    requests reuse it. A model older than refit_interval_s, or one that has
+    seen refit_after_points readings newer than its training window, keeps
+    serving while a single background worker refits it on the current
+    window. Rolling windows ("30d") are persisted with joblib so a restart
+    does not retrain every tank at once.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, root: str = MODEL_DIR):
+        """Initialize with overrides for DEFAULT_MODEL_CONFIG"""
+        self.config = {**DEFAULT_MODEL_CONFIG, **(config or {})}
+        self.root = root
+        self._models: "OrderedDict[ModelKey, FittedModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refitting = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="anomaly-refit")
+        self.metrics = {"hits": 0, "fits": 0, "refits": 0, "loads": 0, "last_fit_ms": None}
+
+    def _path(self, key: ModelKey) -> str:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, f"{digest}.joblib")
+
+    @staticmethod
+    def _persistent(key: ModelKey) -> bool:
+        # Absolute windows are rarely asked for twice; only rolling windows are saved
+        return "/" not in key[2]
+
+    def _save(self, key: ModelKey, fitted: FittedModel) -> None:
+        if not (self.config["persist"] and self._persistent(key)):
+            return
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            path = self._path(key)
+            joblib.dump(fitted.state(), path + ".tmp")
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.error(f"Error saving anomaly model {key}: {str(e)}")
+
+    def _fit(self, key: Optional[ModelKey], timestamps: np.ndarray, levels: np.ndarray) -> FittedModel:
+        started = time.perf_counter()
+        fitted = FittedModel.fit(timestamps, levels)
+        self.metrics["last_fit_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        if key is not None:
+            self._save(key, fitted)
+        return fitted
+
+    def _load(self, key: ModelKey) -> Optional[FittedModel]:
+        path = self._path(key)
+        if not (self.config["persist"] and self._persistent(key) and os.path.exists(path)):
+            return None
+        try:
+            fitted = FittedModel.from_state(joblib.load(path))
+        except Exception as e:
+            logger.warning(f"Could not load anomaly model {key}: {str(e)}")
+            return None
+        self.metrics["loads"] += 1
+        return fitted
+
+    def _store(self, key: ModelKey, fitted: FittedModel) -> None:
+        with self._lock:
+            self._models[key] = fitted
+            self._models.move_to_end(key)
+            while len(self._models) > self.config["max_models"]:
+                self._models.popitem(last=False)
+
+    def _is_stale(self, fitted: FittedModel, timestamps: np.ndarray) -> bool:
+        if time.time() - fitted.fitted_at > self.config["refit_interval_s"]:
+            return True
+        newer = int(np.count_nonzero(timestamps > fitted.trained_until_us))
+        return newer >= self.config["refit_after_points"]
+
+    def _refit_in_background(self, key: ModelKey, timestamps: np.ndarray, levels: np.ndarray) -> None:
+        with self._lock:
+            if key in self._refitting:
+                return
+            self._refitting.add(key)
+
+        def refit():
+            try:
+                self._store(key, self._fit(key, timestamps, levels))
+                self.metrics["refits"] += 1
+                logger.info(f"Refitted anomaly model {key} on {len(levels)} readings")
+            except Exception as e:
+                logger.error(f"Error refitting anomaly model {key}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refitting.discard(key)
+
+        self._executor.submit(refit)
+
+    def put(self, key: ModelKey, fitted: FittedModel) -> None:
+        """Install a model fitted elsewhere (e.g. in a worker process) under a key"""
+        self._save(key, fitted)
+        self._store(key, fitted)
+        self.metrics["fits"] += 1
+
+    def get_model(self, key: Optional[ModelKey], timestamps: np.ndarray, levels: np.ndarray) -> FittedModel:
+        """
+        Get a fitted model for a window, fitting or loading it on first use
+
+        Args:
+            key: Registry key, or None to fit a throwaway model
+            timestamps: Epoch microseconds of the window's readings
+            levels: Levels of the window's readings
+
+        Returns:
+            The fitted model
+        """
+        if key is None:
+            return self._fit(None, timestamps, levels)
+
+        with self._lock:
+            fitted = self._models.get(key)
+            if fitted is not None:
+                self._models.move_to_end(key)
+        if fitted is None:
+            fitted = self._load(key)
+            if fitted is None:
+                fitted = self._fit(key, timestamps, levels)
+                self.metrics["fits"] += 1
+            self._store(key, fitted)
+        else:
+            self.metrics["hits"] += 1
+
+        if self._is_stale(fitted, timestamps):
+            self._refit_in_background(key, timestamps.copy(), np.array(levels, dtype=np.float64))
+        return fitted
+
+    def decision_function(self, key: Optional[ModelKey], timestamps: np.ndarray, levels: np.ndarray,
+                          contamination: float) -> np.ndarray:
+        """
+        Score a window like IsolationForest(contamination=...).decision_function
+
+        Args:
+            key: Registry key, or None to fit a throwaway model
+            timestamps: Epoch microseconds of the readings
+            levels: Levels of the readings
+            contamination: Expected proportion of anomalies (the sensitivity)
+
+        Returns:
+            Scores; negative means anomalous
+        """
+        fitted = self.get_model(key, timestamps, levels)
+        return fitted.score_samples(levels) - fitted.threshold(contamination)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the configuration, model count and cache metrics"""
+        with self._lock:
+            return {"config": self.config, "models": len(self._models),
+                    "refitting": len(self._refitting), **self.metrics}
@@ -0,0 +1,261 @@
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from dateutil import tz
+from tank_storage import TankSeries
+
+# pyarrow is only needed for Parquet import
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+MAX_BATCH_READINGS = 100000
+MAX_REPORTED_ERRORS = 100
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+TIMEZONE_SUFFIX = r"(?:Z|[+-]\d{2}:?\d{2})$"
+
+
+class BatchError(ValueError):
+    """Raised when a batch body cannot be parsed at all"""
+
+
+def parse_batch(body: bytes, content_type: Optional[str] = None) -> List[Any]:
+    """
+    Parse a batch request body
+
+    Args:
+        body: Raw request body
+        content_type: Request content type; NDJSON types are parsed line by line,
+            anything else as a JSON array (or an object with a "readings" array)
+
+    Returns:
+        List of reading objects (not yet validated)
+    """
+    text = body.decode("utf-8")
+    media_type = (content_type or "").split(";")[0].strip().lower()
+
+    try:
+        if media_type in NDJSON_CONTENT_TYPES:
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise BatchError(f"Invalid JSON: {str(e)}")
+
+    if isinstance(data, dict) and isinstance(data.get("readings"), list):
+        return data["readings"]
+    if not isinstance(data, list):
+        raise BatchError("Expected a JSON array of readings")
+    return data
+
+
+def _parse_timestamps(values: pd.Series, now: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse ISO-8601 timestamps into epoch microseconds in one pass per kind
+
+    Naive timestamps are local time, like everywhere else in the service;
+    timestamps with an offset are converted to local time. Missing timestamps
+    default to now.
+
+    Returns:
+        Tuple of (int64 epoch microseconds, validity mask)
+    """
+    result = np.zeros(len(values), dtype=np.int64)
+    valid = np.zeros(len(values), dtype=bool)
+
+    missing = values.isna().to_numpy()
+    result[missing] = np.datetime64(now, "us").astype(np.int64)
+    valid[missing] = True
+
+    text = values.where(~missing).astype("string")
+    aware = text.str.contains(TIMEZONE_SUFFIX, regex=True, na=False).to_numpy()
+    naive = ~missing & ~aware
+
+    if naive.any():
+        parsed = pd.to_datetime(text[naive], format="ISO8601", errors="coerce")
+        ok = parsed.notna().to_numpy()
+        result[np.flatnonzero(naive)[ok]] = parsed[ok].to_numpy().astype("datetime64[us]").astype(np.int64)
+        valid[np.flatnonzero(naive)[ok]] = True
+
+    if aware.any():
+        parsed = pd.to_datetime(text[aware], format="ISO8601", errors="coerce", utc=True)
+        ok = parsed.notna().to_numpy()
+        local = parsed[ok].dt.tz_convert(tz.tzlocal()).dt.tz_localize(None)
+        result[np.flatnonzero(aware)[ok]] = local.to_numpy().astype("datetime64[us]").astype(np.int64)
+        valid[np.flatnonzero(aware)[ok]] = True
+
+    return result, valid
+
+
+def validate_batch(items: List[Any], default_tank_id: str,
+                   user_id: Optional[str] = None) -> Tuple[List[TankSeries], List[Dict[str, Any]]]:
+    """
+    Validate a batch of readings column by column and group them by tank
+
+    Args:
+        items: Parsed reading objects with 'level' and optional 'tank_id' and 'timestamp'
+        default_tank_id: Tank used when a reading has no tank_id
+        user_id: Owner recorded on every accepted reading
+
+    Returns:
+        Tuple of (one sorted TankSeries per tank, errors as {index, error} dicts)
+    """
+    errors: List[Dict[str, Any]] = []
+    if not items:
+        return [], errors
+
+    is_object = np.fromiter((isinstance(item, dict) for item in items), dtype=bool, count=len(items))
+    frame = pd.DataFrame.from_records(
+        [item if isinstance(item, dict) else {} for item in items],
+        columns=["tank_id", "timestamp", "level"],
+    )
+
+    levels = pd.to_numeric(frame["level"], errors="coerce").to_numpy(dtype=np.float64)
+    level_ok = np.isfinite(levels)
+
+    tank_ids = frame["tank_id"].where(frame["tank_id"].notna(), default_tank_id).astype(str).str.strip()
+    tank_ok = (tank_ids != "").to_numpy()
+
+    timestamps, timestamp_ok = _parse_timestamps(frame["timestamp"], datetime.now())
+
+    valid = is_object & level_ok & tank_ok & timestamp_ok
+    for index in np.flatnonzero(~valid)[:MAX_REPORTED_ERRORS]:
+        if not is_object[index]:
+            message = "reading must be an object"
+        elif not level_ok[index]:
+            message = "level must be a finite number"
+        elif not tank_ok[index]:
+            message = "tank_id must not be empty"
+        else:
+            message = "timestamp must be an ISO-8601 date-time"
+        errors.append({"index": int(index), "error": message})
+
+    owners = np.full(int(valid.sum()), user_id, dtype=object) if user_id is not None else None
+    series_list = _group_by_tank(tank_ids.to_numpy(dtype=object)[valid], timestamps[valid],
+                                 levels[valid].astype(np.float32), owners)
+    return series_list, errors
+
+
+def _group_by_tank(tank_ids: np.ndarray, timestamps: np.ndarray, levels: np.ndarray,
+                   user_ids: Optional[np.ndarray]) -> List[TankSeries]:
+    """Split validated columns into one timestamp-sorted TankSeries per tank"""
+    if not len(tank_ids):
+        return []
+    # One stable sort by (tank, timestamp), then cut where the tank changes
+    codes, names = pd.factorize(tank_ids)
+    order = np.lexsort((timestamps, codes))
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    series_list = []
+    for positions in np.split(order, bounds):
+        series_list.append(TankSeries(
+            names[codes[positions[0]]],
+            timestamps[positions],
+            levels[positions],
+            user_ids[positions] if user_ids is not None else None,
+        ))
+    return series_list
+
+
+def parquet_row_count(body: bytes) -> int:
+    """
+    Get the number of rows in a Parquet file from its footer, without decoding any column
+
+    Args:
+        body: Parquet file contents
+
+    Returns:
+        Number of rows in the file
+    """
+    if pq is None:
+        raise RuntimeError("pyarrow is required for Parquet import")
+    try:
+        return pq.ParquetFile(pa.BufferReader(body)).metadata.num_rows
+    except (pa.ArrowInvalid, OSError) as e:
+        raise BatchError(f"Invalid Parquet file: {str(e)}")
+
+
+def parse_parquet(body: bytes, default_tank_id: str, user_id: Optional[str] = None,
+                  keep_owners: bool = False) -> Tuple[List[TankSeries], List[Dict[str, Any]], int]:
+    """
+    Read a Parquet file of readings column by column and group them by tank
+
+    The file needs timestamp and level columns; tank_id and user_id are
+    optional. Files written by the Parquet export can be imported unchanged.
+
+    Args:
+        body: Parquet file contents
+        default_tank_id: Tank used when the file has no tank_id column or a row has none
+        user_id: Owner recorded on every accepted reading
+        keep_owners: Keep the file's user_id column instead (admin restores)
+
+    Returns:
+        Tuple of (one sorted TankSeries per tank, errors as {index, error} dicts,
+        number of rows in the file)
+    """
+    if pq is None:
+        raise RuntimeError("pyarrow is required for Parquet import")
+
+    try:
+        table = pq.read_table(pa.BufferReader(body))
+    except (pa.ArrowInvalid, OSError) as e:
+        raise BatchError(f"Invalid Parquet file: {str(e)}")
+    missing = [name for name in ("timestamp", "level") if name not in table.column_names]
+    if missing:
+        raise BatchError(f"Parquet file is missing columns: {', '.join(missing)}")
+
+    count = table.num_rows
+    levels = pd.to_numeric(table.column("level").to_pandas(), errors="coerce").to_numpy(dtype=np.float64)
+    level_ok = np.isfinite(levels)
+
+    if "tank_id" in table.column_names:
+        tank_ids = table.column("tank_id").to_pandas().astype(object)
+        tank_ids = tank_ids.where(tank_ids.notna(), default_tank_id).astype(str).str.strip()
+    else:
+        tank_ids = pd.Series(np.full(count, default_tank_id, dtype=object))
+    tank_ok = (tank_ids != "").to_numpy()
+
+    column = table.column("timestamp").to_pandas()
+    if pd.api.types.is_datetime64_any_dtype(column):
+        if column.dt.tz is not None:
+            column = column.dt.tz_convert(tz.tzlocal()).dt.tz_localize(None)
+        timestamp_ok = column.notna().to_numpy()
+        timestamps = column.to_numpy().astype("datetime64[us]").astype(np.int64)
+    else:
+        timestamps, timestamp_ok = _parse_timestamps(column.astype(object), datetime.now())
+        timestamp_ok &= column.notna().to_numpy()
+
+    valid = level_ok & tank_ok & timestamp_ok
+    errors: List[Dict[str, Any]] = []
+    for index in np.flatnonzero(~valid)[:MAX_REPORTED_ERRORS]:
+        if not level_ok[index]:
+            message = "level must be a finite number"
+        elif not tank_ok[index]:
+            message = "tank_id must not be empty"
+        else:
+            message = "timestamp must be a date-time"
+        errors.append({"index": int(index), "error": message})
+
+    if keep_owners and "user_id" in table.column_names:
+        owners = table.column("user_id").to_pandas().astype(object)
+        owners = owners.where(owners.notna(), None).to_numpy(dtype=object)[valid]
+        if all(owner is None for owner in owners):
+            owners = None
+    elif user_id is not None:
+        owners = np.full(int(valid.sum()), user_id, dtype=object)
+    else:
+        owners = None
+
+    series_list = _group_by_tank(tank_ids.to_numpy(dtype=object)[valid], timestamps[valid],
+                                 levels[valid].astype(np.float32), owners)
+    return series_list, errors, count
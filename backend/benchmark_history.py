@@ -0,0 +1,119 @@
+"""
+Benchmark tank history read latency for the JSON, segment and binary formats.
+
+Generates 1 year and 10 years of hourly readings for one tank in a scratch
+directory and measures how long a `days=N` read takes:
+
+- cold: first read from a freshly opened store
+- warm: median of repeated reads from the same store
+
+Usage:
+    python benchmark_history.py [--years 1 10] [--days 7 30 365] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, List
+import numpy as np
+from tank_storage import SegmentedTankStore
+from binary_history import BinaryHistoryStore
+
+
+def generate_readings(years: int, tank_id: str = "tank1") -> List[Dict[str, Any]]:
+    """Generate hourly readings ending now, oldest first"""
+    hours = years * 365 * 24
+    now = datetime.now().replace(microsecond=0)
+    offsets = np.arange(hours, 0, -1)
+    levels = 5.0 + np.sin(2 * np.pi * offsets / (365 * 24)) + np.random.normal(0, 0.2, hours)
+    return [
+        {"timestamp": now - timedelta(hours=int(offset)), "level": float(level), "tank_id": tank_id}
+        for offset, level in zip(offsets, levels)
+    ]
+
+
+def read_legacy_json(path: str, days: int) -> int:
+    """The original read path: json.load, parse every timestamp, filter in Python"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    for item in data:
+        item["timestamp"] = datetime.fromisoformat(item["timestamp"])
+    cutoff_date = datetime.now() - timedelta(days=days)
+    return len([item for item in data if item["timestamp"] >= cutoff_date])
+
+
+def time_reads(open_store: Callable[[], Any], read: Callable[[Any, int], int],
+               days: int, repeat: int) -> Dict[str, float]:
+    """Time one cold read and `repeat` warm reads, in milliseconds"""
+    start = time.perf_counter()
+    store = open_store()
+    read(store, days)
+    cold = (time.perf_counter() - start) * 1000
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read(store, days)
+        warm.append((time.perf_counter() - start) * 1000)
+
+    return {"cold_ms": cold, "warm_ms": statistics.median(warm)}
+
+
+def run(years_list: List[int], days_list: List[int], repeat: int) -> None:
+    print(f"{'years':>5} {'days':>5} {'format':>8} {'cold ms':>10} {'warm ms':>10} {'bytes':>12}")
+
+    for years in years_list:
+        workdir = tempfile.mkdtemp(prefix="tank_bench_")
+        try:
+            readings = generate_readings(years)
+
+            json_path = os.path.join(workdir, "tank_levels.json")
+            with open(json_path, 'w') as f:
+                json.dump([{**item, "timestamp": item["timestamp"].isoformat()} for item in readings], f, indent=2)
+
+            segments_dir = os.path.join(workdir, "segments")
+            segment_store = SegmentedTankStore(segments_dir)
+            segment_store.append(readings)
+            segment_store.close()
+
+            binary_dir = os.path.join(workdir, "binary")
+            BinaryHistoryStore(binary_dir).append(readings)
+
+            formats = {
+                "json": (lambda: json_path, read_legacy_json, os.path.getsize(json_path)),
+                "segments": (
+                    lambda: SegmentedTankStore(segments_dir),
+                    lambda store, days: len(store.read_series("tank1", datetime.now() - timedelta(days=days))),
+                    _dir_size(segments_dir),
+                ),
+                "binary": (
+                    lambda: BinaryHistoryStore(binary_dir),
+                    lambda store, days: len(store.read_series("tank1", datetime.now() - timedelta(days=days))),
+                    _dir_size(binary_dir),
+                ),
+            }
+
+            for days in days_list:
+                for name, (open_store, read, size) in formats.items():
+                    result = time_reads(open_store, read, days, repeat)
+                    print(f"{years:>5} {days:>5} {name:>8} {result['cold_ms']:>10.2f} "
+                          f"{result['warm_ms']:>10.2f} {size:>12}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tank history read latency")
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--days", type=int, nargs="+", default=[7, 30, 365])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.years, args.days, args.repeat)
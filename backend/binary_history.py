@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterable, Set
+import numpy as np
+import pandas as pd
+from tank_storage import (
+    DATA_DIR, TankStorage, TankSeries, SegmentedTankStore, encode_tank_id, decode_tank_id,
+    to_epoch_us, from_epoch_us, directory_size, fsync_path, rename_legacy_names
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+BINARY_DIR = os.path.join(DATA_DIR, "binary")
+BINARY_SUFFIX = ".bin"
+OWNERS_FILE = "owners.json"
+
+# Fixed-width 16 byte record: epoch microseconds, level, owner code (0 = no user_id)
+RECORD_DTYPE = np.dtype([("timestamp", "<i8"), ("level", "<f4"), ("owner", "<i4")])
+
+
+class BinaryHistoryStore(TankStorage):
+    """Tank history stored as fixed-width binary records, one file per tank
+
+    Files are kept sorted by timestamp and read through numpy.memmap, so a
+    time range is located with a binary search and returned as a view without
+    parsing anything.
+    """
+
+    def __init__(self, root: str = BINARY_DIR):
+        """Initialize the store and recover any torn trailing record"""
+        self.root = root
+        self._lock = threading.RLock()
+        self._maps: Dict[str, np.memmap] = {}
+        self._unsynced: Set[str] = set()  # tank files appended to since the last sync
+
+        os.makedirs(self.root, exist_ok=True)
+        rename_legacy_names(self.root, BINARY_SUFFIX)
+        self._owners_path = os.path.join(self.root, OWNERS_FILE)
+        self._owner_names: List[Optional[str]] = [None]
+        if os.path.exists(self._owners_path):
+            with open(self._owners_path, 'r') as f:
+                self._owner_names = [None] + json.load(f)
+        self._owner_codes = {name: code for code, name in enumerate(self._owner_names) if name is not None}
+
+        self._recover()
+
+    def _path(self, tank_id: str) -> str:
+        return os.path.join(self.root, f"{encode_tank_id(tank_id)}{BINARY_SUFFIX}")
+
+    def _recover(self) -> None:
+        """Truncate files whose size is not a whole number of records"""
+        for tank_id in self.tank_ids():
+            path = self._path(tank_id)
+            size = os.path.getsize(path)
+            whole = size - size % RECORD_DTYPE.itemsize
+            if whole != size:
+                logger.warning(f"Truncating incomplete record at offset {whole} in {path}")
+                with open(path, 'r+b') as f:
+                    f.truncate(whole)
+
+    def _encode_owner(self, user_id: Optional[str]) -> int:
+        if user_id is None:
+            return 0
+        code = self._owner_codes.get(user_id)
+        if code is None:
+            code = len(self._owner_names)
+            self._owner_names.append(user_id)
+            self._owner_codes[user_id] = code
+            # Records written after this refer to the new code, so it must reach disk first
+            _replace_durably(self._owners_path, json.dumps(self._owner_names[1:]).encode("utf-8"))
+        return code
+
+    def _map(self, tank_id: str) -> Optional[np.ndarray]:
+        """Get a read-only memory map of a tank's records"""
+        records = self._maps.get(tank_id)
+        if records is not None:
+            return records
+
+        path = self._path(tank_id)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r')
+        self._maps[tank_id] = records
+        return records
+
+    def tank_ids(self) -> List[str]:
+        """Get the IDs of all tanks with stored history"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            decode_tank_id(name[:-len(BINARY_SUFFIX)]) for name in os.listdir(self.root)
+            if name.endswith(BINARY_SUFFIX)
+        )
+
+    def is_empty(self) -> bool:
+        """Check whether any readings have been stored"""
+        return not any(os.path.getsize(self._path(tank_id)) for tank_id in self.tank_ids())
+
+    def last_timestamp(self, tank_id: str) -> Optional[datetime]:
+        """Get the timestamp of the newest reading stored for a tank"""
+        with self._lock:
+            records = self._map(tank_id)
+            if records is None:
+                return None
+            return from_epoch_us(records["timestamp"][-1])
+
+    def first_timestamp(self, tank_id: str) -> Optional[datetime]:
+        """Get the timestamp of the oldest reading stored for a tank"""
+        with self._lock:
+            records = self._map(tank_id)
+            if records is None:
+                return None
+            return from_epoch_us(records["timestamp"][0])
+
+    def append(self, readings: Iterable[Dict[str, Any]]) -> int:
+        """
+        Append readings to their tank files
+
+        Args:
+            readings: Readings with 'timestamp', 'level' and 'tank_id' keys
+
+        Returns:
+            Number of readings written
+        """
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for item in readings:
+            grouped.setdefault(str(item.get("tank_id", "tank1")), []).append(item)
+
+        written = 0
+        with self._lock:
+            for tank_id, items in grouped.items():
+                new = np.empty(len(items), dtype=RECORD_DTYPE)
+                for i, item in enumerate(items):
+                    timestamp = item["timestamp"]
+                    if isinstance(timestamp, str):
+                        timestamp = datetime.fromisoformat(timestamp)
+                    new[i] = (to_epoch_us(timestamp), float(item["level"]), self._encode_owner(item.get("user_id")))
+                written += self.append_records(tank_id, new)
+
+        return written
+
+    def append_series(self, series_list: List[TankSeries]) -> int:
+        """Append columnar batches straight into records, without building dicts"""
+        written = 0
+        with self._lock:
+            for series in series_list:
+                records = np.empty(len(series), dtype=RECORD_DTYPE)
+                records["timestamp"] = series.timestamps
+                records["level"] = series.levels
+                records["owner"] = 0
+                if series.user_ids is not None:
+                    # Unowned readings keep code 0; only real owners get an entry in owners.json
+                    present = ~pd.isnull(series.user_ids)
+                    owners, codes = np.unique(series.user_ids[present], return_inverse=True)
+                    table = np.array([self._encode_owner(owner) for owner in owners], dtype=np.int32)
+                    records["owner"][present] = table[codes]
+                written += self.append_records(series.tank_id, records)
+        return written
+
+    def append_records(self, tank_id: str, new: np.ndarray) -> int:
+        """Append an array of RECORD_DTYPE records to a tank file"""
+        if len(new) == 0:
+            return 0
+
+        with self._lock:
+            new = np.sort(new, order="timestamp", kind="stable")
+            existing = self._map(tank_id)
+            path = self._path(tank_id)
+            self._maps.pop(tank_id, None)
+
+            if existing is None or new["timestamp"][0] >= existing["timestamp"][-1]:
+                # Fast path: records stay sorted, so just append the bytes
+                with open(path, 'ab') as f:
+                    f.write(new.tobytes())
+                self._unsynced.add(path)
+            else:
+                # Back-filled records: rewrite the file in sorted order
+                merged = np.concatenate([np.asarray(existing), new])
+                merged = np.sort(merged, order="timestamp", kind="stable")
+                del existing
+                _replace_durably(path, merged.tobytes())
+
+        return len(new)
+
+    def rewrite(self, tank_id: str, series: TankSeries) -> None:
+        """Replace a tank file atomically"""
+        records = np.empty(len(series), dtype=RECORD_DTYPE)
+        records["timestamp"] = series.timestamps
+        records["level"] = series.levels
+        records["owner"] = 0
+
+        with self._lock:
+            if series.user_ids is not None:
+                records["owner"] = [self._encode_owner(user_id) for user_id in series.user_ids]
+
+            path = self._path(tank_id)
+            self._maps.pop(tank_id, None)
+            _replace_durably(path, records.tobytes())
+
+    def sync(self) -> None:
+        """Fsync every tank file appended to since the last sync"""
+        with self._lock:
+            paths, self._unsynced = self._unsynced, set()
+            for path in paths:
+                fsync_path(path)
+
+    def storage_bytes(self) -> int:
+        """Get the total size of the tank files"""
+        return directory_size(self.root)
+
+    def tank_bytes(self, tank_id: str) -> int:
+        """Get the size of one tank file"""
+        path = self._path(tank_id)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def close(self) -> None:
+        """Release memory maps"""
+        with self._lock:
+            self._maps = {}
+
+    def read_series(self, tank_id: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, user_id: Optional[str] = None) -> TankSeries:
+        """Read a time range of one tank as views over the memory map"""
+        with self._lock:
+            records = self._map(tank_id)
+        if records is None:
+            return TankSeries.empty(tank_id)
+
+        timestamps = records["timestamp"]
+        lo = int(np.searchsorted(timestamps, to_epoch_us(start), side="left")) if start else 0
+        hi = int(np.searchsorted(timestamps, to_epoch_us(end), side="right")) if end else len(records)
+        window = records[lo:hi]
+
+        user_ids = None
+        owners = window["owner"]
+        if len(self._owner_names) > 1 and owners.any():
+            user_ids = np.asarray(self._owner_names, dtype=object)[owners]
+
+        return TankSeries(tank_id, window["timestamp"], window["level"], user_ids).owned_by(user_id)
+
+
+def _replace_durably(path: str, data: bytes) -> None:
+    """Write a file's new contents beside it, fsync them, then rename it into place"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def migrate_json_file(json_path: str, store: BinaryHistoryStore) -> int:
+    """
+    Convert a legacy tank_levels.json array into binary tank files
+
+    Args:
+        json_path: Path to the JSON array file
+        store: Destination store
+
+    Returns:
+        Number of readings converted
+    """
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    count = store.append(data)
+    logger.info(f"Converted {count} readings from {json_path}")
+    return count
+
+
+def migrate_segment_store(segments: SegmentedTankStore, store: BinaryHistoryStore) -> int:
+    """
+    Convert every tank in a segment store into binary tank files
+
+    Args:
+        segments: Source segment store
+        store: Destination store
+
+    Returns:
+        Number of readings converted
+    """
+    count = 0
+    for tank_id in segments.tank_ids():
+        count += store.append(segments.read(tank_id))
+    logger.info(f"Converted {count} readings from segment store {segments.root}")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert tank history to the binary memory-mapped format")
+    parser.add_argument("--json", help="Legacy tank_levels.json file to convert")
+    parser.add_argument("--segments", help="Segment store directory to convert")
+    parser.add_argument("--output", default=BINARY_DIR, help="Destination directory")
+    args = parser.parse_args()
+
+    destination = BinaryHistoryStore(args.output)
+    if not destination.is_empty():
+        parser.error(f"Destination {args.output} already contains history")
+
+    if args.json:
+        migrate_json_file(args.json, destination)
+    elif args.segments:
+        migrate_segment_store(SegmentedTankStore(args.segments), destination)
+    else:
+        segment_store = SegmentedTankStore()
+        legacy_file = os.path.join(DATA_DIR, "tank_levels.json")
+        if segment_store.is_empty() and os.path.exists(legacy_file):
+            migrate_json_file(legacy_file, destination)
+        else:
+            migrate_segment_store(segment_store, destination)
@@ -0,0 +1,117 @@
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+import numpy as np
+from tank_storage import TankSeries
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_DEDUP_CONFIG = {
+    "enabled": True,
+    "include_value": False,     # also require the same level for a reading to count as a duplicate
+    "index_size": 4096,         # recent keys remembered per tank
+    "deadband": None,           # drop readings within this distance of the last kept level (None: off)
+    "deadband_window_s": 300    # ... unless this long has passed since it, so a heartbeat is still kept
+}
+
+
+class _TankIndex:
+    """Recent reading keys and the last kept reading of one tank"""
+
+    __slots__ = ("keys", "last_timestamp", "last_level")
+
+    def __init__(self):
+        self.keys: Dict[Any, None] = {}  # insertion-ordered, oldest first
+        self.last_timestamp: Optional[int] = None
+        self.last_level: Optional[float] = None
+
+
+class ReadingDeduplicator:
+    """Drops repeated and unchanged readings before they are stored
+
+    A reading is a duplicate when the same (tank_id, timestamp) - or with
+    include_value, (tank_id, timestamp, level) - was seen among the tank's
+    last index_size readings, which catches MQTT QoS 1 redeliveries and
+    overlapping polls of the same source. With a deadband, a reading whose
+    level is within deadband of the last kept one is also dropped, unless
+    deadband_window_s has passed since that reading; values that sit still
+    collapse to one reading per window and any real change still gets through.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """Initialize with overrides for DEFAULT_DEDUP_CONFIG"""
+        self.config = {**DEFAULT_DEDUP_CONFIG, **(config or {})}
+        self._lock = threading.Lock()
+        self._tanks: Dict[str, _TankIndex] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config.get("enabled", True))
+
+    def filter(self, series: TankSeries) -> Tuple[TankSeries, int, int]:
+        """
+        Remove duplicate and deadband-suppressed readings from a sorted series
+
+        Args:
+            series: One tank's readings, sorted by timestamp
+
+        Returns:
+            Tuple of (kept readings, duplicates dropped, readings suppressed by the deadband)
+        """
+        if not len(series):
+            return series, 0, 0
+
+        index_size = self.config["index_size"]
+        include_value = self.config["include_value"]
+        deadband = self.config["deadband"]
+        window_us = int(self.config["deadband_window_s"] * 1_000_000)
+
+        timestamps = series.timestamps.tolist()
+        levels = series.levels.tolist()
+        keep = np.ones(len(timestamps), dtype=bool)
+        duplicates = 0
+        suppressed = 0
+
+        with self._lock:
+            state = self._tanks.get(series.tank_id)
+            if state is None:
+                state = self._tanks[series.tank_id] = _TankIndex()
+            keys = state.keys
+
+            for position, (timestamp, level) in enumerate(zip(timestamps, levels)):
+                key = (timestamp, level) if include_value else timestamp
+                if key in keys:
+                    keep[position] = False
+                    duplicates += 1
+                    continue
+
+                if (deadband is not None and state.last_timestamp is not None and
+                        state.last_timestamp <= timestamp < state.last_timestamp + window_us and
+                        abs(level - state.last_level) <= deadband):
+                    keep[position] = False
+                    suppressed += 1
+                    continue
+
+                keys[key] = None
+                if len(keys) > index_size:
+                    del keys[next(iter(keys))]
+                if state.last_timestamp is None or timestamp >= state.last_timestamp:
+                    state.last_timestamp = timestamp
+                    state.last_level = level
+
+        if keep.all():
+            return series, 0, 0
+        user_ids = series.user_ids[keep] if series.user_ids is not None else None
+        return TankSeries(series.tank_id, series.timestamps[keep], series.levels[keep], user_ids), duplicates, suppressed
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the configuration and index sizes"""
+        with self._lock:
+            return {
+                "config": self.config,
+                "tanks": len(self._tanks),
+                "indexed_keys": sum(len(state.keys) for state in self._tanks.values()),
+            }
@@ -0,0 +1,82 @@
+import logging
+import numpy as np
+from tank_storage import TankSeries
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+DOWNSAMPLE_METHODS = ["lttb"]
+DEFAULT_POINTS = 800
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Select points with Largest-Triangle-Three-Buckets
+
+    The first and last points are always kept. The rest of the series is split
+    into points - 2 equal buckets and, from each one, the point forming the
+    largest triangle with the previously kept point and the next bucket's mean
+    is kept. Spikes form large triangles, so they survive downsampling.
+
+    Args:
+        x: Sorted x values (e.g. epoch microseconds)
+        y: Values aligned with x
+        points: Number of points to keep
+
+    Returns:
+        Sorted indices of the kept points
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket edges over the interior points 1 .. n-2
+    edges = (np.arange(points - 1) * (n - 2) / (points - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    # Mean of every bucket, with the last point standing in after the final bucket
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    mean_x = np.append(mean_x[1:], x[-1])
+    mean_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        # Twice the triangle area for every candidate in the bucket at once
+        areas = np.abs(
+            (x[previous] - mean_x[bucket]) * (y[lo:hi] - y[previous])
+            - (x[previous] - x[lo:hi]) * (mean_y[bucket] - y[previous])
+        )
+        previous = lo + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return selected
+
+
+def downsample_series(series: TankSeries, points: int = DEFAULT_POINTS) -> TankSeries:
+    """
+    Downsample a tank series with LTTB
+
+    Args:
+        series: Sorted tank history
+        points: Number of points to keep
+
+    Returns:
+        TankSeries holding the selected readings
+    """
+    if len(series) <= points:
+        return series
+
+    keep = lttb_indices(series.timestamps, series.levels, points)
+    user_ids = series.user_ids[keep] if series.user_ids is not None else None
+    return TankSeries(series.tank_id, series.timestamps[keep], series.levels[keep], user_ids)
@@ -0,0 +1,185 @@
+"""
+Gorilla-style compression for blocks of tank readings.
+
+Timestamps are stored as zigzag-encoded delta-of-deltas and float32 levels as
+the XOR with the previous level, following Facebook's Gorilla paper. Regular
+sampling makes most delta-of-deltas zero and slowly changing levels share
+sign, exponent and high mantissa bits, so both shrink to a few bits per point.
+
+Unlike the paper's single interleaved bit stream, control bits and payload
+bits are kept in separate streams. Every control field has a fixed width, so
+payload offsets come from a cumulative sum and whole blocks encode and decode
+with NumPy instead of a per-point Python loop.
+
+Block layout (little endian):
+    magic "TKG1" | point count u32 | 6 section lengths u32 | sections
+Sections:
+    1. timestamp classes: 3 bits per point indexing DOD_WIDTHS
+    2. timestamp payload: zigzag delta-of-delta, DOD_WIDTHS[class] bits each
+    3. level flags: 1 bit per point, set when the XOR is non-zero
+    4. level headers: 10 bits per non-zero XOR (5 leading zeros, 5 length - 1)
+    5. level payload: the meaningful XOR bits
+    6. owners: JSON list of [start index, user_id] runs (empty when unowned)
+"""
+import json
+import struct
+from typing import List, Optional, Tuple
+import numpy as np
+
+# Constants
+MAGIC = b"TKG1"
+HEADER = struct.Struct("<4sI6I")
+DOD_WIDTHS = np.array([0, 7, 9, 12, 16, 24, 32, 64], dtype=np.int64)
+DOD_CLASS_BITS = 3
+LEVEL_HEADER_BITS = 10
+
+
+def _pack_bits(values: np.ndarray, widths: np.ndarray) -> bytes:
+    """Concatenate the low `widths[i]` bits of each value, most significant first"""
+    total = int(widths.sum())
+    if total == 0:
+        return b""
+    values = values.astype(np.uint64)
+    offsets = np.cumsum(widths) - widths
+    bits = np.zeros(total, dtype=np.uint8)
+
+    # One vectorized scatter per distinct width (at most a handful)
+    for width in np.unique(widths):
+        if width == 0:
+            continue
+        selected = widths == width
+        shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+        positions = offsets[selected][:, None] + np.arange(width)[None, :]
+        bits[positions] = (values[selected][:, None] >> shifts[None, :]) & np.uint64(1)
+
+    return np.packbits(bits).tobytes()
+
+
+def _unpack_bits(data: bytes, widths: np.ndarray) -> np.ndarray:
+    """Inverse of _pack_bits"""
+    values = np.zeros(len(widths), dtype=np.uint64)
+    if int(widths.sum()) == 0:
+        return values
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).astype(np.uint64)
+    offsets = np.cumsum(widths) - widths
+
+    for width in np.unique(widths):
+        if width == 0:
+            continue
+        selected = widths == width
+        shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+        positions = offsets[selected][:, None] + np.arange(width)[None, :]
+        values[selected] = np.bitwise_or.reduce(bits[positions] << shifts[None, :], axis=1)
+
+    return values
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Number of significant bits of each non-negative integer (may round up above 2**53)"""
+    return np.frexp(values.astype(np.float64))[1].astype(np.int64)
+
+
+def _encode_owner_runs(user_ids: Optional[np.ndarray]) -> bytes:
+    if user_ids is None:
+        return b""
+    runs: List[list] = []
+    previous = object()
+    for i, user_id in enumerate(user_ids):
+        if user_id != previous:
+            runs.append([i, user_id])
+            previous = user_id
+    if all(user_id is None for _, user_id in runs):
+        return b""
+    return json.dumps(runs, separators=(",", ":")).encode("utf-8")
+
+
+def _decode_owner_runs(data: bytes, count: int) -> Optional[np.ndarray]:
+    if not data:
+        return None
+    runs = json.loads(data)
+    user_ids = np.empty(count, dtype=object)
+    bounds = [start for start, _ in runs[1:]] + [count]
+    for (start, user_id), end in zip(runs, bounds):
+        user_ids[start:end] = user_id
+    return user_ids
+
+
+def encode_block(timestamps: np.ndarray, levels: np.ndarray, user_ids: Optional[np.ndarray] = None) -> bytes:
+    """
+    Compress a sorted block of readings
+
+    Args:
+        timestamps: Sorted int64 epoch microseconds
+        levels: float32 levels
+        user_ids: Optional owner per reading
+
+    Returns:
+        Encoded block
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    count = len(timestamps)
+
+    # Timestamps: delta-of-delta, zigzag encoded so small negatives stay small
+    deltas = np.diff(timestamps, prepend=np.int64(0))
+    dods = np.diff(deltas, prepend=np.int64(0))
+    zigzag = ((dods << 1) ^ (dods >> 63)).view(np.uint64)
+    classes = np.searchsorted(DOD_WIDTHS, _bit_length(zigzag), side="left")
+    ts_classes = _pack_bits(classes, np.full(count, DOD_CLASS_BITS, dtype=np.int64))
+    ts_payload = _pack_bits(zigzag, DOD_WIDTHS[classes])
+
+    # Levels: XOR with the previous value's bits, storing only the meaningful window
+    bits = np.asarray(levels, dtype=np.float32).view(np.uint32).astype(np.uint64)
+    xors = bits ^ np.concatenate([[np.uint64(0)], bits[:-1]])
+    nonzero = xors != 0
+    flags = np.packbits(nonzero).tobytes()
+
+    meaningful_xors = xors[nonzero]
+    leading = 32 - _bit_length(meaningful_xors)
+    lowest_bit = meaningful_xors & (~meaningful_xors + np.uint64(1))
+    trailing = _bit_length(lowest_bit) - 1
+    length = 32 - leading - trailing
+    headers = (leading.astype(np.uint64) << np.uint64(5)) | (length - 1).astype(np.uint64)
+    lv_headers = _pack_bits(headers, np.full(len(headers), LEVEL_HEADER_BITS, dtype=np.int64))
+    lv_payload = _pack_bits(meaningful_xors >> trailing.astype(np.uint64), length)
+
+    owners = _encode_owner_runs(user_ids)
+    sections = [ts_classes, ts_payload, flags, lv_headers, lv_payload, owners]
+    return HEADER.pack(MAGIC, count, *[len(section) for section in sections]) + b"".join(sections)
+
+
+def decode_block(data: bytes) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    Decompress a block written by encode_block
+
+    Args:
+        data: Encoded block
+
+    Returns:
+        Tuple of (int64 timestamps, float32 levels, user_ids or None)
+    """
+    magic, count, *lengths = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a compressed tank block")
+
+    sections = []
+    offset = HEADER.size
+    for length in lengths:
+        sections.append(data[offset:offset + length])
+        offset += length
+    ts_classes, ts_payload, flags, lv_headers, lv_payload, owners = sections
+
+    classes = _unpack_bits(ts_classes, np.full(count, DOD_CLASS_BITS, dtype=np.int64)).astype(np.int64)
+    zigzag = _unpack_bits(ts_payload, DOD_WIDTHS[classes])
+    dods = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+    timestamps = np.cumsum(np.cumsum(dods))
+
+    nonzero = np.unpackbits(np.frombuffer(flags, dtype=np.uint8), count=count).astype(bool)
+    headers = _unpack_bits(lv_headers, np.full(int(nonzero.sum()), LEVEL_HEADER_BITS, dtype=np.int64))
+    leading = (headers >> np.uint64(5)).astype(np.int64)
+    length = (headers & np.uint64(31)).astype(np.int64) + 1
+    trailing = 32 - leading - length
+    xors = np.zeros(count, dtype=np.uint64)
+    xors[nonzero] = _unpack_bits(lv_payload, length) << trailing.astype(np.uint64)
+    levels = np.bitwise_xor.accumulate(xors).astype(np.uint32).view(np.float32)
+
+    return timestamps, levels, _decode_owner_runs(owners, count)
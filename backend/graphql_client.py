@@ -5,6 +5,8 @@ import logging
 import time
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from ingestion_bus import ingestion_bus
+from ring_buffer import ReadingRing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -25,7 +27,7 @@ class GraphQLClient:
         self.config = self._load_config()
         self.connected = False
         self.last_error = None
-        self.tank_data = []
+        self.tank_data = ReadingRing("graphql")
         self.auth_token = None
         self.token_expiry = None
         
@@ -370,6 +372,7 @@ class GraphQLClient:
                 
                 results.append(tank_entry)
                 self.tank_data.append(tank_entry)
+                ingestion_bus.publish(tank_entry, "graphql")
             
             logger.info(f"Fetched {len(results)} tank readings from GraphQL API")
             return results
@@ -379,13 +382,13 @@ class GraphQLClient:
             self.last_error = f"Error fetching tank data: {str(e)}"
             return []
     
-    def get_tank_data(self) -> List[Dict[str, Any]]:
-        """Get collected tank data"""
-        return self.tank_data.copy()
+    def get_tank_data(self, since: int = 0) -> List[Dict[str, Any]]:
+        """Get collected tank data newer than a sequence number"""
+        return self.tank_data.since(since)
     
     def clear_tank_data(self) -> None:
         """Clear collected tank data"""
-        self.tank_data = []
+        self.tank_data.clear()
         logger.info("Cleared GraphQL tank data")
 
 # Create a singleton instance
@@ -0,0 +1,351 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional
+import numpy as np
+from tank_storage import DATA_DIR, TankSeries, to_epoch_us
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_INGEST_CONFIG = {
+    "write_behind": True,
+    "max_batch": 5000,            # flush as soon as this many readings are waiting
+    "flush_interval_ms": 200,     # ... or when the oldest waiting reading is this old
+    "max_pending": 100000,        # writers flush inline above this (backpressure)
+    "fsync": "interval",          # batch: after every flush, interval: every fsync_interval_ms, os: never
+    "fsync_interval_ms": 1000,
+    "max_retries": 3              # failed flushes of a tank before its readings are dead-lettered
+}
+DEAD_LETTER_FILE = os.path.join(DATA_DIR, "ingest_dead_letter.ndjson")
+FSYNC_POLICIES = ["batch", "interval", "os"]
+
+
+class _PendingTank:
+    """Readings of one tank waiting to be written"""
+
+    __slots__ = ("timestamps", "levels", "user_ids", "has_owner", "attempts")
+
+    def __init__(self, attempts: int = 0):
+        self.timestamps: List[np.ndarray] = []
+        self.levels: List[np.ndarray] = []
+        self.user_ids: List[Optional[np.ndarray]] = []
+        self.has_owner = False
+        self.attempts = attempts  # failed flushes so far
+
+    def add(self, series: TankSeries) -> None:
+        self.timestamps.append(series.timestamps)
+        self.levels.append(series.levels)
+        self.user_ids.append(series.user_ids)
+        self.has_owner = self.has_owner or series.user_ids is not None
+
+    def to_series(self, tank_id: str) -> TankSeries:
+        timestamps = np.concatenate(self.timestamps)
+        order = np.argsort(timestamps, kind="stable")
+        user_ids = None
+        if self.has_owner:
+            user_ids = np.concatenate([
+                owners if owners is not None else np.full(len(levels), None, dtype=object)
+                for owners, levels in zip(self.user_ids, self.levels)
+            ])[order]
+        return TankSeries(tank_id, timestamps[order], np.concatenate(self.levels).astype(np.float32)[order], user_ids)
+
+
+class IngestBuffer:
+    """Write-behind buffer in front of the history store
+
+    Writers hand readings over and return immediately. A background thread
+    coalesces everything waiting into one sorted series per tank and writes it
+    with a single group commit when max_batch readings are waiting or
+    flush_interval_ms has passed. Readings accepted but not yet flushed are
+    lost if the process dies, so the window is bounded by flush_interval_ms;
+    the fsync policy bounds what a power loss can take on top of that.
+
+    Each tank is committed on its own, so a tank that fails to write is the
+    only one retried. After max_retries failed flushes its readings are
+    appended to a dead-letter file instead of blocking the queue for good.
+    """
+
+    def __init__(self, write: Callable[[List[TankSeries]], int], sync: Callable[[], None],
+                 config: Optional[Dict[str, Any]] = None, dead_letter_path: str = DEAD_LETTER_FILE):
+        """
+        Initialize the buffer
+
+        Args:
+            write: Group commit of one series per tank (store, cache and rollups)
+            sync: Forces written readings to stable storage
+            config: Overrides for DEFAULT_INGEST_CONFIG
+            dead_letter_path: NDJSON file that readings which cannot be written are moved to
+        """
+        self.write = write
+        self.sync = sync
+        self.dead_letter_path = dead_letter_path
+        self.config = {**DEFAULT_INGEST_CONFIG, **(config or {})}
+        if self.config["fsync"] not in FSYNC_POLICIES:
+            logger.warning(f"Unknown fsync policy '{self.config['fsync']}', using interval")
+            self.config["fsync"] = "interval"
+
+        self._pending: Dict[str, _PendingTank] = {}
+        self._pending_count = 0
+        self._oldest_pending: Optional[float] = None
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_sync = time.monotonic()
+        self._unsynced = 0
+
+        self.metrics = {
+            "accepted": 0,
+            "flushed": 0,
+            "flushes": 0,
+            "inline_flushes": 0,
+            "max_pending": 0,
+            "last_flush_at": None,
+            "last_flush_ms": None,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+            "fsyncs": 0,
+            "last_fsync_ms": None,
+            "errors": 0,
+            "last_error": None,
+            "retrying_tanks": 0,
+            "dead_lettered": 0,
+            "dead_letter_batches": 0,
+            "last_dead_letter_at": None,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config.get("write_behind", True))
+
+    # Writers
+
+    def submit(self, tank_id: str, timestamp: datetime, level: float, user_id: Optional[str] = None) -> None:
+        """Accept a single reading"""
+        self.submit_series([TankSeries(
+            tank_id,
+            np.array([to_epoch_us(timestamp)], dtype=np.int64),
+            np.array([level], dtype=np.float32),
+            np.array([user_id], dtype=object) if user_id is not None else None,
+        )])
+
+    def submit_series(self, series_list: List[TankSeries]) -> None:
+        """
+        Accept readings for one or more tanks
+
+        Without write-behind (or before start()) the readings are written
+        synchronously, so callers never need to know which mode is active.
+        """
+        series_list = [series for series in series_list if len(series)]
+        if not series_list:
+            return
+        if not self.enabled or not self.is_running():
+            self.write(series_list)
+            return
+
+        with self._condition:
+            for series in series_list:
+                self._pending.setdefault(series.tank_id, _PendingTank()).add(series)
+                self._pending_count += len(series)
+                self.metrics["accepted"] += len(series)
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+            self.metrics["max_pending"] = max(self.metrics["max_pending"], self._pending_count)
+            over_limit = self._pending_count >= self.config["max_pending"]
+            if self._pending_count >= self.config["max_batch"]:
+                self._condition.notify()
+
+        if over_limit:
+            # Backpressure: the writer pays for the flush instead of growing the queue
+            self.metrics["inline_flushes"] += 1
+            self.flush()
+
+    # Flushing
+
+    def pending(self) -> int:
+        """Get the number of readings waiting to be written"""
+        return self._pending_count
+
+    def flush(self) -> int:
+        """
+        Write everything waiting now
+
+        Failures are logged, counted and retried (or dead-lettered) per tank;
+        they are never raised, so a bad tank cannot fail the caller.
+
+        Returns:
+            Number of readings written
+        """
+        with self._flush_lock:
+            with self._condition:
+                pending, self._pending = self._pending, {}
+                self._pending_count = 0
+                self._oldest_pending = None
+            if not pending:
+                self._maybe_sync(force=False)
+                return 0
+
+            started = time.perf_counter()
+            written = 0
+            failed = []
+            for tank_id, tanks in pending.items():
+                series = tanks.to_series(tank_id)
+                try:
+                    written += self.write([series])
+                except Exception as e:
+                    self.metrics["errors"] += 1
+                    self.metrics["last_error"] = f"{tank_id}: {str(e)}"
+                    logger.error(f"Error flushing {len(series)} readings for tank {tank_id[:64]}: {str(e)}")
+                    failed.append((series, tanks.attempts + 1, str(e)))
+            if failed:
+                self._retry(failed)
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._unsynced += written
+            self._maybe_sync(force=self.config["fsync"] == "batch")
+
+            self.metrics["flushed"] += written
+            self.metrics["flushes"] += 1
+            self.metrics["last_flush_at"] = datetime.now().isoformat()
+            self.metrics["last_flush_ms"] = round(elapsed_ms, 3)
+            self.metrics["max_flush_ms"] = round(max(self.metrics["max_flush_ms"], elapsed_ms), 3)
+            self.metrics["total_flush_ms"] += elapsed_ms
+            return written
+
+    def _retry(self, failed: List[tuple]) -> None:
+        """Re-queue tanks whose write failed, dead-lettering those out of retries"""
+        with self._condition:
+            for series, attempts, error in failed:
+                if attempts >= self.config["max_retries"]:
+                    self._dead_letter(series, attempts, error)
+                    continue
+                # Put the readings back in front of anything that arrived meanwhile
+                retry = _PendingTank(attempts)
+                retry.add(series)
+                later = self._pending.get(series.tank_id)
+                if later is not None:
+                    for timestamps, levels, owners in zip(later.timestamps, later.levels, later.user_ids):
+                        retry.add(TankSeries(series.tank_id, timestamps, levels, owners))
+                self._pending[series.tank_id] = retry
+                self._pending_count += len(series)
+                self._oldest_pending = self._oldest_pending or time.monotonic()
+            self.metrics["retrying_tanks"] = sum(1 for tanks in self._pending.values() if tanks.attempts)
+
+    def _dead_letter(self, series: TankSeries, attempts: int, error: str) -> None:
+        """Append a tank's unwritable readings to the dead-letter file"""
+        entry = {
+            "tank_id": series.tank_id,
+            "failed_at": datetime.now().isoformat(),
+            "attempts": attempts,
+            "error": error,
+            "readings": [
+                {**record, "timestamp": record["timestamp"].isoformat()}
+                for record in series.to_records()
+            ],
+        }
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path) or ".", exist_ok=True)
+            with open(self.dead_letter_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        except Exception as e:
+            logger.error(f"Error dead-lettering {len(series)} readings for tank {series.tank_id[:64]}, "
+                         f"readings are lost: {str(e)}")
+            return
+        self.metrics["dead_lettered"] += len(series)
+        self.metrics["dead_letter_batches"] += 1
+        self.metrics["last_dead_letter_at"] = entry["failed_at"]
+        logger.error(f"Moved {len(series)} readings for tank {series.tank_id[:64]} to {self.dead_letter_path} "
+                     f"after {attempts} failed flushes")
+
+    def _maybe_sync(self, force: bool) -> None:
+        """Apply the fsync policy to readings written since the last sync"""
+        if not self._unsynced or self.config["fsync"] == "os":
+            return
+        due = (time.monotonic() - self._last_sync) * 1000 >= self.config["fsync_interval_ms"]
+        if not force and not (self.config["fsync"] == "interval" and due):
+            return
+
+        started = time.perf_counter()
+        self.sync()
+        self._last_sync = time.monotonic()
+        self._unsynced = 0
+        self.metrics["fsyncs"] += 1
+        self.metrics["last_fsync_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def _thread_func(self) -> None:
+        """Flush on size or age until stopped"""
+        interval = self.config["flush_interval_ms"] / 1000
+        while not self._stop.is_set():
+            with self._condition:
+                if self._pending_count < self.config["max_batch"]:
+                    if self._oldest_pending is None:
+                        timeout = interval
+                    else:
+                        timeout = max(0.0, self._oldest_pending + interval - time.monotonic())
+                    self._condition.wait(timeout)
+            try:
+                with self._condition:
+                    ready = self._pending_count >= self.config["max_batch"] or (
+                        self._oldest_pending is not None and
+                        time.monotonic() - self._oldest_pending >= interval
+                    )
+                if ready:
+                    self.flush()
+                else:
+                    with self._flush_lock:
+                        self._maybe_sync(force=False)
+            except Exception as e:
+                # Failed writes are handled by flush; this is a failing fsync
+                self.metrics["errors"] += 1
+                self.metrics["last_error"] = str(e)
+                logger.error(f"Error syncing ingest buffer: {str(e)}")
+                self._stop.wait(interval)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """Start the background flusher"""
+        if not self.enabled:
+            logger.info("Write-behind ingest is disabled; readings are written synchronously")
+            return False
+        if self.is_running():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._thread_func)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Started write-behind ingest (batch {self.config['max_batch']}, "
+                    f"every {self.config['flush_interval_ms']} ms, fsync {self.config['fsync']})")
+        return True
+
+    def stop(self) -> None:
+        """Stop the flusher and write (and sync) anything still waiting"""
+        self._stop.set()
+        with self._condition:
+            self._condition.notify()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self._thread = None
+        self.flush()
+        with self._flush_lock:
+            if self.config["fsync"] != "os":
+                self._maybe_sync(force=True)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the configuration, queue depth and flush metrics"""
+        flushes = self.metrics["flushes"]
+        return {
+            "running": self.is_running(),
+            "config": self.config,
+            "pending": self._pending_count,
+            "dead_letter_path": self.dead_letter_path,
+            **{name: value for name, value in self.metrics.items() if name != "total_flush_ms"},
+            "avg_flush_ms": round(self.metrics["total_flush_ms"] / flushes, 3) if flushes else None,
+        }
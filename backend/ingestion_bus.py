@@ -0,0 +1,245 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from batch_ingest import validate_batch
+from dedup import ReadingDeduplicator, DEFAULT_DEDUP_CONFIG
+from tank_storage import TankSeries
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_BUS_CONFIG = {
+    "max_queue": 50000,         # readings waiting for dispatch before publishers are pushed back
+    "max_batch": 5000,          # readings normalized and dispatched together
+    "publish_timeout_ms": 100,  # how long a publisher waits for room before the reading is dropped
+    "dedup": DEFAULT_DEDUP_CONFIG
+}
+DEFAULT_TANK_ID = "unknown"
+
+Sink = Callable[[List[TankSeries]], Any]
+
+
+class IngestionBus:
+    """Single ingestion pipeline shared by the protocol clients
+
+    MQTT, REST, GraphQL, OPC UA and Modbus readings are published into one
+    bounded queue. A dispatcher thread drains it in batches, normalizes each
+    batch into per-tank TankSeries with the same validation as
+    /api/tank-levels/batch, and fans the result out to every subscribed sink
+    (storage, rollups and cache through the ingest buffer, anomaly scoring).
+    Repeated and, with a deadband, unchanged readings are dropped before the
+    fan-out.
+    When the queue is full, publishers block for up to publish_timeout_ms and
+    the reading is then dropped and counted, so a flood from one source
+    cannot grow memory without bound.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """Initialize the bus; sinks are attached with subscribe() and dispatching begins with start()"""
+        self.config = {**DEFAULT_BUS_CONFIG, **(config or {})}
+        self._queue: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue(maxsize=self.config["max_queue"])
+        self._sinks: List[Tuple[str, Sink]] = []
+        self.dedup = ReadingDeduplicator(self.config["dedup"])
+        self._dispatch_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.sources: Dict[str, Dict[str, int]] = {}
+        self.metrics = {
+            "batches": 0,
+            "dispatched": 0,
+            "last_dispatch_ms": None,
+            "max_queue_depth": 0,
+            "sink_errors": 0,
+            "last_error": None,
+        }
+
+    def configure(self, config: Optional[Dict[str, Any]]) -> None:
+        """Apply configuration overrides; the queue is resized only while it is empty"""
+        self.config = {**DEFAULT_BUS_CONFIG, **(config or {})}
+        self.dedup = ReadingDeduplicator(self.config["dedup"])
+        if self._queue.empty():
+            self._queue = queue.Queue(maxsize=self.config["max_queue"])
+
+    def subscribe(self, name: str, sink: Sink) -> None:
+        """
+        Attach a sink that receives every dispatched batch
+
+        Args:
+            name: Name reported in logs and status
+            sink: Called with one sorted TankSeries per tank
+        """
+        self._sinks.append((name, sink))
+        logger.info(f"Ingestion bus sink subscribed: {name}")
+
+    def _source_counts(self, source: str) -> Dict[str, int]:
+        counts = self.sources.get(source)
+        if counts is None:
+            counts = self.sources[source] = {
+                "published": 0, "accepted": 0, "rejected": 0, "dropped": 0, "duplicates": 0, "suppressed": 0
+            }
+        return counts
+
+    # Publishers
+
+    def publish(self, reading: Dict[str, Any], source: str) -> bool:
+        """
+        Publish one reading
+
+        Args:
+            reading: Dict with 'level' and usually 'tank_id' and 'timestamp'
+                (datetime or ISO-8601 string; missing means now)
+            source: Name of the publishing client
+
+        Returns:
+            True if queued, False if dropped because the queue stayed full
+        """
+        counts = self._source_counts(source)
+        counts["published"] += 1
+
+        item = {"tank_id": reading.get("tank_id"), "timestamp": reading.get("timestamp"), "level": reading.get("level")}
+        if isinstance(item["timestamp"], datetime):
+            item["timestamp"] = item["timestamp"].isoformat()
+
+        try:
+            self._queue.put((source, item), timeout=self.config["publish_timeout_ms"] / 1000)
+        except queue.Full:
+            counts["dropped"] += 1
+            if counts["dropped"] == 1 or counts["dropped"] % 1000 == 0:
+                logger.warning(f"Ingestion bus full; dropped {counts['dropped']} readings from {source}")
+            return False
+
+        depth = self._queue.qsize()
+        if depth > self.metrics["max_queue_depth"]:
+            self.metrics["max_queue_depth"] = depth
+        return True
+
+    def publish_many(self, readings: List[Dict[str, Any]], source: str) -> int:
+        """Publish several readings and return how many were queued"""
+        return sum(self.publish(reading, source) for reading in readings)
+
+    # Dispatching
+
+    def _drain(self, first: Optional[Tuple[str, Dict[str, Any]]] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        items = [first] if first is not None else []
+        while len(items) < self.config["max_batch"]:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _dispatch(self, items: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """Normalize a batch and hand it to every sink"""
+        if not items:
+            return 0
+
+        started = time.perf_counter()
+        by_source: Dict[str, List[Dict[str, Any]]] = {}
+        for source, reading in items:
+            by_source.setdefault(source, []).append(reading)
+
+        # Validate per source so accepted and rejected counts are exact
+        series_list: List[TankSeries] = []
+        accepted = 0
+        for source, readings in by_source.items():
+            source_series, errors = validate_batch(readings, DEFAULT_TANK_ID)
+            count = sum(len(series) for series in source_series)
+            counts = self._source_counts(source)
+            counts["accepted"] += count
+            counts["rejected"] += len(readings) - count
+            if errors:
+                logger.warning(f"Ingestion bus rejected {len(readings) - count} readings from {source}: {errors[0]['error']}")
+
+            if self.dedup.enabled:
+                kept = []
+                for series in source_series:
+                    series, duplicates, suppressed = self.dedup.filter(series)
+                    counts["duplicates"] += duplicates
+                    counts["suppressed"] += suppressed
+                    count -= duplicates + suppressed
+                    if len(series):
+                        kept.append(series)
+                source_series = kept
+            series_list.extend(source_series)
+            accepted += count
+
+        for name, sink in self._sinks:
+            try:
+                sink(series_list)
+            except Exception as e:
+                self.metrics["sink_errors"] += 1
+                self.metrics["last_error"] = f"{name}: {str(e)}"
+                logger.error(f"Ingestion bus sink {name} failed: {str(e)}")
+
+        self.metrics["batches"] += 1
+        self.metrics["dispatched"] += accepted
+        self.metrics["last_dispatch_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return accepted
+
+    def flush(self) -> int:
+        """
+        Dispatch everything queued now, in the calling thread
+
+        Returns:
+            Number of readings accepted
+        """
+        dispatched = 0
+        with self._dispatch_lock:
+            while True:
+                items = self._drain()
+                if not items:
+                    return dispatched
+                dispatched += self._dispatch(items)
+
+    def _thread_func(self) -> None:
+        """Dispatch batches until stopped"""
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._dispatch_lock:
+                self._dispatch(self._drain(first))
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """Start the dispatcher thread"""
+        if self.is_running():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._thread_func)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Started ingestion bus (queue {self.config['max_queue']}, batch {self.config['max_batch']})")
+        return True
+
+    def stop(self) -> None:
+        """Stop the dispatcher and dispatch anything still queued"""
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self._thread = None
+        self.flush()
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get queue depth, per-source counts and dispatch metrics"""
+        return {
+            "running": self.is_running(),
+            "config": self.config,
+            "queue_depth": self._queue.qsize(),
+            "sinks": [name for name, _ in self._sinks],
+            "sources": self.sources,
+            "dedup": self.dedup.get_status(),
+            **self.metrics,
+        }
+
+
+# Create a singleton instance
+ingestion_bus = IngestionBus()
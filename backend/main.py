@@ -1,16 +1,24 @@
-from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, Depends, Header, status
+from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, Depends, Header, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Union
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import IsolationForest
+import asyncio
 import json
 import os
 import logging
-from fastapi.responses import JSONResponse
+from functools import partial
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from tank_api_service import TankAPIService
+from tank_rollups import RESOLUTIONS
+from downsampling import DOWNSAMPLE_METHODS, DEFAULT_POINTS
+from retention_service import RetentionService
+from batch_ingest import BatchError, MAX_BATCH_READINGS, parse_batch, parse_parquet, parquet_row_count, validate_batch
+from tank_export import ARROW_STREAM_TYPE, COLUMNAR_FORMATS, EXPORT_FORMATS, arrow_available, export_stream, frame_to_arrow
+from tank_storage import encode_tank_id, to_epoch_us
+from pagination import KeysetIndex, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
 import auth
 from auth import get_current_user, UserInDB
 from mqtt_client import mqtt_client
@@ -18,6 +26,8 @@ from rest_api_client import rest_api_client
 from graphql_client import graphql_client
 from opcua_client import opcua_client
 from modbus_client import modbus_client
+from ingestion_bus import ingestion_bus
+from streaming_detectors import ANOMALY_METHODS
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -32,6 +42,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=[NEXT_CURSOR_HEADER],  # Lets browser clients page with keyset cursors
 )
 
 # Include the authentication router
@@ -60,10 +71,22 @@ class TankLevel(BaseModel):
     tank_id: str = "tank1"
     user_id: Optional[str] = None
 
+class TankLevelRollup(TankLevel):
+    min_level: float
+    max_level: float
+    last_level: float
+    count: int
+
 class TankLevelCreate(BaseModel):
     level: float
     tank_id: str = "tank1"
 
+class BatchIngestResult(BaseModel):
+    accepted: int
+    rejected: int
+    tanks: Dict[str, int]
+    errors: List[Dict[str, Any]] = []
+
 class AnomalyResult(BaseModel):
     timestamp: datetime
     level: float
@@ -103,131 +126,141 @@ class SubscriptionTier(BaseModel):
 # Initialize API service
 api_service = TankAPIService()
 
-# Load initial data
-tank_data = api_service.fetch_tank_levels()
+# Load initial data (generates sample history on first run and warms the cache)
+api_service.fetch_tank_frame()
+
+# Protocol clients publish into one bounded bus; batches reach storage, the
+# cache and rollups through the write-behind ingest buffer
+ingestion_bus.configure(api_service.config.get("ingestion_bus"))
+ingestion_bus.subscribe("storage", api_service.ingest.submit_series)
+ingestion_bus.start()
 
 # In-memory storage for user-reported anomalies and feedback
 # In a production environment, this would be stored in a database
 user_reported_anomalies = []
-anomaly_feedback = []  # Store user feedback on anomalies (marked as normal)
-
-# Anomaly detection model
-def detect_anomalies(data, contamination=0.01):
-    """
-    Detect anomalies in tank level data using Isolation Forest
-
-    Args:
-        data: DataFrame with 'level' column
-        contamination: Expected proportion of anomalies
+# Newest-first keyset index over user_reported_anomalies (positions are anomaly IDs)
+user_anomaly_index = KeysetIndex()
+# Feedback on anomalies (marked as normal) is indexed in api_service.anomaly_feedback
+
+# History limits per subscription tier, from SUBSCRIPTION_TIERS (admins: unlimited)
+def tier_history_start(user: Optional[UserInDB]) -> Optional[datetime]:
+    """Get the earliest timestamp the user's subscription tier may read (its max_history_days, as retention keeps)"""
+    if not user or user.is_admin or user.subscription_tier not in SUBSCRIPTION_TIERS:
+        return None
+    return datetime.now() - timedelta(days=SUBSCRIPTION_TIERS[user.subscription_tier].max_history_days)
+
+def to_local_time(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """Convert an offset-aware query timestamp to naive local time, like stored readings"""
+    if timestamp is None or timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone().replace(tzinfo=None)
+
+def history_window(user: Optional[UserInDB], start: Optional[datetime],
+                   end: Optional[datetime]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Resolve an absolute query range in local time, folding in the subscription tier cutoff"""
+    start, end = to_local_time(start), to_local_time(end)
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    tier_start = tier_history_start(user)
+    if tier_start and (start is None or start < tier_start):
+        start = tier_start
+    return start, end
+
+def show_owner(df: pd.DataFrame, user: Optional[UserInDB]) -> pd.DataFrame:
+    """Show readings without an owner as belonging to the requesting (non-admin) user"""
+    if user and not user.is_admin:
+        if 'user_id' not in df.columns:
+            df['user_id'] = user.username
+        else:
+            df['user_id'] = df['user_id'].fillna(user.username)
+    return df
 
-    Returns:
-        DataFrame with anomaly detection results
-    """
-    global anomaly_feedback
-
-    if len(data) < 10:  # Need enough data for meaningful detection
-        return pd.DataFrame({
-            'timestamp': data['timestamp'],
-            'level': data['level'],
-            'is_anomaly': [False] * len(data),
-            'anomaly_score': [0.0] * len(data)
-        })
-
-    # Create and fit the model
-    model = IsolationForest(contamination=contamination, random_state=42)
-
-    # Reshape data for scikit-learn
-    X = data['level'].values.reshape(-1, 1)
-
-    # Fit the model and predict
-    model.fit(X)
-    scores = model.decision_function(X)
-    predictions = model.predict(X)
-
-    # Convert predictions (-1 for anomalies, 1 for normal) to boolean
-    is_anomaly = [pred == -1 for pred in predictions]
-
-    # Create result DataFrame
-    result_df = pd.DataFrame({
-        'timestamp': data['timestamp'],
-        'level': data['level'],
-        'is_anomaly': is_anomaly,
-        'anomaly_score': scores
-    })
-
-    # Apply user feedback to override model predictions
-    # If a user has marked a reading as normal, override the model's prediction
-    if anomaly_feedback:
-        # Convert anomaly_feedback to DataFrame for easier processing
-        feedback_df = pd.DataFrame(anomaly_feedback)
-
-        # For each feedback entry, find matching timestamp and level in result_df and set is_anomaly to False
-        for _, feedback in feedback_df.iterrows():
-            # Find matching entries in result_df
-            matches = result_df[
-                (result_df['timestamp'] == feedback['timestamp']) &
-                (result_df['level'] == feedback['level']) &
-                (result_df['is_anomaly'] == True)  # Only override actual anomalies
-            ]
-
-            # Update is_anomaly to False for matches
-            if not matches.empty:
-                for idx in matches.index:
-                    result_df.at[idx, 'is_anomaly'] = False
-
-    return result_df
+def history_owner(user: Optional[UserInDB]) -> Optional[str]:
+    """Get the owner to filter history by (non-admins only see their own and unowned readings)"""
+    if user and not user.is_admin:
+        return user.username
+    return None
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Tank Level Monitoring API"}
 
-@app.get("/api/tank-levels", response_model=List[TankLevel])
+@app.get("/api/tank-levels", response_model=List[Union[TankLevelRollup, TankLevel]])
 async def get_tank_levels(
+    response: Response,
     days: Optional[int] = Query(None, description="Number of days of data to return"),
+    start: Optional[datetime] = Query(None, description="Earliest timestamp (ISO-8601); overrides days"),
+    end: Optional[datetime] = Query(None, description="Latest timestamp (ISO-8601); overrides days"),
     tank_id: Optional[str] = Query(None, description="Tank ID to filter by"),
+    resolution: Optional[str] = Query(None, description="Resolution: raw, 1m, 1h or 1d"),
+    max_points: Optional[int] = Query(None, gt=0, description="Pick the finest resolution returning at most this many points per tank"),
+    downsample: Optional[str] = Query(None, description="Downsampling method for raw readings: lttb"),
+    points: int = Query(DEFAULT_POINTS, ge=3, description="Number of points per tank to keep when downsampling"),
+    limit: Optional[int] = Query(None, gt=0, le=MAX_PAGE_SIZE, description="Page size for keyset pagination of raw readings"),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the previous page's {NEXT_CURSOR_HEADER} header"),
+    accept: Optional[str] = Header(None),
     user: Optional[UserInDB] = Depends(get_user_from_header)
 ):
-    """Get tank level data, optionally filtered by days and tank ID"""
-    global tank_data
+    """Get tank level data, optionally filtered by days or a start/end range and tank ID and aggregated or downsampled for charts
 
+    Send `Accept: application/vnd.apache.arrow.stream` to get the same columns as an Arrow IPC stream.
+    With `limit`, raw readings are returned one newest-first page at a time and the
+    `X-Next-Cursor` response header holds the cursor for the next page.
+    """
+    as_arrow = ARROW_STREAM_TYPE in (accept or "")
+    if as_arrow and not arrow_available():
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Arrow responses require pyarrow")
+    if resolution is not None and resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid resolution. Must be one of: {', '.join(RESOLUTIONS)}")
+    if downsample is not None and downsample not in DOWNSAMPLE_METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid downsample method. Must be one of: {', '.join(DOWNSAMPLE_METHODS)}")
+    if downsample and (resolution not in (None, "raw") or max_points is not None):
+        raise HTTPException(status_code=400, detail="downsample applies to raw readings and cannot be combined with a rollup resolution")
+    if cursor is not None and limit is None:
+        raise HTTPException(status_code=400, detail="cursor requires limit")
+    if limit is not None and (downsample or resolution not in (None, "raw") or max_points is not None):
+        raise HTTPException(status_code=400, detail="limit and cursor apply to raw readings only")
     try:
-        # Fetch fresh data from API
-        tank_data = api_service.fetch_tank_levels(days)
-
-        # Convert to DataFrame for easier filtering
-        df = pd.DataFrame(tank_data)
-
-        # Filter by tank_id if provided
-        if tank_id:
-            df = df[df['tank_id'] == tank_id]
+        page_after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if start or end:
+        days = None
+    start, end = history_window(user, start, end)
+
+    next_cursor = None
+    try:
+        # Push the tank, owner and subscription tier filters down to storage
+        if limit is not None:
+            # Keyset page: already in newest-first order
+            df, last_key = api_service.fetch_tank_page(
+                days, tank_id, start=start, user_id=history_owner(user),
+                limit=limit, cursor=page_after, end=end
+            )
+            next_cursor = encode_cursor(last_key) if last_key else None
+        elif resolution in (None, "raw") and max_points is None:
+            df = api_service.fetch_tank_frame(
+                days, tank_id, start=start, user_id=history_owner(user),
+                lttb_points=points if downsample == "lttb" else None, end=end
+            )
+        else:
+            _, df = api_service.fetch_rollup_frame(
+                days, tank_id, start=start, user_id=history_owner(user),
+                resolution=resolution, max_points=max_points, end=end
+            )
 
-        # Filter by user_id if user is authenticated
-        if user:
-            # If user is not admin, only show their data
-            if not user.is_admin:
-                # For mock data, we'll just assign some data to the user
-                # In a real implementation, you'd filter by actual user_id
-                if 'user_id' not in df.columns:
-                    df['user_id'] = user.username  # Assign all data to this user for mock data
-                else:
-                    df['user_id'] = df['user_id'].fillna(user.username)
-                    df = df[df['user_id'] == user.username]
+        # Readings without an owner are shown as belonging to the requesting user
+        df = show_owner(df, user)
 
         # Sort by timestamp (newest first)
-        df = df.sort_values('timestamp', ascending=False)
-
-        # Apply subscription tier limits
-        if user:
-            # Limit history based on subscription tier
-            if user.subscription_tier == "free":
-                # Free tier: 7 days of history
-                cutoff_date = datetime.now() - timedelta(days=7)
-                df = df[df['timestamp'] >= cutoff_date]
-            elif user.subscription_tier == "basic":
-                # Basic tier: 30 days of history
-                cutoff_date = datetime.now() - timedelta(days=30)
-                df = df[df['timestamp'] >= cutoff_date]
-            # Premium tier: unlimited history
+        if limit is None:
+            df = df.sort_values('timestamp', ascending=False)
+
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        # Columnar clients skip per-row validation and JSON encoding entirely
+        if as_arrow:
+            return Response(content=frame_to_arrow(df), media_type=ARROW_STREAM_TYPE, headers=headers)
+        response.headers.update(headers)
 
         # Convert back to list of dictionaries
         result = df.to_dict('records')
@@ -236,14 +269,83 @@ async def get_tank_levels(
         logger.error(f"Error getting tank levels: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching tank levels: {str(e)}")
 
+@app.get("/api/tank-levels/export")
+def export_tank_levels(
+    format: str = Query("ndjson", description="Export format: ndjson, csv, arrow or parquet"),
+    start: Optional[datetime] = Query(None, description="Earliest timestamp to export"),
+    end: Optional[datetime] = Query(None, description="Latest timestamp to export"),
+    tank_id: Optional[str] = Query(None, description="Tank ID to filter by"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
+    """Stream tank level history as NDJSON, CSV, Arrow IPC or Parquet without loading it all into memory"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {', '.join(EXPORT_FORMATS)}")
+    if format in COLUMNAR_FORMATS and not arrow_available():
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=f"{format} export requires pyarrow")
+    # Same subscription tier and owner filters as GET /api/tank-levels
+    start, end = history_window(user, start, end)
+    default_user_id = user.username if user and not user.is_admin else None
+
+    chunks = api_service.iter_series_chunks(tank_id, start=start, end=end, user_id=history_owner(user))
+    filename = f"tank-levels-{encode_tank_id(tank_id) if tank_id else 'all'}.{format}"
+    return StreamingResponse(
+        export_stream(chunks, format, default_user_id),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.post("/api/tank-levels/import", response_model=BatchIngestResult)
+async def import_tank_levels(
+    request: Request,
+    tank_id: Optional[str] = Query(None, description="Tank ID for rows without one"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
+    """Import readings from a Parquet file (timestamp and level columns, optional tank_id and user_id)"""
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to add tank level readings",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if not arrow_available():
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Parquet import requires pyarrow")
+
+    body = await request.body()
+    loop = asyncio.get_running_loop()
+    try:
+        # The footer gives the row count, so oversized files are refused before any column is decoded
+        if parquet_row_count(body) > MAX_BATCH_READINGS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Import too large: at most {MAX_BATCH_READINGS} readings per request"
+            )
+
+        # Admins may restore an export with its owners; everyone else imports as themselves
+        # Decoding and storing the columns is CPU-bound, so stay off the event loop
+        series_list, errors, rows = await loop.run_in_executor(None, partial(
+            parse_parquet, body, tank_id or api_service.tank_id, user.username, keep_owners=user.is_admin
+        ))
+    except BatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        accepted = await loop.run_in_executor(None, api_service.add_tank_series, series_list)
+        return {
+            "accepted": accepted,
+            "rejected": rows - accepted,
+            "tanks": {series.tank_id: len(series) for series in series_list},
+            "errors": errors,
+        }
+    except Exception as e:
+        logger.error(f"Error importing tank levels: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error importing tank levels: {str(e)}")
+
 @app.post("/api/tank-levels", response_model=TankLevel)
 async def add_tank_level(
     tank_level: TankLevelCreate,
     user: Optional[UserInDB] = Depends(get_user_from_header)
 ):
     """Add a new tank level reading"""
-    global tank_data
-
     # Check if user is authenticated
     if not user:
         raise HTTPException(
@@ -253,30 +355,65 @@ async def add_tank_level(
         )
 
     try:
-        # Add reading via API service
-        new_reading = api_service.add_tank_level(tank_level.level)
+        # Add reading via API service, owned by the requesting user
+        return api_service.add_tank_level(tank_level.level, tank_level.tank_id, user.username)
+    except Exception as e:
+        logger.error(f"Error adding tank level: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error adding tank level: {str(e)}")
 
-        # Add user_id to the reading
-        new_reading["user_id"] = user.username
+@app.post("/api/tank-levels/batch", response_model=BatchIngestResult)
+async def add_tank_levels_batch(
+    request: Request,
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
+    """Add many readings at once from a JSON array or NDJSON body (Content-Type: application/x-ndjson)"""
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to add tank level readings",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
-        # Refresh in-memory data
-        tank_data = api_service.fetch_tank_levels()
+    body = await request.body()
+    loop = asyncio.get_running_loop()
+    try:
+        # Decoding, validating and storing a large batch is CPU-bound, so stay off the event loop
+        items = await loop.run_in_executor(None, parse_batch, body, request.headers.get("content-type"))
+    except (BatchError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(items) > MAX_BATCH_READINGS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch too large: at most {MAX_BATCH_READINGS} readings per request"
+        )
 
-        return new_reading
+    try:
+        series_list, errors = await loop.run_in_executor(
+            None, validate_batch, items, api_service.tank_id, user.username
+        )
+        accepted = await loop.run_in_executor(None, api_service.add_tank_series, series_list)
+        return {
+            "accepted": accepted,
+            "rejected": len(items) - accepted,
+            "tanks": {series.tank_id: len(series) for series in series_list},
+            "errors": errors,
+        }
     except Exception as e:
-        logger.error(f"Error adding tank level: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error adding tank level: {str(e)}")
+        logger.error(f"Error adding tank level batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error adding tank level batch: {str(e)}")
 
 @app.get("/api/anomalies", response_model=List[AnomalyResult])
 async def get_anomalies(
     days: Optional[int] = Query(30, description="Number of days of data to analyze"),
+    start: Optional[datetime] = Query(None, description="Earliest timestamp (ISO-8601); overrides days"),
+    end: Optional[datetime] = Query(None, description="Latest timestamp (ISO-8601); overrides days"),
     tank_id: Optional[str] = Query(None, description="Tank ID to filter by"),
     sensitivity: float = Query(0.01, description="Anomaly detection sensitivity (0.01-0.1)"),
+    method: Optional[str] = Query(None, description="Detector: isolation_forest, ewma, mad or hst (default: the tank's configured detector)"),
     user: Optional[UserInDB] = Depends(get_user_from_header)
 ):
     """Detect anomalies in tank level data"""
-    global tank_data
-
     # Check if user has access to anomaly detection
     if user and user.subscription_tier == "free":
         raise HTTPException(
@@ -284,34 +421,30 @@ async def get_anomalies(
             detail="Anomaly detection requires a Basic or Premium subscription"
         )
 
-    try:
-        # Ensure we have the latest data
-        tank_data = api_service.fetch_tank_levels(days)
-
-        # Convert to DataFrame for analysis
-        df = pd.DataFrame(tank_data)
-
-        # Filter by tank_id if provided
-        if tank_id:
-            df = df[df['tank_id'] == tank_id]
-
-        # Filter by user_id if user is authenticated
-        if user and not user.is_admin:
-            # For mock data, we'll just assign some data to the user
-            if 'user_id' not in df.columns:
-                df['user_id'] = user.username  # Assign all data to this user for mock data
-            else:
-                df['user_id'] = df['user_id'].fillna(user.username)
-                df = df[df['user_id'] == user.username]
+    max_sensitivity = api_service.anomaly_flags.max_sensitivity
+    if not 0 < sensitivity <= max_sensitivity:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Sensitivity must be greater than 0 and at most {max_sensitivity}"
+        )
 
-        # Sort by timestamp
-        df = df.sort_values('timestamp')
+    if method is not None and method not in ANOMALY_METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid detection method. Must be one of: {', '.join(ANOMALY_METHODS)}")
 
-        # Detect anomalies
-        result_df = detect_anomalies(df, contamination=sensitivity)
+    if start or end:
+        days = None
+    start, end = history_window(user, start, end)
 
-        # Filter to only return anomalies
-        anomalies_df = result_df[result_df['is_anomaly']]
+    try:
+        # Readings are scored when they are stored; look up the flags in the
+        # time range, tank, owner and subscription tier window, less the
+        # readings users marked as normal. A tank seen for the first time has
+        # its history scored, so stay off the event loop
+        anomalies_df = await asyncio.get_running_loop().run_in_executor(None, partial(
+            api_service.fetch_anomalies,
+            days, tank_id, start=start, user_id=history_owner(user), end=end, sensitivity=sensitivity,
+            method=method
+        ))
 
         # Convert back to list of dictionaries
         result = anomalies_df.to_dict('records')
@@ -320,73 +453,143 @@ async def get_anomalies(
         logger.error(f"Error detecting anomalies: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error detecting anomalies: {str(e)}")
 
+@app.get("/api/anomalies/models")
+async def get_anomaly_model_status(user: Optional[UserInDB] = Depends(get_user_from_header)):
+    """Get the anomaly model registry, cache metrics and flag counts (admin only)"""
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to view anomaly model status",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if not user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only administrators can view anomaly model status"
+        )
+
+    return {
+        **api_service.anomaly_models.get_status(),
+        "flags": api_service.anomaly_flags.get_status(),
+        "jobs": api_service.anomaly_jobs.get_status(),
+        "detectors": api_service.anomaly_detectors.get_status(),
+    }
+
+@app.post("/api/anomalies/rescore")
+async def rescore_anomalies(
+    tank_ids: Optional[str] = Query(None, description="Comma-separated tank IDs; all tanks if not given"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
+    """Refit the anomaly models and rescore tank histories in parallel worker processes (admin only)"""
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to rescore anomalies",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if not user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only administrators can rescore anomalies"
+        )
+
+    requested = None
+    if tank_ids:
+        requested = list(dict.fromkeys(tank.strip() for tank in tank_ids.split(",") if tank.strip()))
+
+    try:
+        # Tanks are fanned out across the job pool; the event loop keeps serving other requests
+        tanks = await asyncio.get_running_loop().run_in_executor(
+            None, api_service.rescore_anomalies, requested
+        )
+        return {"tanks": tanks, "jobs": api_service.anomaly_jobs.get_status()}
+    except Exception as e:
+        logger.error(f"Error rescoring anomalies: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error rescoring anomalies: {str(e)}")
+
 @app.get("/api/stats")
 async def get_stats(
     days: Optional[int] = Query(30, description="Number of days of data to analyze"),
+    start: Optional[datetime] = Query(None, description="Earliest timestamp (ISO-8601); overrides days"),
+    end: Optional[datetime] = Query(None, description="Latest timestamp (ISO-8601); overrides days"),
     tank_id: Optional[str] = Query(None, description="Tank ID to filter by"),
     user: Optional[UserInDB] = Depends(get_user_from_header)
 ):
     """Get statistics about tank levels"""
-    global tank_data
+    if start or end:
+        days = None
+    start, end = history_window(user, start, end)
 
     try:
-        # Ensure we have the latest data
-        tank_data = api_service.fetch_tank_levels(days)
-
-        # Convert to DataFrame for analysis
-        df = pd.DataFrame(tank_data)
+        # Merged from per-bucket accumulators, with the same range, tank, owner and tier filters
+        return api_service.fetch_stats(days, tank_id, start=start, user_id=history_owner(user), end=end)
+    except Exception as e:
+        logger.error(f"Error getting stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
 
-        # Filter by tank_id if provided
-        if tank_id:
-            df = df[df['tank_id'] == tank_id]
+@app.get("/api/fleet/levels")
+async def get_fleet_levels(
+    tank_ids: str = Query(..., description="Comma-separated tank IDs"),
+    days: Optional[int] = Query(None, description="Number of days of data to return"),
+    start: Optional[datetime] = Query(None, description="Earliest timestamp (ISO-8601); overrides days"),
+    end: Optional[datetime] = Query(None, description="Latest timestamp (ISO-8601); overrides days"),
+    resolution: Optional[str] = Query(None, description="Resolution: raw, 1m, 1h or 1d"),
+    max_points: Optional[int] = Query(None, gt=0, description="Pick the finest resolution returning at most this many points per tank"),
+    downsample: Optional[str] = Query(None, description="Downsampling method for raw readings: lttb"),
+    points: int = Query(DEFAULT_POINTS, ge=3, description="Number of points per tank to keep when downsampling"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
+    """Get levels and statistics for several tanks in one request"""
+    requested = list(dict.fromkeys(tank.strip() for tank in tank_ids.split(",") if tank.strip()))
+    if not requested:
+        raise HTTPException(status_code=400, detail="tank_ids must name at least one tank")
+    if user and not user.is_admin and user.subscription_tier in SUBSCRIPTION_TIERS:
+        max_tanks = SUBSCRIPTION_TIERS[user.subscription_tier].max_tanks
+        if len(requested) > max_tanks:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Your subscription allows up to {max_tanks} tanks per request"
+            )
+    if resolution is not None and resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid resolution. Must be one of: {', '.join(RESOLUTIONS)}")
+    if downsample is not None and downsample not in DOWNSAMPLE_METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid downsample method. Must be one of: {', '.join(DOWNSAMPLE_METHODS)}")
+    if downsample and (resolution not in (None, "raw") or max_points is not None):
+        raise HTTPException(status_code=400, detail="downsample applies to raw readings and cannot be combined with a rollup resolution")
+    if start or end:
+        days = None
+    start, end = history_window(user, start, end)
 
-        # Filter by user_id if user is authenticated
-        if user and not user.is_admin:
-            # For mock data, we'll just assign some data to the user
-            if 'user_id' not in df.columns:
-                df['user_id'] = user.username  # Assign all data to this user for mock data
-            else:
-                df['user_id'] = df['user_id'].fillna(user.username)
-                df = df[df['user_id'] == user.username]
-
-        # Apply subscription tier limits
-        if user:
-            if user.subscription_tier == "free":
-                # Free tier: 7 days of history
-                cutoff_date = datetime.now() - timedelta(days=7)
-                df = df[df['timestamp'] >= cutoff_date]
-            elif user.subscription_tier == "basic":
-                # Basic tier: 30 days of history
-                cutoff_date = datetime.now() - timedelta(days=30)
-                df = df[df['timestamp'] >= cutoff_date]
-            # Premium tier: unlimited history
-
-        # Calculate statistics
-        if len(df) == 0:
-            return {
-                "count": 0,
-                "min_level": None,
-                "max_level": None,
-                "avg_level": None,
-                "std_dev": None,
-                "current_level": None,
-                "last_updated": None
-            }
+    try:
+        # Reading and summarizing many tanks is CPU-bound, so stay off the event loop
+        used_resolution, df, stats = await asyncio.get_running_loop().run_in_executor(None, partial(
+            api_service.fetch_fleet,
+            requested, days, start=start, user_id=history_owner(user), end=end,
+            resolution=resolution, max_points=max_points,
+            lttb_points=points if downsample == "lttb" else None
+        ))
+        df = show_owner(df, user)
+        if 'user_id' in df.columns:
+            # Tanks without owners leave NaN after concatenation; JSON needs null
+            df['user_id'] = df['user_id'].astype(object).where(df['user_id'].notna(), None)
+
+        # One sort and one grouping for every tank (newest first within each tank)
+        df = df.sort_values(['tank_id', 'timestamp'], ascending=[True, False])
+        levels = {tank: group.to_dict('records') for tank, group in df.groupby('tank_id', sort=False)}
 
-        stats = {
-            "count": len(df),
-            "min_level": float(df['level'].min()),
-            "max_level": float(df['level'].max()),
-            "avg_level": float(df['level'].mean()),
-            "std_dev": float(df['level'].std()),
-            "current_level": float(df.sort_values('timestamp', ascending=False).iloc[0]['level']),
-            "last_updated": df.sort_values('timestamp', ascending=False).iloc[0]['timestamp'].isoformat()
+        return {
+            "resolution": used_resolution,
+            "tanks": {
+                tank: {"levels": levels.get(tank, []), "stats": stats[tank]}
+                for tank in requested if tank in stats
+            },
+            "missing": [tank for tank in requested if tank not in stats],
         }
-
-        return stats
     except Exception as e:
-        logger.error(f"Error getting stats: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
+        logger.error(f"Error getting fleet levels: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting fleet levels: {str(e)}")
 
 # Define subscription tiers
 SUBSCRIPTION_TIERS = {
@@ -440,6 +643,105 @@ async def get_current_subscription(user: Optional[UserInDB] = Depends(get_user_f
 
     return subscription_info
 
+# Retention: each owner's readings are kept for their tier's max_history_days
+def owner_retention_days() -> Dict[str, Optional[int]]:
+    """Get the retention window in days for every known user"""
+    return {
+        username: SUBSCRIPTION_TIERS.get(user.subscription_tier, SUBSCRIPTION_TIERS["free"]).max_history_days
+        for username, user in auth.get_users().items()
+    }
+
+retention_service = RetentionService(api_service, owner_retention_days)
+retention_service.start()
+
+@app.get("/api/retention/status")
+async def get_retention_status(user: Optional[UserInDB] = Depends(get_user_from_header)):
+    """Get the retention configuration, storage size and last run report (admin only)"""
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to view retention status",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if not user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only administrators can view retention status"
+        )
+
+    return {**retention_service.get_status(), "storage_bytes": api_service.store.storage_bytes()}
+
+@app.post("/api/retention/run")
+async def run_retention(user: Optional[UserInDB] = Depends(get_user_from_header)):
+    """Apply retention and compact storage now (admin only)"""
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to run retention",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if not user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only administrators can run retention"
+        )
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, retention_service.run_once)
+    except Exception as e:
+        logger.error(f"Error running retention: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error running retention: {str(e)}")
+
+@app.get("/api/storage/stats")
+async def get_storage_stats(user: Optional[UserInDB] = Depends(get_user_from_header)):
+    """Get on-disk bytes and bytes per point for each tank (admin only)"""
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to view storage statistics",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if not user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only administrators can view storage statistics"
+        )
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, api_service.storage_stats)
+    except Exception as e:
+        logger.error(f"Error getting storage statistics: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting storage statistics: {str(e)}")
+
+@app.get("/api/ingest/status")
+async def get_ingest_status(user: Optional[UserInDB] = Depends(get_user_from_header)):
+    """Get the ingestion bus and write-behind buffer configuration, queue depths and latencies (admin only)"""
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required to view ingest status",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if not user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only administrators can view ingest status"
+        )
+
+    return {**api_service.ingest.get_status(), "bus": ingestion_bus.get_status()}
+
+@app.on_event("shutdown")
+def stop_background_services():
+    """Stop retention, write out readings still waiting in the ingestion bus and ingest buffer, and stop the anomaly job pool"""
+    retention_service.stop()
+    ingestion_bus.stop()
+    api_service.ingest.stop()
+    api_service.anomaly_jobs.shutdown()
+
 # User-reported anomalies endpoints
 @app.post("/api/user-anomalies", response_model=UserReportedAnomaly)
 async def report_anomaly(
@@ -470,6 +772,7 @@ async def report_anomaly(
 
         # Add to in-memory storage
         user_reported_anomalies.append(new_anomaly.dict())
+        user_anomaly_index.add(to_epoch_us(new_anomaly.timestamp), new_anomaly.tank_id, len(user_reported_anomalies) - 1)
 
         # In a real implementation, you would save to a database here
 
@@ -480,11 +783,14 @@ async def report_anomaly(
 
 @app.get("/api/user-anomalies", response_model=List[UserReportedAnomaly])
 async def get_user_reported_anomalies(
+    response: Response,
     tank_id: Optional[str] = Query(None, description="Tank ID to filter by"),
     status: Optional[str] = Query(None, description="Status to filter by (pending, confirmed, rejected)"),
+    limit: Optional[int] = Query(None, gt=0, le=MAX_PAGE_SIZE, description="Page size for keyset pagination"),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the previous page's {NEXT_CURSOR_HEADER} header"),
     user: Optional[UserInDB] = Depends(get_user_from_header)
 ):
-    """Get user-reported anomalies"""
+    """Get user-reported anomalies (newest first, one page at a time when limit is given)"""
     global user_reported_anomalies
 
     # Check if user is authenticated
@@ -495,6 +801,26 @@ async def get_user_reported_anomalies(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    if cursor is not None and limit is None:
+        raise HTTPException(status_code=400, detail="cursor requires limit")
+    if limit is not None:
+        try:
+            page_after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        def matches(position: int) -> bool:
+            anomaly = user_reported_anomalies[position]
+            return ((not tank_id or anomaly['tank_id'] == tank_id)
+                    and (not status or anomaly['status'] == status)
+                    and (user.is_admin or anomaly['user_id'] == user.username))
+
+        # Walk the sorted index from the cursor instead of sorting every report
+        positions, last_key = user_anomaly_index.page(limit, page_after, matches)
+        if last_key:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last_key)
+        return [user_reported_anomalies[position] for position in positions]
+
     try:
         # Convert to DataFrame for easier filtering
         if not user_reported_anomalies:
@@ -574,7 +900,6 @@ async def mark_anomaly_as_normal(
     user: Optional[UserInDB] = Depends(get_user_from_header)
 ):
     """Mark an anomaly as normal to improve the model"""
-    global anomaly_feedback
 
     # Check if user is authenticated
     if not user:
@@ -589,23 +914,8 @@ async def mark_anomaly_as_normal(
         feedback_dict = feedback.dict()
         feedback_dict["user_id"] = user.username
 
-        # Check if this feedback already exists
-        existing_feedback = next(
-            (f for f in anomaly_feedback if
-             f["timestamp"] == feedback_dict["timestamp"] and
-             f["level"] == feedback_dict["level"] and
-             f["tank_id"] == feedback_dict["tank_id"]),
-            None
-        )
-
-        if existing_feedback:
-            # Update existing feedback
-            existing_feedback.update(feedback_dict)
-            result = existing_feedback
-        else:
-            # Add new feedback
-            anomaly_feedback.append(feedback_dict)
-            result = feedback_dict
+        # Add the feedback, updating earlier feedback on the same reading
+        result = api_service.anomaly_feedback.add(feedback_dict)
 
         # In a real implementation, you would save to a database here
 
@@ -854,7 +1164,10 @@ async def get_mqtt_status(user: Optional[UserInDB] = Depends(get_user_from_heade
         )
 
 @app.get("/api/mqtt/data")
-async def get_mqtt_data(user: Optional[UserInDB] = Depends(get_user_from_header)):
+async def get_mqtt_data(
+    since: int = Query(0, ge=0, description="Only return readings with a seq greater than this"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
     """Get tank data received from MQTT"""
     # Check if user is authenticated
     if not user:
@@ -866,14 +1179,7 @@ async def get_mqtt_data(user: Optional[UserInDB] = Depends(get_user_from_header)
 
     try:
         # Get tank data from MQTT
-        tank_data = mqtt_client.get_tank_data()
-
-        # Convert datetime objects to ISO format strings
-        for item in tank_data:
-            if isinstance(item.get("timestamp"), datetime):
-                item["timestamp"] = item["timestamp"].isoformat()
-
-        return tank_data
+        return mqtt_client.get_tank_data(since)
     except Exception as e:
         logger.error(f"Error getting MQTT data: {str(e)}")
         raise HTTPException(
@@ -1027,7 +1333,10 @@ async def test_rest_connection(user: Optional[UserInDB] = Depends(get_user_from_
         return {"success": False, "message": f"Error testing connection: {str(e)}"}
 
 @app.get("/api/rest/data")
-async def get_rest_data(user: Optional[UserInDB] = Depends(get_user_from_header)):
+async def get_rest_data(
+    since: int = Query(0, ge=0, description="Only return readings with a seq greater than this"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
     """Get tank data from REST API"""
     # Check if user is authenticated
     if not user:
@@ -1039,7 +1348,7 @@ async def get_rest_data(user: Optional[UserInDB] = Depends(get_user_from_header)
 
     try:
         # Get tank data
-        tank_data = rest_api_client.get_tank_data()
+        tank_data = rest_api_client.get_tank_data(since)
 
         return tank_data
     except Exception as e:
@@ -1235,7 +1544,10 @@ async def test_graphql_connection(user: Optional[UserInDB] = Depends(get_user_fr
         return {"success": False, "message": f"Error testing connection: {str(e)}"}
 
 @app.get("/api/graphql/data")
-async def get_graphql_data(user: Optional[UserInDB] = Depends(get_user_from_header)):
+async def get_graphql_data(
+    since: int = Query(0, ge=0, description="Only return readings with a seq greater than this"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
     """Get tank data from GraphQL API"""
     # Check if user is authenticated
     if not user:
@@ -1247,7 +1559,7 @@ async def get_graphql_data(user: Optional[UserInDB] = Depends(get_user_from_head
 
     try:
         # Get tank data
-        tank_data = graphql_client.get_tank_data()
+        tank_data = graphql_client.get_tank_data(since)
 
         return tank_data
     except Exception as e:
@@ -1515,7 +1827,10 @@ async def stop_opcua_monitoring(user: Optional[UserInDB] = Depends(get_user_from
         return {"success": False, "message": f"Error stopping monitoring: {str(e)}"}
 
 @app.get("/api/opcua/data")
-async def get_opcua_data(user: Optional[UserInDB] = Depends(get_user_from_header)):
+async def get_opcua_data(
+    since: int = Query(0, ge=0, description="Only return readings with a seq greater than this"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
     """Get tank data from OPC UA server"""
     # Check if user is authenticated
     if not user:
@@ -1527,7 +1842,7 @@ async def get_opcua_data(user: Optional[UserInDB] = Depends(get_user_from_header
 
     try:
         # Get tank data
-        tank_data = opcua_client.get_tank_data()
+        tank_data = opcua_client.get_tank_data(since)
 
         return tank_data
     except Exception as e:
@@ -1797,7 +2112,10 @@ async def stop_modbus_monitoring(user: Optional[UserInDB] = Depends(get_user_fro
         return {"success": False, "message": f"Error stopping monitoring: {str(e)}"}
 
 @app.get("/api/modbus/data")
-async def get_modbus_data(user: Optional[UserInDB] = Depends(get_user_from_header)):
+async def get_modbus_data(
+    since: int = Query(0, ge=0, description="Only return readings with a seq greater than this"),
+    user: Optional[UserInDB] = Depends(get_user_from_header)
+):
     """Get tank data from Modbus registers"""
     # Check if user is authenticated
     if not user:
@@ -1809,7 +2127,7 @@ async def get_modbus_data(user: Optional[UserInDB] = Depends(get_user_from_heade
 
     try:
         # Get tank data
-        tank_data = modbus_client.get_tank_data()
+        tank_data = modbus_client.get_tank_data(since)
 
         return tank_data
     except Exception as e:
@@ -8,6 +8,8 @@ from datetime import datetime
 from pymodbus.client import ModbusTcpClient, ModbusSerialClient
 from pymodbus.exceptions import ModbusException, ConnectionException
 from pymodbus.pdu import ExceptionResponse
+from ingestion_bus import ingestion_bus
+from ring_buffer import ReadingRing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -28,7 +30,7 @@ class ModbusClient:
         self.config = self._load_config()
         self.connected = False
         self.last_error = None
-        self.tank_data = []
+        self.tank_data = ReadingRing("modbus")
         self.client = None
         self.monitoring_thread = None
         self.stop_monitoring = False
@@ -475,6 +477,7 @@ class ModbusClient:
                         
                         results.append(tank_data)
                         self.tank_data.append(tank_data)
+                        ingestion_bus.publish(tank_data, "modbus")
                         
                 except Exception as e:
                     logger.warning(f"Error reading register for tank {register.get('tank_id')}: {str(e)}")
@@ -487,13 +490,13 @@ class ModbusClient:
             logger.error(f"Error fetching tank data from Modbus registers: {str(e)}")
             return []
     
-    def get_tank_data(self) -> List[Dict[str, Any]]:
-        """Get collected tank data"""
-        return self.tank_data.copy()
+    def get_tank_data(self, since: int = 0) -> List[Dict[str, Any]]:
+        """Get collected tank data newer than a sequence number"""
+        return self.tank_data.since(since)
     
     def clear_tank_data(self) -> None:
         """Clear collected tank data"""
-        self.tank_data = []
+        self.tank_data.clear()
         logger.info("Cleared Modbus tank data")
 
 # Create a singleton instance
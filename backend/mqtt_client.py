@@ -6,6 +6,8 @@ import time
 import threading
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from ingestion_bus import ingestion_bus
+from ring_buffer import ReadingRing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -27,7 +29,7 @@ class MQTTClient:
         self.client = None
         self.connected = False
         self.last_error = None
-        self.tank_data = []
+        self.tank_data = ReadingRing("mqtt")
         
         # Initialize client if enabled
         if self.config.get("enabled", False):
@@ -249,19 +251,20 @@ class MQTTClient:
                     
                     # Add to tank data
                     self.tank_data.append(data)
+                    ingestion_bus.publish(data, "mqtt")
                     logger.info(f"Added tank data from MQTT: {data}")
             except json.JSONDecodeError:
                 logger.warning(f"Received non-JSON MQTT message: {payload}")
         except Exception as e:
             logger.error(f"Error processing MQTT message: {str(e)}")
     
-    def get_tank_data(self) -> List[Dict[str, Any]]:
-        """Get collected tank data"""
-        return self.tank_data.copy()
+    def get_tank_data(self, since: int = 0) -> List[Dict[str, Any]]:
+        """Get collected tank data newer than a sequence number"""
+        return self.tank_data.since(since)
     
     def clear_tank_data(self) -> None:
         """Clear collected tank data"""
-        self.tank_data = []
+        self.tank_data.clear()
         logger.info("Cleared MQTT tank data")
 
 # Create a singleton instance
@@ -9,6 +9,8 @@ from opcua import Client, ua
 from opcua.ua import NodeId, QualifiedName
 from opcua.crypto import security_policies
 from opcua.ua.uaerrors import UaStatusCodeError
+from ingestion_bus import ingestion_bus
+from ring_buffer import ReadingRing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -29,7 +31,7 @@ class OpcUaClient:
         self.config = self._load_config()
         self.connected = False
         self.last_error = None
-        self.tank_data = []
+        self.tank_data = ReadingRing("opcua")
         self.client = None
         self.subscription = None
         self.subscription_handle = None
@@ -428,6 +430,7 @@ class OpcUaClient:
 
                     results.append(tank_data)
                     self.tank_data.append(tank_data)
+                    ingestion_bus.publish(tank_data, "opcua")
 
                 except Exception as e:
                     logger.warning(f"Error getting data for tank {tank_node.get_browse_name().Name}: {str(e)}")
@@ -440,13 +443,13 @@ class OpcUaClient:
             logger.error(f"Error fetching tank data from OPC UA server: {str(e)}")
             return []
 
-    def get_tank_data(self) -> List[Dict[str, Any]]:
-        """Get collected tank data"""
-        return self.tank_data.copy()
+    def get_tank_data(self, since: int = 0) -> List[Dict[str, Any]]:
+        """Get collected tank data newer than a sequence number"""
+        return self.tank_data.since(since)
 
     def clear_tank_data(self) -> None:
         """Clear collected tank data"""
-        self.tank_data = []
+        self.tank_data.clear()
         logger.info("Cleared OPC UA tank data")
 
 # Create a singleton instance
@@ -0,0 +1,92 @@
+import base64
+import bisect
+import json
+import logging
+from typing import Callable, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 10000
+
+# Sort key of a row in newest-first keyset order: (epoch microseconds, tank_id, tie-breaker)
+Key = Tuple[int, str, int]
+
+
+def encode_cursor(key: Key) -> str:
+    """
+    Encode the key of the last row on a page as an opaque cursor
+
+    Args:
+        key: (timestamp in epoch microseconds, tank_id, tie-breaker)
+
+    Returns:
+        URL-safe cursor string
+    """
+    data = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Key:
+    """
+    Decode a cursor created by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp_us, tank_id, tie = json.loads(data)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+    if not isinstance(timestamp_us, int) or not isinstance(tank_id, str) or not isinstance(tie, int):
+        raise ValueError("Invalid cursor")
+    return timestamp_us, tank_id, tie
+
+
+class KeysetIndex:
+    """Sorted (timestamp, tank_id, position) keys over an append-only list
+
+    Lets newest-first pages be served by bisecting to the cursor and walking
+    backwards, instead of sorting the whole list on every request.
+    """
+
+    def __init__(self):
+        self._keys: List[Key] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, timestamp_us: int, tank_id: str, position: int) -> None:
+        """Index the item stored at `position`"""
+        bisect.insort(self._keys, (timestamp_us, tank_id, position))
+
+    def page(self, limit: int, cursor: Optional[Key] = None,
+             matches: Optional[Callable[[int], bool]] = None) -> Tuple[List[int], Optional[Key]]:
+        """
+        Get one newest-first page of item positions
+
+        Args:
+            limit: Maximum number of positions to return
+            cursor: Key of the last item on the previous page
+            matches: Optional filter called with each candidate position
+
+        Returns:
+            Tuple of (positions, key of the last one, or None when the list is exhausted)
+        """
+        end = bisect.bisect_left(self._keys, cursor) if cursor is not None else len(self._keys)
+        positions: List[int] = []
+        index = end - 1
+        while index >= 0 and len(positions) < limit:
+            position = self._keys[index][2]
+            if matches is None or matches(position):
+                positions.append(position)
+            index -= 1
+
+        # A full page may be followed by an empty one; that is cheaper than looking ahead
+        if len(positions) < limit:
+            return positions, None
+        return positions, self._keys[index + 1]
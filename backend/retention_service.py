@@ -0,0 +1,239 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable
+import numpy as np
+import pandas as pd
+from tank_storage import TankSeries, from_epoch_us, to_epoch_us
+from tank_rollups import MICROSECONDS, aggregate
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_RETENTION_CONFIG = {
+    "enabled": True,
+    "interval_hours": 24,
+    "mode": "drop",                 # drop or downsample expired readings
+    "downsample_resolution": "1h",  # bucket width used by downsample mode
+    "unowned_days": 365,            # retention for readings without a user_id (null keeps them forever)
+    "compact_after_days": 31,       # merge segments of months that ended this long ago
+    "cold_after_days": 92           # compress months that ended this long ago (null disables)
+}
+RETENTION_MODES = ["drop", "downsample"]
+NO_CUTOFF = np.iinfo(np.int64).min
+
+
+def apply_retention(series: TankSeries, cutoffs: Dict[Optional[str], Optional[int]],
+                    mode: str = "drop", width_us: int = MICROSECONDS["1h"]) -> Optional[TankSeries]:
+    """
+    Drop or downsample the readings of a tank that fall outside their owner's window
+
+    Args:
+        series: Full, sorted tank history
+        cutoffs: Epoch-microsecond cutoff per owner (None key: unowned readings;
+            None value: keep forever)
+        mode: "drop" removes expired readings, "downsample" replaces them with
+            one mean reading per owner per bucket
+        width_us: Bucket width for downsample mode
+
+    Returns:
+        The retained series, or None if nothing changed
+    """
+    if len(series) == 0:
+        return None
+
+    def cutoff_for(owner: Optional[str]) -> int:
+        value = cutoffs.get(owner, cutoffs.get(None))
+        return NO_CUTOFF if value is None else value
+
+    # One cutoff per distinct owner, broadcast to readings through factorized codes
+    if series.user_ids is None:
+        codes = np.full(len(series), -1, dtype=np.int64)
+        owners = np.empty(0, dtype=object)
+    else:
+        codes, owners = pd.factorize(series.user_ids, use_na_sentinel=True)
+    table = np.array([cutoff_for(owner) for owner in owners] + [cutoff_for(None)], dtype=np.int64)
+    expired = series.timestamps < table[codes]  # code -1 picks the unowned cutoff
+
+    if not expired.any():
+        return None
+
+    keep = ~expired
+    timestamps = [series.timestamps[keep]]
+    levels = [series.levels[keep]]
+    user_ids = [series.user_ids[keep]] if series.user_ids is not None else None
+
+    if mode == "downsample":
+        for code in np.unique(codes[expired]):
+            selected = expired & (codes == code)
+            columns = aggregate(series.timestamps[selected], series.levels[selected], width_us)
+            timestamps.append(columns["bucket"])
+            levels.append((columns["sum"] / columns["count"]).astype(np.float32))
+            if user_ids is not None:
+                owner = owners[code] if code >= 0 else None
+                user_ids.append(np.full(len(columns["bucket"]), owner, dtype=object))
+
+    all_timestamps = np.concatenate(timestamps)
+    order = np.argsort(all_timestamps, kind="stable")
+    result = TankSeries(
+        series.tank_id,
+        all_timestamps[order],
+        np.concatenate(levels).astype(np.float32)[order],
+        np.concatenate(user_ids)[order] if user_ids is not None else None,
+    )
+
+    # Readings already downsampled on an earlier pass come back unchanged
+    if len(result) == len(series) and np.array_equal(result.timestamps, series.timestamps):
+        return None
+    return result
+
+
+class RetentionService:
+    """Background job that enforces per-owner retention and compacts storage
+
+    Each run computes a cutoff for every owner from their subscription tier,
+    rewrites the segments holding expired readings, merges small segments of old
+    months, compresses cold months and reports how many bytes that reclaimed.
+    """
+
+    def __init__(self, api_service, owner_retention: Callable[[], Dict[str, Optional[int]]]):
+        """
+        Initialize the service
+
+        Args:
+            api_service: TankAPIService whose store, cache and rollups are maintained
+            owner_retention: Returns retention days per user_id (None: keep forever)
+        """
+        self.api_service = api_service
+        self.owner_retention = owner_retention
+        self.config = {**DEFAULT_RETENTION_CONFIG, **api_service.config.get("retention", {})}
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.last_error = None
+        self.running = False
+        self._thread = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+
+    def _cutoffs(self, now: datetime) -> Dict[Optional[str], Optional[int]]:
+        """Convert retention days per owner into epoch-microsecond cutoffs"""
+        def cutoff(days: Optional[int]) -> Optional[int]:
+            return to_epoch_us(now - timedelta(days=days)) if days is not None else None
+
+        cutoffs = {owner: cutoff(days) for owner, days in self.owner_retention().items()}
+        cutoffs[None] = cutoff(self.config.get("unowned_days"))
+        return cutoffs
+
+    def run_once(self) -> Dict[str, Any]:
+        """
+        Apply retention to every tank, then compact the store
+
+        Returns:
+            Report with reading counts of the rewritten range per tank and bytes reclaimed
+        """
+        with self._run_lock:
+            started_at = datetime.now()
+            store = self.api_service.store
+            mode = self.config.get("mode", "drop")
+            if mode not in RETENTION_MODES:
+                logger.warning(f"Unknown retention mode '{mode}', using drop")
+                mode = "drop"
+            width_us = MICROSECONDS.get(self.config.get("downsample_resolution"), MICROSECONDS["1h"])
+            cutoffs = self._cutoffs(started_at)
+
+            bytes_before = store.storage_bytes()
+            tanks = {}
+            # No reading at or after the latest cutoff can expire, so newer history is never read
+            finite = [cutoff for cutoff in cutoffs.values() if cutoff is not None]
+            before = from_epoch_us(max(finite)) if finite else None
+
+            def retain(series: TankSeries) -> Optional[TankSeries]:
+                return apply_retention(series, cutoffs, mode, width_us)
+
+            for tank_id in (store.tank_ids() if before is not None else []):
+                # Hold the history lock per tank so writers are only paused briefly
+                with self.api_service.history_lock:
+                    replaced = store.expire(tank_id, before, retain)
+                    if replaced is None:
+                        continue
+                    start_us, end_us, readings_before, retained = replaced
+                    # Patch the derived state for the replaced days instead of rebuilding it
+                    if self.api_service.cache is not None:
+                        self.api_service.cache.replace_range(tank_id, start_us, end_us, retained)
+                    self.api_service.rollups.replace_range(tank_id, start_us, end_us, retained)
+                    self.api_service.anomaly_flags.replace_range(tank_id, start_us, end_us, retained)
+                    self.api_service.anomaly_detectors.replace_range(tank_id, start_us, end_us, retained)
+                tanks[tank_id] = {"readings_before": readings_before, "readings_after": len(retained)}
+                logger.info(f"Retention rewrote {from_epoch_us(start_us).date()} to {from_epoch_us(end_us).date()} "
+                            f"of tank {tank_id}: {readings_before} -> {len(retained)} readings")
+
+            compact_before = started_at - timedelta(days=self.config.get("compact_after_days", 31))
+            with self.api_service.history_lock:
+                segments_merged = store.compact(compact_before)
+            blocks_encoded = 0
+            if self.config.get("cold_after_days") is not None:
+                cold_before = started_at - timedelta(days=self.config["cold_after_days"])
+                with self.api_service.history_lock:
+                    blocks_encoded = store.encode_cold(cold_before)
+            bytes_after = store.storage_bytes()
+
+            self.last_report = {
+                "started_at": started_at.isoformat(),
+                "finished_at": datetime.now().isoformat(),
+                "mode": mode,
+                "tanks": tanks,
+                "readings_removed": sum(t["readings_before"] - t["readings_after"] for t in tanks.values()),
+                "segments_merged": segments_merged,
+                "blocks_encoded": blocks_encoded,
+                "bytes_before": bytes_before,
+                "bytes_after": bytes_after,
+                "bytes_reclaimed": bytes_before - bytes_after,
+            }
+            logger.info(f"Retention run reclaimed {bytes_before - bytes_after} bytes "
+                        f"across {len(tanks)} tanks, merged {segments_merged} segments")
+            return self.last_report
+
+    def _thread_func(self) -> None:
+        """Run retention every interval_hours until stopped"""
+        interval = self.config.get("interval_hours", 24) * 3600
+        while not self._stop.wait(interval):
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error running retention: {str(e)}")
+        logger.info("Retention thread stopped")
+
+    def start(self) -> bool:
+        """Start the scheduled retention thread"""
+        if not self.config.get("enabled", True):
+            logger.info("Retention is disabled")
+            return False
+        if self._thread and self._thread.is_alive():
+            return True
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._thread_func)
+        self._thread.daemon = True
+        self._thread.start()
+        self.running = True
+        logger.info(f"Started retention service (every {self.config.get('interval_hours', 24)} hours)")
+        return True
+
+    def stop(self) -> None:
+        """Stop the scheduled retention thread"""
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self.running = False
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the retention configuration and the last run's report"""
+        return {
+            "running": self.running,
+            "config": self.config,
+            "last_report": self.last_report,
+            "last_error": self.last_error,
+        }
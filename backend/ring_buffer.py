@@ -0,0 +1,146 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+import numpy as np
+from dateutil import tz
+from tank_storage import to_epoch_us
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+RECENT_READINGS = 1000  # readings each protocol client keeps for its /data endpoint
+
+
+def _timestamp_us(value: Any) -> int:
+    """Convert a datetime or ISO-8601 string to local epoch microseconds, defaulting to now"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = None
+    if not isinstance(value, datetime):
+        value = datetime.now()
+    if value.tzinfo is not None:
+        value = value.astimezone(tz.tzlocal()).replace(tzinfo=None)
+    return to_epoch_us(value)
+
+
+class ReadingRing:
+    """Fixed-capacity ring of recent readings with monotonically increasing sequence numbers
+
+    Readings are stored column-wise in preallocated arrays (tank IDs and
+    names interned as small integer codes), so memory stays constant however
+    long the client runs. Every appended reading gets the next sequence
+    number, starting at 1; since(seq) returns only readings newer than seq,
+    so a poller that remembers the last seq it saw pays for new readings only.
+    """
+
+    def __init__(self, source: str, capacity: int = RECENT_READINGS):
+        """
+        Initialize an empty ring
+
+        Args:
+            source: Protocol name reported on every reading
+            capacity: Number of readings kept; older ones are overwritten
+        """
+        self.source = source
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._timestamps = np.zeros(capacity, dtype=np.int64)
+        self._levels = np.zeros(capacity, dtype=np.float64)
+        self._tanks = np.zeros(capacity, dtype=np.int32)
+        self._names = np.zeros(capacity, dtype=np.int32)
+        self._strings: List[Optional[str]] = [None]
+        self._codes: Dict[str, int] = {}
+        self._next_seq = 1   # sequence number of the next reading
+        self._first_seq = 1  # oldest sequence number still readable (moves on clear)
+
+    def _code(self, value: Any) -> int:
+        """Intern a tank ID or name; 0 means None"""
+        if value is None:
+            return 0
+        value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._strings)
+            self._strings.append(value)
+        return code
+
+    def __len__(self) -> int:
+        return self._next_seq - max(self._first_seq, self._next_seq - self.capacity)
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest reading (0 if nothing was ever appended)"""
+        return self._next_seq - 1
+
+    def append(self, reading: Dict[str, Any]) -> int:
+        """
+        Store a reading dict, overwriting the oldest one when full
+
+        Args:
+            reading: Dict with 'tank_id', 'level' and optional 'timestamp' and 'name'
+
+        Returns:
+            The reading's sequence number
+        """
+        try:
+            level = float(reading.get("level", 0))
+        except (TypeError, ValueError):
+            level = float("nan")
+        timestamp_us = _timestamp_us(reading.get("timestamp"))
+
+        with self._lock:
+            seq = self._next_seq
+            slot = seq % self.capacity
+            self._timestamps[slot] = timestamp_us
+            self._levels[slot] = level
+            self._tanks[slot] = self._code(reading.get("tank_id"))
+            self._names[slot] = self._code(reading.get("name"))
+            self._next_seq = seq + 1
+        return seq
+
+    def since(self, seq: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Get readings newer than a sequence number, oldest first
+
+        Args:
+            seq: Last sequence number the caller has seen (0 for everything retained)
+            limit: Optional maximum number of readings, counted from the oldest
+
+        Returns:
+            Reading dicts with seq, tank_id, name, level, timestamp and source
+        """
+        with self._lock:
+            first = max(seq + 1, self._first_seq, self._next_seq - self.capacity)
+            last = self._next_seq
+            if limit is not None:
+                last = min(last, first + limit)
+            if first >= last:
+                return []
+
+            seqs = np.arange(first, last, dtype=np.int64)
+            slots = seqs % self.capacity
+            timestamps = self._timestamps[slots].astype("datetime64[us]").astype(str).tolist()
+            levels = self._levels[slots]
+            # Unparseable levels are kept as NaN but reported as null
+            levels = np.where(np.isnan(levels), None, levels).tolist()
+            strings = self._strings
+            tanks = [strings[code] for code in self._tanks[slots].tolist()]
+            names = [strings[code] for code in self._names[slots].tolist()]
+
+        source = self.source
+        return [
+            {"seq": s, "tank_id": tank, "name": name, "level": level, "timestamp": timestamp, "source": source}
+            for s, tank, name, level, timestamp in zip(seqs.tolist(), tanks, names, levels, timestamps)
+        ]
+
+    def clear(self) -> None:
+        """Drop all readings; sequence numbers keep increasing so pollers never see a reset"""
+        with self._lock:
+            self._first_seq = self._next_seq
+            self._strings = [None]
+            self._codes = {}
@@ -0,0 +1,208 @@
+import os
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterable
+import numpy as np
+from tank_storage import DATA_DIR, TankStorage, TankSeries, to_epoch_us, to_epoch_us_array, from_epoch_us
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+SQLITE_FILE = os.path.join(DATA_DIR, "tank_history.db")
+
+# Statements are kept as constants so sqlite3's statement cache reuses the
+# prepared form on every call
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tank_levels (
+    tank_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    level REAL NOT NULL,
+    user_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tank_levels_tank_timestamp ON tank_levels (tank_id, timestamp);
+"""
+INSERT_READING = "INSERT INTO tank_levels (tank_id, timestamp, level, user_id) VALUES (?, ?, ?, ?)"
+SELECT_RANGE = (
+    "SELECT timestamp, level, user_id FROM tank_levels "
+    "WHERE tank_id = ? AND timestamp BETWEEN ? AND ? "
+    "ORDER BY timestamp"
+)
+SELECT_RANGE_FOR_USER = (
+    "SELECT timestamp, level, user_id FROM tank_levels "
+    "WHERE tank_id = ? AND timestamp BETWEEN ? AND ? AND (user_id IS NULL OR user_id = ?) "
+    "ORDER BY timestamp"
+)
+SELECT_TANK_IDS = "SELECT DISTINCT tank_id FROM tank_levels ORDER BY tank_id"
+SELECT_LAST_TIMESTAMP = "SELECT MAX(timestamp) FROM tank_levels WHERE tank_id = ?"
+SELECT_FIRST_TIMESTAMP = "SELECT MIN(timestamp) FROM tank_levels WHERE tank_id = ?"
+SELECT_ANY = "SELECT 1 FROM tank_levels LIMIT 1"
+DELETE_TANK = "DELETE FROM tank_levels WHERE tank_id = ?"
+COUNT_TANK = "SELECT COUNT(*) FROM tank_levels WHERE tank_id = ?"
+COUNT_ALL = "SELECT COUNT(*) FROM tank_levels"
+
+# Bounds used when a range end is open
+MIN_EPOCH_US = -(2 ** 63)
+MAX_EPOCH_US = 2 ** 63 - 1
+
+
+class SQLiteTankStorage(TankStorage):
+    """Tank history in a SQLite table indexed on (tank_id, timestamp)
+
+    Range queries seek the composite index, so reading one tank's window costs
+    O(log n + rows) regardless of fleet size. The database runs in WAL mode so
+    readers don't block the writer.
+    """
+
+    def __init__(self, path: str = SQLITE_FILE):
+        """Open (or create) the database"""
+        self.path = path
+        self._lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, cached_statements=64)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        logger.info(f"Opened SQLite tank history at {path}")
+
+    def tank_ids(self) -> List[str]:
+        """Get the IDs of all tanks with stored history"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(SELECT_TANK_IDS)]
+
+    def is_empty(self) -> bool:
+        """Check whether any readings have been stored"""
+        with self._lock:
+            return self._conn.execute(SELECT_ANY).fetchone() is None
+
+    def last_timestamp(self, tank_id: str) -> Optional[datetime]:
+        """Get the timestamp of the newest reading stored for a tank"""
+        with self._lock:
+            value = self._conn.execute(SELECT_LAST_TIMESTAMP, (tank_id,)).fetchone()[0]
+        return from_epoch_us(value) if value is not None else None
+
+    def first_timestamp(self, tank_id: str) -> Optional[datetime]:
+        """Get the timestamp of the oldest reading stored for a tank"""
+        with self._lock:
+            value = self._conn.execute(SELECT_FIRST_TIMESTAMP, (tank_id,)).fetchone()[0]
+        return from_epoch_us(value) if value is not None else None
+
+    def append(self, readings: Iterable[Dict[str, Any]]) -> int:
+        """
+        Insert readings in a single transaction
+
+        Args:
+            readings: Readings with 'timestamp', 'level' and 'tank_id' keys
+
+        Returns:
+            Number of readings written
+        """
+        readings = list(readings)
+        if not readings:
+            return 0
+
+        timestamps = to_epoch_us_array([item["timestamp"] for item in readings])
+        rows = [
+            (str(item.get("tank_id", "tank1")), int(timestamp), float(item["level"]), item.get("user_id"))
+            for item, timestamp in zip(readings, timestamps)
+        ]
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(INSERT_READING, rows)
+
+        return len(rows)
+
+    def append_series(self, series_list: List[TankSeries]) -> int:
+        """Insert columnar batches for several tanks in a single transaction"""
+        rows = []
+        for series in series_list:
+            user_ids = series.user_ids if series.user_ids is not None else [None] * len(series)
+            rows.extend(zip([series.tank_id] * len(series), series.timestamps.tolist(),
+                            series.levels.tolist(), user_ids))
+        if not rows:
+            return 0
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(INSERT_READING, rows)
+        return len(rows)
+
+    def read_series(self, tank_id: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, user_id: Optional[str] = None) -> TankSeries:
+        """Read one tank's window with an index range scan, filtering owners in SQL"""
+        start_us = to_epoch_us(start) if start else MIN_EPOCH_US
+        end_us = to_epoch_us(end) if end else MAX_EPOCH_US
+
+        with self._lock:
+            if user_id is None:
+                rows = self._conn.execute(SELECT_RANGE, (tank_id, start_us, end_us)).fetchall()
+            else:
+                rows = self._conn.execute(SELECT_RANGE_FOR_USER, (tank_id, start_us, end_us, user_id)).fetchall()
+
+        if not rows:
+            return TankSeries.empty(tank_id)
+
+        timestamps, levels, user_ids = zip(*rows)
+        owners = None
+        if any(owner is not None for owner in user_ids):
+            owners = np.asarray(user_ids, dtype=object)
+
+        return TankSeries(
+            tank_id,
+            np.asarray(timestamps, dtype=np.int64),
+            np.asarray(levels, dtype=np.float32),
+            owners,
+        )
+
+    def rewrite(self, tank_id: str, series: TankSeries) -> None:
+        """Replace a tank's rows in a single transaction"""
+        user_ids = series.user_ids if series.user_ids is not None else [None] * len(series)
+        rows = [
+            (tank_id, timestamp, level, user_id)
+            for timestamp, level, user_id in zip(series.timestamps.tolist(), series.levels.tolist(), user_ids)
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.execute(DELETE_TANK, (tank_id,))
+                self._conn.executemany(INSERT_READING, rows)
+
+    def compact(self, before: datetime) -> int:
+        """VACUUM so deleted rows give their pages back, then truncate the WAL"""
+        with self._lock:
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return 0
+
+    def storage_bytes(self) -> int:
+        """Get the size of the database and its WAL"""
+        return sum(
+            os.path.getsize(path) for path in (self.path, self.path + "-wal", self.path + "-shm")
+            if os.path.exists(path)
+        )
+
+    def tank_bytes(self, tank_id: str) -> int:
+        """Estimate one tank's share of the database by its share of the rows"""
+        with self._lock:
+            rows = self._conn.execute(COUNT_TANK, (tank_id,)).fetchone()[0]
+            total = self._conn.execute(COUNT_ALL).fetchone()[0]
+        return int(self.storage_bytes() * rows / total) if total else 0
+
+    def sync(self) -> None:
+        """
+        Checkpoint the WAL
+
+        With synchronous=NORMAL commits are not fsynced; a checkpoint syncs
+        the WAL and copies it into the database file.
+        """
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self) -> None:
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
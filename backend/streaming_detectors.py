@@ -0,0 +1,461 @@
+import bisect
+import logging
+import math
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional, Tuple, Type
+import numpy as np
+import pandas as pd
+from anomaly_feedback import FeedbackIndex
+from tank_storage import TankSeries, from_epoch_us
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+ISOLATION_FOREST = "isolation_forest"
+DEFAULT_DETECTOR_CONFIG = {
+    "default_method": ISOLATION_FOREST,  # engine for tanks not listed in tank_methods
+    "tank_methods": {},                  # per-tank engine, e.g. {"tank1": "ewma"}
+    "ewma": {"alpha": 0.05, "warmup": 30},
+    "mad": {"window": 61, "warmup": 30},
+    "hst": {"trees": 25, "depth": 8, "window": 250, "seed": 42}
+}
+RANK_BINS = 400          # score histogram resolution
+RANK_DECAY_AFTER = 100000  # halve the histogram after this many scores so it follows drift
+FLAG_DTYPES = {"timestamps": np.int64, "levels": np.float32, "ranks": np.float64, "user_ids": object}
+FLAG_COLUMNS = list(FLAG_DTYPES)
+INITIAL_FLAG_CAPACITY = 64
+
+
+class StreamingDetector:
+    """A detector that scores one reading at a time from constant-size state
+
+    update() scores a level against the state built from the readings before
+    it, then folds the level into the state. Scores are non-negative and
+    larger means more anomalous; None means the detector is still warming up.
+    MAX_SCORE bounds the score histogram used to rank scores.
+    """
+
+    MAX_SCORE = 20.0
+
+    def __init__(self, **params):
+        self.params = params
+
+    def update(self, level: float) -> Optional[float]:
+        raise NotImplementedError
+
+
+class EWMADetector(StreamingDetector):
+    """Z-score against an exponentially weighted mean and variance"""
+
+    def __init__(self, alpha: float = 0.05, warmup: int = 30):
+        super().__init__(alpha=alpha, warmup=warmup)
+        self.alpha = alpha
+        self.warmup = warmup
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def update(self, level: float) -> Optional[float]:
+        score = None
+        if self.count >= self.warmup:
+            deviation = abs(level - self.mean)
+            score = deviation / math.sqrt(self.var) if self.var > 0 else (0.0 if deviation == 0 else self.MAX_SCORE)
+
+        self.count += 1
+        if self.count == 1:
+            self.mean = level
+        else:
+            delta = level - self.mean
+            self.mean += self.alpha * delta
+            self.var = (1 - self.alpha) * (self.var + self.alpha * delta * delta)
+        return score
+
+
+class MADDetector(StreamingDetector):
+    """Robust z-score against the median and MAD of the last `window` readings
+
+    The median is exact. Recomputing the MAD for every reading would sort the
+    window each time, so each reading's deviation is instead taken from the
+    median when it arrives and the MAD is the median of the last `window`
+    such deviations. Both windows are kept sorted, so an update costs a
+    binary search and a shift of at most `window` floats.
+    """
+
+    MAD_SCALE = 1.4826  # MAD to standard deviation for normal data
+
+    def __init__(self, window: int = 61, warmup: int = 30):
+        super().__init__(window=window, warmup=warmup)
+        self.window = window
+        self.warmup = min(warmup, window)
+        self.recent = deque()
+        self.sorted: List[float] = []
+        self.recent_deviations = deque()
+        self.sorted_deviations: List[float] = []
+
+    @staticmethod
+    def _push(recent: deque, ordered: List[float], value: float, window: int) -> None:
+        recent.append(value)
+        bisect.insort(ordered, value)
+        if len(recent) > window:
+            del ordered[bisect.bisect_left(ordered, recent.popleft())]
+
+    def update(self, level: float) -> Optional[float]:
+        score = None
+        if self.recent:
+            median = self.sorted[len(self.sorted) // 2]
+            deviation = abs(level - median)
+            if len(self.recent) >= self.warmup and self.sorted_deviations:
+                mad = self.sorted_deviations[len(self.sorted_deviations) // 2] * self.MAD_SCALE
+                score = deviation / mad if mad > 0 else (0.0 if deviation == 0 else self.MAX_SCORE)
+            self._push(self.recent_deviations, self.sorted_deviations, deviation, self.window)
+        self._push(self.recent, self.sorted, level, self.window)
+        return score
+
+
+class HalfSpaceTreesDetector(StreamingDetector):
+    """Streaming half-space trees (Tan, Ting and Liu, 2011) for one feature
+
+    In one dimension a half-space tree of depth d splits a randomly shifted
+    work range in half d times, so level k of a tree is a grid of 2^k cells.
+    Each tree counts readings per cell over the last complete window
+    (reference mass) while counting the current window; a reading is scored
+    by the reference mass of the first sparse cell on its path, weighted by
+    2^depth. Low mass means anomalous. The work range comes from the first
+    window of readings, which only builds the first reference.
+    """
+
+    MAX_SCORE = 1.0
+
+    def __init__(self, trees: int = 25, depth: int = 8, window: int = 250, seed: int = 42):
+        super().__init__(trees=trees, depth=depth, window=window, seed=seed)
+        self.trees = trees
+        self.depth = depth
+        self.window = window
+        self.size_limit = max(1, int(0.1 * window))
+        self.rng = np.random.default_rng(seed)
+        self.low: Optional[np.ndarray] = None
+        self.width: Optional[np.ndarray] = None
+        self.reference = np.zeros((trees, 2 ** (depth + 1)), dtype=np.int64)
+        self.latest = np.zeros_like(self.reference)
+        self.offsets = np.array([2 ** k - 1 for k in range(depth + 1)], dtype=np.int64)
+        self.scales = 2.0 ** np.arange(depth + 1)
+        self.first: List[float] = []
+        self.seen = 0
+
+    def _nodes(self, level: float) -> np.ndarray:
+        """Heap indices of the cell holding a level, per tree and depth"""
+        position = np.clip((level - self.low) / self.width, 0.0, 1.0 - 1e-12)
+        cells = np.floor(position[:, None] * self.scales[None, :]).astype(np.int64)
+        return self.offsets[None, :] + cells
+
+    def update(self, level: float) -> Optional[float]:
+        if self.low is None:
+            self.first.append(level)
+            if len(self.first) < self.window:
+                return None
+            # Work range per tree: [s - r, s + r] with s ~ U(0, 1) and r = 2 max(s, 1 - s),
+            # in units of the first window's range, as in the paper
+            lo, hi = min(self.first), max(self.first)
+            span = (hi - lo) or 1.0
+            shift = self.rng.random(self.trees)
+            reach = 2 * np.maximum(shift, 1 - shift)
+            self.low = lo + (shift - reach) * span
+            self.width = 2 * reach * span
+            for value in self.first:
+                np.add.at(self.latest, (np.arange(self.trees)[:, None], self._nodes(value)), 1)
+            self.reference, self.latest = self.latest, np.zeros_like(self.latest)
+            self.first = []
+            return None
+
+        nodes = self._nodes(level)
+        rows = np.arange(self.trees)[:, None]
+        mass = self.reference[rows, nodes]
+        # Each tree stops at the first cell holding fewer than size_limit reference readings (or a leaf)
+        stop = np.minimum((mass >= self.size_limit).sum(axis=1), self.depth)
+        raw = float((mass[np.arange(self.trees), stop] * self.scales[stop]).sum())
+        score = 1.0 / (1.0 + raw / (self.trees * self.size_limit))
+
+        np.add.at(self.latest, (rows, nodes), 1)
+        self.seen += 1
+        if self.seen % self.window == 0:
+            self.reference, self.latest = self.latest, np.zeros_like(self.latest)
+        return score
+
+
+DETECTORS: Dict[str, Type[StreamingDetector]] = {
+    "ewma": EWMADetector,
+    "mad": MADDetector,
+    "hst": HalfSpaceTreesDetector,
+}
+ANOMALY_METHODS = (ISOLATION_FOREST,) + tuple(DETECTORS)
+
+
+class _ScoreRank:
+    """Fixed-size histogram of past scores, for the share of scores at least as high"""
+
+    def __init__(self, max_score: float):
+        self.max_score = max_score
+        self.counts = np.zeros(RANK_BINS, dtype=np.float64)
+        self.total = 0.0
+
+    def _bin(self, score: float) -> int:
+        return min(int(score / self.max_score * RANK_BINS), RANK_BINS - 1)
+
+    def rank(self, score: float) -> float:
+        """Share of past scores at least as high as this one (1.0 with no history)"""
+        if self.total == 0:
+            return 1.0
+        return float(self.counts[self._bin(score):].sum() / self.total)
+
+    def add(self, score: float) -> None:
+        self.counts[self._bin(score)] += 1
+        self.total += 1
+        if self.total >= RANK_DECAY_AFTER:
+            self.counts /= 2
+            self.total /= 2
+
+
+class _TankDetector:
+    """One engine's state and flagged readings for one tank
+
+    Flags are kept in growable columns, like the history cache's, so
+    appending them is amortized O(1) per flag.
+    """
+
+    def __init__(self, detector: StreamingDetector):
+        self.detector = detector
+        self.ranks = _ScoreRank(detector.MAX_SCORE)
+        self.last_timestamp: Optional[int] = None
+        self.size = 0
+        self.columns = {name: np.empty(INITIAL_FLAG_CAPACITY, dtype=dtype) for name, dtype in FLAG_DTYPES.items()}
+
+    def flags(self) -> Dict[str, np.ndarray]:
+        """The flagged readings, as views that later appends leave unchanged"""
+        return {name: values[:self.size] for name, values in self.columns.items()}
+
+    def _reserve(self, extra: int) -> None:
+        needed = self.size + extra
+        if needed <= len(self.columns["timestamps"]):
+            return
+        capacity = max(needed, len(self.columns["timestamps"]) * 2)
+        for name, old in self.columns.items():
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            self.columns[name] = new
+
+    def keep(self, mask: np.ndarray) -> None:
+        """Drop the flags where mask is False, into fresh columns so views handed out earlier stay valid"""
+        kept = {name: values[mask] for name, values in self.flags().items()}
+        self.size = 0
+        self.columns = {name: np.empty(max(INITIAL_FLAG_CAPACITY, len(values) * 2), dtype=values.dtype)
+                        for name, values in kept.items()}
+        self._append(kept)
+
+    def _append(self, new: Dict[str, np.ndarray]) -> None:
+        count = len(new["timestamps"])
+        self._reserve(count)
+        end = self.size + count
+        for name in FLAG_COLUMNS:
+            self.columns[name][self.size:end] = new[name]
+        self.size = end
+
+    def feed(self, series: TankSeries, max_sensitivity: float) -> int:
+        """Score readings in order, keeping those ranked below max_sensitivity; returns readings scored"""
+        keep, ranks = [], []
+        update, rank, add = self.detector.update, self.ranks.rank, self.ranks.add
+        last = self.last_timestamp
+        for position, (timestamp, level) in enumerate(zip(series.timestamps.tolist(), series.levels.tolist())):
+            if last is not None and timestamp <= last or level != level:
+                # Streams only move forward; late and NaN readings are not scored
+                continue
+            last = timestamp
+            score = update(level)
+            if score is None:
+                continue
+            share = rank(score)
+            add(score)
+            if share < max_sensitivity:
+                keep.append(position)
+                ranks.append(share)
+        self.last_timestamp = last
+
+        if keep:
+            user_ids = series.user_ids[keep] if series.user_ids is not None else np.full(len(keep), None, dtype=object)
+            self._append({
+                "timestamps": series.timestamps[keep],
+                "levels": series.levels[keep],
+                "ranks": np.array(ranks, dtype=np.float64),
+                "user_ids": user_ids,
+            })
+        return len(series)
+
+
+class StreamingDetectorStore:
+    """Streaming anomaly engines, updated per reading as readings are stored
+
+    An engine is started for a tank the first time it is asked for, by
+    replaying the tank's history through it; from then on every stored
+    reading updates it on a background thread. Engine state has a fixed size
+    and costs O(1) per reading (O(window) for MAD); the flagged readings grow
+    with the history, by at most max_sensitivity of it. Each score is ranked against a fixed-size
+    histogram of the engine's earlier scores, so a sensitivity s flags the
+    readings scoring in the top s of their tank's history, as with the
+    Isolation Forest. State is kept in memory and rebuilt by replay on restart.
+    """
+
+    def __init__(self, loader: Callable[[str, Optional[datetime]], TankSeries], config: Optional[Dict[str, Any]] = None,
+                 max_sensitivity: float = 0.1, lock: Optional[threading.RLock] = None,
+                 feedback: Optional[FeedbackIndex] = None):
+        """
+        Initialize the store
+
+        Args:
+            loader: Reads a tank's history from an optional start (all of it for None)
+            config: Overrides for DEFAULT_DETECTOR_CONFIG
+            max_sensitivity: Highest sensitivity flags are kept for
+            lock: Lock shared with the history writers
+            feedback: Readings users marked as normal, left out of query results
+        """
+        self.loader = loader
+        self.config = {**DEFAULT_DETECTOR_CONFIG, **(config or {})}
+        self.max_sensitivity = max_sensitivity
+        self.lock = lock or threading.RLock()
+        self.feedback = feedback
+        self._tanks: Dict[Tuple[str, str], _TankDetector] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="anomaly-stream")
+        self._pending: Optional[Future] = None
+        self.metrics = {"scored": 0, "replayed_tanks": 0, "errors": 0}
+
+    def method_for(self, tank_id: str) -> str:
+        """Get a tank's default anomaly engine"""
+        return self.config["tank_methods"].get(tank_id, self.config["default_method"])
+
+    def _ensure(self, tank_id: str, method: str) -> _TankDetector:
+        """
+        Get a tank's running engine, starting it by replaying the tank's history the first time
+
+        Must be called without holding the lock: the history is read and
+        replayed outside it, so writers are not held up by the replay.
+        """
+        with self.lock:
+            state = self._tanks.get((tank_id, method))
+        if state is not None:
+            return state
+
+        state = _TankDetector(DETECTORS[method](**self.config.get(method, {})))
+        history = self.loader(tank_id, None)
+        state.feed(history, self.max_sensitivity)
+        with self.lock:
+            if (tank_id, method) in self._tanks:
+                # Another thread started the engine meanwhile
+                return self._tanks[(tank_id, method)]
+            if state.last_timestamp is not None:
+                # Readings stored during the replay were skipped by _update
+                state.feed(self.loader(tank_id, from_epoch_us(state.last_timestamp + 1)), self.max_sensitivity)
+            self._tanks[(tank_id, method)] = state
+        self.metrics["replayed_tanks"] += 1
+        logger.info(f"Replayed {len(history)} readings of tank {tank_id} through the {method} detector")
+        return state
+
+    def _update(self, series_list: List[TankSeries]) -> None:
+        with self.lock:
+            for series in series_list:
+                for method in DETECTORS:
+                    state = self._tanks.get((series.tank_id, method))
+                    if state is None:
+                        continue
+                    try:
+                        self.metrics["scored"] += state.feed(series, self.max_sensitivity)
+                    except Exception as e:
+                        self.metrics["errors"] += 1
+                        logger.error(f"Error scoring tank {series.tank_id} with the {method} detector: {str(e)}")
+
+    def submit(self, series_list: List[TankSeries]) -> None:
+        """Queue freshly stored readings for the tanks' running engines"""
+        series_list = [series for series in series_list if len(series)]
+        if series_list:
+            self._pending = self._executor.submit(self._update, series_list)
+
+    def wait(self) -> None:
+        """Wait until every reading submitted so far has been scored"""
+        pending = self._pending
+        if pending is not None:
+            pending.result()
+
+    def replace_range(self, tank_id: str, start_us: int, end_us: int, series: TankSeries) -> None:
+        """Drop the flags within [start_us, end_us] of readings that are no longer stored (e.g. after retention)
+
+        Engine state only summarizes the past, so it is kept as it is.
+        """
+        with self.lock:
+            for method in DETECTORS:
+                state = self._tanks.get((tank_id, method))
+                if state is None:
+                    continue
+                flags = state.flags()
+                timestamps = flags["timestamps"]
+                lo = int(np.searchsorted(timestamps, start_us, side="left"))
+                hi = int(np.searchsorted(timestamps, end_us, side="right"))
+                keep = np.ones(len(timestamps), dtype=bool)
+                keep[lo:hi] = series.contains(timestamps[lo:hi], flags["levels"][lo:hi])
+                if not keep.all():
+                    state.keep(keep)
+
+    def invalidate(self, tank_id: str) -> None:
+        """Drop a tank's engines (e.g. after retention rewrote it) so they are replayed on next use"""
+        with self.lock:
+            for method in DETECTORS:
+                self._tanks.pop((tank_id, method), None)
+
+    def query(self, tank_id: str, method: str, start_us: Optional[int], end_us: Optional[int],
+              sensitivity: float, user_id: Optional[str] = None) -> pd.DataFrame:
+        """
+        Get a tank's anomalies in a time range from one engine
+
+        Args:
+            tank_id: Tank to read
+            method: Engine name (a key of DETECTORS)
+            start_us: Optional inclusive lower bound (epoch microseconds)
+            end_us: Optional inclusive upper bound (epoch microseconds)
+            sensitivity: Expected proportion of anomalies, at most max_sensitivity
+            user_id: Optional owner; readings owned by other users are skipped
+
+        Returns:
+            DataFrame of the anomalies not marked as normal, with timestamp,
+            level, is_anomaly and anomaly_score (rank minus sensitivity; negative) columns
+        """
+        state = self._ensure(tank_id, method)
+        with self.lock:
+            columns = state.flags()
+            timestamps = columns["timestamps"]
+            lo = int(np.searchsorted(timestamps, start_us, side="left")) if start_us is not None else 0
+            hi = int(np.searchsorted(timestamps, end_us, side="right")) if end_us is not None else len(timestamps)
+            selected = {name: values[lo:hi] for name, values in columns.items()}
+
+        keep = selected["ranks"] < sensitivity
+        if user_id is not None:
+            keep &= pd.isnull(selected["user_ids"]) | (selected["user_ids"] == user_id)
+        if self.feedback is not None and keep.any():
+            positions = np.flatnonzero(keep)
+            keep[positions[self.feedback.mask(
+                tank_id, selected["timestamps"][positions], selected["levels"][positions]
+            )]] = False
+        return pd.DataFrame({
+            "timestamp": selected["timestamps"][keep].astype("datetime64[us]"),
+            "level": selected["levels"][keep].astype(np.float64),
+            "is_anomaly": np.ones(int(keep.sum()), dtype=bool),
+            "anomaly_score": selected["ranks"][keep] - sensitivity,
+        })
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the configuration, running engines and scoring metrics"""
+        with self.lock:
+            running: Dict[str, int] = {}
+            for _, method in self._tanks:
+                running[method] = running.get(method, 0) + 1
+            return {"config": self.config, "running": running, **self.metrics}
@@ -2,10 +2,26 @@ import requests
 import json
 import os
 import logging
+import threading
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
+from tank_storage import TankSeries, create_storage, series_to_frame, to_epoch_us, from_epoch_us
+from tank_cache import TankHistoryCache
+from downsampling import downsample_series
+from fleet_generator import generate_tank_series
+from ingest_buffer import IngestBuffer, DEFAULT_INGEST_CONFIG
+from ingestion_bus import DEFAULT_BUS_CONFIG
+from anomaly_feedback import FeedbackIndex
+from anomaly_jobs import AnomalyJobExecutor, DEFAULT_JOB_CONFIG
+from anomaly_models import AnomalyModelRegistry, DEFAULT_MODEL_CONFIG
+from anomaly_flags import AnomalyFlagStore, DEFAULT_FLAG_CONFIG
+from streaming_detectors import StreamingDetectorStore, DEFAULT_DETECTOR_CONFIG, ISOLATION_FOREST
+from tank_rollups import (
+    RollupStore, MICROSECONDS, aggregate, aggregate_all, combine_buckets, empty_columns, rollup_to_frame,
+    choose_resolution
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -15,6 +31,8 @@ logger = logging.getLogger(__name__)
 CONFIG_FILE = "config.json"
 DATA_DIR = "data"
 TANK_DATA_FILE = os.path.join(DATA_DIR, "tank_levels.json")
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_WINDOW_DAYS = 31
 
 class TankAPIService:
     """Service to interact with external tank level API"""
@@ -29,6 +47,52 @@ class TankAPIService:
         
         # Ensure data directory exists
         os.makedirs(DATA_DIR, exist_ok=True)
+
+        # History store: NDJSON segments (default), memory-mapped binary files or SQLite
+        self.storage_backend = self.config.get("storage_backend", "segments")
+        self.store = create_storage(self.storage_backend)
+
+        # Migrate the legacy single-file cache once
+        if os.path.exists(TANK_DATA_FILE) and self.store.is_empty():
+            try:
+                self.store.import_legacy_file(TANK_DATA_FILE)
+            except (json.JSONDecodeError, KeyError, ValueError) as e:
+                logger.error(f"Could not migrate legacy cache file: {str(e)}")
+
+        # Columnar in-memory view of the store, loaded per tank on first use.
+        # The binary store can serve memory-mapped views directly instead.
+        # Writers hold this lock so a concurrent first load of the cache or the
+        # rollups can't see the same readings twice
+        self.history_lock = threading.RLock()
+        self.cache = None
+        if self.config.get("history_cache", True):
+            self.cache = TankHistoryCache(self.store.read_series, lock=self.history_lock)
+
+        # 1-minute, hourly and daily aggregates, maintained on ingest
+        self.rollups = RollupStore(self._load_full_series, lock=self.history_lock)
+
+        # Fitted Isolation Forests, reused across requests and refitted in the background,
+        # the anomaly flags new readings are scored into as they are stored, the
+        # readings users marked as normal, and the process pool histories are scored in
+        self.anomaly_models = AnomalyModelRegistry(self.config.get("anomaly_models"))
+        self.anomaly_feedback = FeedbackIndex()
+        self.anomaly_jobs = AnomalyJobExecutor(self.config.get("anomaly_jobs"))
+        self.anomaly_jobs.start()
+        self.anomaly_flags = AnomalyFlagStore(
+            self.anomaly_models, lambda tank_id, since: self.query_series(tank_id, since)[0],
+            self.config.get("anomaly_flags"), lock=self.history_lock, feedback=self.anomaly_feedback,
+            jobs=self.anomaly_jobs
+        )
+        # Streaming engines (EWMA, MAD, half-space trees) a tank can use instead
+        self.anomaly_detectors = StreamingDetectorStore(
+            lambda tank_id, since: self.query_series(tank_id, since)[0], self.config.get("anomaly_detectors"),
+            max_sensitivity=self.anomaly_flags.max_sensitivity, lock=self.history_lock,
+            feedback=self.anomaly_feedback
+        )
+
+        # Single readings are coalesced in a write-behind buffer and group committed
+        self.ingest = IngestBuffer(self.add_tank_series, self.store.sync, self.config.get("ingest"))
+        self.ingest.start()
     
     def _load_config(self) -> Dict[str, Any]:
         """Load configuration from file or create default"""
@@ -45,7 +109,24 @@ class TankAPIService:
             "api_key": "your-api-key",
             "tank_id": "tank1",
             "use_mock_data": True,
-            "update_interval_hours": 1
+            "update_interval_hours": 1,
+            "storage_backend": "segments",
+            "history_cache": True,
+            "retention": {
+                "enabled": True,
+                "interval_hours": 24,
+                "mode": "drop",
+                "downsample_resolution": "1h",
+                "unowned_days": 365,
+                "compact_after_days": 31,
+                "cold_after_days": 92
+            },
+            "ingest": dict(DEFAULT_INGEST_CONFIG),
+            "ingestion_bus": dict(DEFAULT_BUS_CONFIG),
+            "anomaly_models": dict(DEFAULT_MODEL_CONFIG),
+            "anomaly_flags": dict(DEFAULT_FLAG_CONFIG),
+            "anomaly_jobs": dict(DEFAULT_JOB_CONFIG),
+            "anomaly_detectors": dict(DEFAULT_DETECTOR_CONFIG)
         }
         
         # Save default config if none exists
@@ -99,23 +180,27 @@ class TankAPIService:
             # Fall back to cached data if available
             return self._get_cached_data(days)
     
-    def add_tank_level(self, level: float) -> Dict[str, Any]:
+    def add_tank_level(self, level: float, tank_id: Optional[str] = None,
+                       user_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Add a new tank level reading via the API
         
         Args:
             level: The tank level in meters
+            tank_id: Tank the reading belongs to (defaults to the configured tank)
+            user_id: Optional owner of the reading
             
         Returns:
             The created tank level reading
         """
+        tank_id = tank_id or self.tank_id
         if self.use_mock_data:
             logger.info("Using mock data - adding to local storage")
-            return self._add_to_mock_data(level)
+            return self._add_to_mock_data(level, tank_id, user_id)
         
         payload = {
             "level": level,
-            "tank_id": self.tank_id,
+            "tank_id": tank_id,
             "timestamp": datetime.now().isoformat()
         }
         
@@ -132,115 +217,684 @@ class TankAPIService:
             logger.info(f"Successfully added tank level reading: {level} meters")
             
             # Update cached data
-            cached_data = self._get_cached_data()
             if isinstance(data.get("timestamp"), str):
                 data["timestamp"] = datetime.fromisoformat(data["timestamp"])
-            cached_data.append(data)
-            self._save_data(cached_data)
+            data.setdefault("tank_id", tank_id)
+            if user_id is not None:
+                data["user_id"] = user_id
+            self._write_readings([data])
             
             return data
             
         except requests.RequestException as e:
             logger.error(f"Error adding tank level: {str(e)}")
             # Fall back to adding to local cache
-            return self._add_to_mock_data(level)
+            return self._add_to_mock_data(level, tank_id, user_id)
+
+    def add_tank_series(self, series_list: List[TankSeries]) -> int:
+        """
+        Store a validated batch of readings with one group commit
+
+        Batches are written to local history only; they are not forwarded to
+        the external API one reading at a time.
+
+        Args:
+            series_list: Sorted readings, one TankSeries per tank
+
+        Returns:
+            Number of readings stored
+        """
+        series_list = [series for series in series_list if len(series)]
+        if not series_list:
+            return 0
+
+        with self.history_lock:
+            written = self.store.append_series(series_list)
+            for series in series_list:
+                if self.cache is not None:
+                    self.cache.append(series)
+                self.rollups.ingest(series)
+        self.anomaly_flags.submit(series_list)
+        self.anomaly_detectors.submit(series_list)
+
+        logger.info(f"Stored batch of {written} readings for {len(series_list)} tanks")
+        return written
     
+    def _select_tanks(self, tank_id: Optional[Union[str, List[str]]] = None) -> List[str]:
+        """Resolve a tank ID or list of tank IDs to the stored tanks it names (all tanks if not given)"""
+        tank_ids = self.store.tank_ids()
+        if not tank_id:
+            return tank_ids
+        stored = set(tank_ids)
+        wanted = [tank_id] if isinstance(tank_id, str) else tank_id
+        return [current for current in wanted if current in stored]
+
+    def query_series(self, tank_id: Optional[Union[str, List[str]]] = None, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, user_id: Optional[str] = None) -> List[TankSeries]:
+        """
+        Get history for one, several or all tanks within a time range
+
+        Args:
+            tank_id: Optional tank, or list of tanks, to query; all stored tanks if not given
+            start: Optional inclusive lower bound on timestamp
+            end: Optional inclusive upper bound on timestamp
+            user_id: Optional owner; readings owned by other users are skipped
+
+        Returns:
+            One TankSeries per tank
+        """
+        tank_ids = self._select_tanks(tank_id)
+
+        start_us = to_epoch_us(start) if start else None
+        end_us = to_epoch_us(end) if end else None
+        series_list = []
+        for current in tank_ids:
+            if self.cache is None or (end is not None and not self.cache.is_loaded(current)):
+                # Push the range and owner filters down to the backend; a closed
+                # window into the past is not worth loading the tank's whole history
+                series_list.append(self.store.read_series(current, start, end, user_id))
+            else:
+                series_list.append(self.cache.get_series(current, start_us, end_us).owned_by(user_id))
+        return series_list
+
+    def _load_full_series(self, tank_id: str) -> TankSeries:
+        """Load a tank's complete history, from the cache when enabled"""
+        if self.cache is not None:
+            return self.cache.get_series(tank_id)
+        return self.store.read_series(tank_id)
+
+    def _refresh(self, days: Optional[int] = None) -> None:
+        """Make sure the store holds current data before it is queried"""
+        if self.use_mock_data:
+            self._ensure_mock_data()
+        else:
+            # Pull anything new from the external API into the store first
+            self.fetch_tank_levels(days)
+
+        # Read-your-writes: anything still in the write-behind buffer goes out first.
+        # A failing write must not fail the read; the buffer retries or dead-letters it.
+        try:
+            self.ingest.flush()
+        except Exception as e:
+            logger.error(f"Error flushing ingest buffer before query: {str(e)}")
+
+    def _history_cutoff(self, days: Optional[int], start: Optional[datetime]) -> Optional[datetime]:
+        """Combine a days window with an explicit start, keeping the later of the two"""
+        cutoff_date = datetime.now() - timedelta(days=days) if days else None
+        if start and (cutoff_date is None or start > cutoff_date):
+            cutoff_date = start
+        return cutoff_date
+
+    def fetch_tank_frame(self, days: Optional[int] = None, tank_id: Optional[Union[str, List[str]]] = None,
+                         start: Optional[datetime] = None, user_id: Optional[str] = None,
+                         lttb_points: Optional[int] = None, end: Optional[datetime] = None) -> pd.DataFrame:
+        """
+        Fetch tank level data as a DataFrame built directly from columnar history
+
+        Args:
+            days: Optional number of days to fetch
+            tank_id: Optional tank, or list of tanks, to fetch
+            start: Optional earliest timestamp (e.g. a subscription cutoff); the
+                later of this and the days cutoff is used
+            user_id: Optional owner; readings owned by other users are skipped
+            lttb_points: Optional number of points to keep per tank (LTTB downsampling)
+            end: Optional latest timestamp (inclusive)
+
+        Returns:
+            DataFrame with timestamp, level, tank_id (and user_id when known) columns
+        """
+        self._refresh(days)
+        cutoff_date = self._history_cutoff(days, start)
+        series_list = self.query_series(tank_id, start=cutoff_date, end=end, user_id=user_id)
+        if lttb_points:
+            series_list = [downsample_series(series, lttb_points) for series in series_list]
+        return series_to_frame(series_list)
+
+    def fetch_tank_page(self, days: Optional[int] = None, tank_id: Optional[str] = None,
+                        start: Optional[datetime] = None, user_id: Optional[str] = None,
+                        limit: int = 1000, cursor: Optional[Tuple[int, str, int]] = None,
+                        end: Optional[datetime] = None
+                        ) -> Tuple[pd.DataFrame, Optional[Tuple[int, str, int]]]:
+        """
+        Fetch one newest-first page of tank level readings by keyset
+
+        Rows are ordered by (timestamp, tank_id, position among equal
+        timestamps), all descending. Each tank's page is found by bisecting its
+        sorted timestamps to the cursor, so a page costs the same wherever it is
+        in the history.
+
+        Args:
+            days: Optional number of days to fetch
+            tank_id: Optional tank to fetch
+            start: Optional earliest timestamp (see fetch_tank_frame)
+            user_id: Optional owner; readings owned by other users are skipped
+            limit: Maximum number of readings on the page
+            cursor: Key of the last reading on the previous page
+            end: Optional latest timestamp (inclusive)
+
+        Returns:
+            Tuple of (page DataFrame, key of its last reading or None on the last page)
+        """
+        self._refresh(days)
+        cutoff_date = self._history_cutoff(days, start)
+        tank_ids = sorted(self._select_tanks(tank_id))
+
+        tails = []
+        for rank, current in enumerate(tank_ids):
+            tail, ties = self._page_tail(current, cutoff_date, end, cursor, limit, user_id)
+            if len(tail):
+                tails.append((rank, tail, ties))
+        if not tails:
+            return series_to_frame([]), None
+
+        timestamps = np.concatenate([tail.timestamps for _, tail, _ in tails])
+        ranks = np.concatenate([np.full(len(tail), rank) for rank, tail, _ in tails])
+        ties = np.concatenate([tail_ties for _, _, tail_ties in tails])
+        order = np.lexsort((ties, ranks, timestamps))[::-1][:limit]
+
+        columns = {
+            "timestamp": timestamps[order].astype("datetime64[us]"),
+            "level": np.concatenate([tail.levels for _, tail, _ in tails])[order].astype(np.float64),
+            "tank_id": np.array(tank_ids, dtype=object)[ranks[order]],
+        }
+        if any(tail.user_ids is not None for _, tail, _ in tails):
+            user_ids = np.concatenate([
+                tail.user_ids if tail.user_ids is not None else np.full(len(tail), None, dtype=object)
+                for _, tail, _ in tails
+            ])
+            columns["user_id"] = pd.Series(user_ids[order], dtype=object)
+        frame = pd.DataFrame(columns)
+
+        if len(order) < limit:
+            return frame, None
+        last = order[-1]
+        return frame, (int(timestamps[last]), tank_ids[ranks[last]], int(ties[last]))
+
+    def _page_tail(self, tank_id: str, start: Optional[datetime], end: Optional[datetime],
+                   cursor: Optional[Tuple[int, str, int]], limit: int,
+                   user_id: Optional[str]) -> Tuple[TankSeries, np.ndarray]:
+        """
+        Get the newest `limit` readings of a tank that sort after the cursor
+
+        Returns:
+            Tuple of (readings in ascending order, position of each among readings
+            with the same timestamp)
+        """
+        if self.cache is not None:
+            view = self.cache.get_series(tank_id, to_epoch_us(start) if start else None,
+                                         to_epoch_us(end) if end else None)
+            end = _cursor_bound(view.timestamps, tank_id, cursor)
+            # Widen the block until enough of the owner's readings are in it
+            block = limit
+            while True:
+                begin = max(0, end - block)
+                positions = np.arange(begin, end)
+                if user_id is not None and view.user_ids is not None:
+                    owners = view.user_ids[begin:end]
+                    positions = positions[pd.isnull(owners) | (owners == user_id)]
+                if len(positions) >= limit or begin == 0:
+                    break
+                block *= 4
+            positions = positions[-limit:]
+            ties = positions - np.searchsorted(view.timestamps, view.timestamps[positions], side="left")
+            tail = TankSeries(tank_id, view.timestamps[positions], view.levels[positions],
+                              view.user_ids[positions] if view.user_ids is not None else None)
+            return tail, ties
+
+        # Without the cache, read backwards one window at a time until the page is full
+        first = self.store.first_timestamp(tank_id)
+        last = self.store.last_timestamp(tank_id)
+        if first is None or last is None:
+            return TankSeries.empty(tank_id), np.empty(0, dtype=np.int64)
+        floor = max(first, start) if start else first
+        window_end = min(last, from_epoch_us(cursor[0])) if cursor else last
+        if end is not None:
+            window_end = min(window_end, end)
+
+        pieces = []
+        count = 0
+        while window_end >= floor and count < limit:
+            window_start = max(floor, window_end - timedelta(days=EXPORT_WINDOW_DAYS))
+            window = self.store.read_series(tank_id, window_start, window_end, user_id)
+            end = _cursor_bound(window.timestamps, tank_id, cursor)
+            ties = np.arange(end) - np.searchsorted(window.timestamps, window.timestamps[:end], side="left")
+            pieces.insert(0, (window, end, ties))
+            count += end
+            window_end = window_start - timedelta(microseconds=1)
+
+        if not pieces:
+            return TankSeries.empty(tank_id), np.empty(0, dtype=np.int64)
+        user_ids = None
+        if any(window.user_ids is not None for window, _, _ in pieces):
+            user_ids = np.concatenate([
+                window.user_ids[:end] if window.user_ids is not None else np.full(end, None, dtype=object)
+                for window, end, _ in pieces
+            ])[-limit:]
+        tail = TankSeries(
+            tank_id,
+            np.concatenate([window.timestamps[:end] for window, end, _ in pieces])[-limit:],
+            np.concatenate([window.levels[:end] for window, end, _ in pieces])[-limit:],
+            user_ids,
+        )
+        return tail, np.concatenate([ties for _, _, ties in pieces])[-limit:]
+
+    def fetch_rollup_frame(self, days: Optional[int] = None, tank_id: Optional[Union[str, List[str]]] = None,
+                           start: Optional[datetime] = None, user_id: Optional[str] = None,
+                           resolution: Optional[str] = None, max_points: Optional[int] = None,
+                           end: Optional[datetime] = None) -> Tuple[str, pd.DataFrame]:
+        """
+        Fetch tank level data at a rollup resolution
+
+        Args:
+            days: Optional number of days to fetch
+            tank_id: Optional tank, or list of tanks, to fetch
+            start: Optional earliest timestamp (see fetch_tank_frame)
+            user_id: Optional owner; readings owned by other users are skipped
+            resolution: "raw", "1m", "1h" or "1d"; chosen from max_points when not given
+            max_points: Optional upper bound on points per tank, used to pick a resolution
+            end: Optional latest timestamp (inclusive); buckets straddling it are left out
+
+        Returns:
+            Tuple of the resolution used and the DataFrame. Rollup frames carry
+            min_level, max_level, last_level and count columns, with the bucket
+            mean as level.
+        """
+        self._refresh(days)
+        cutoff_date = self._history_cutoff(days, start)
+        start_us = to_epoch_us(cutoff_date) if cutoff_date else None
+        end_us = to_epoch_us(end) if end else None
+
+        def bucket_end(name: str) -> Optional[int]:
+            # Latest bucket start whose bucket lies entirely before end
+            return end_us - MICROSECONDS[name] + 1 if end_us is not None else None
+
+        tank_ids = self._select_tanks(tank_id)
+
+        if resolution is None:
+            resolution = "raw"
+            if max_points:
+                raw_count = max((len(series) for series in self.query_series(tank_id, start=cutoff_date, end=end,
+                                                                              user_id=user_id)), default=0)
+                bucket_counts = {
+                    name: max((self.rollups.bucket_count(current, name, start_us, bucket_end(name))
+                               for current in tank_ids),
+                              default=0)
+                    for name in MICROSECONDS
+                }
+                resolution = choose_resolution(raw_count, bucket_counts, max_points)
+
+        if resolution == "raw":
+            return resolution, series_to_frame(self.query_series(tank_id, start=cutoff_date, end=end, user_id=user_id))
+
+        frames = []
+        for current in tank_ids:
+            series = self.query_series(current, start=cutoff_date, end=end)[0]
+            if user_id is not None and series.user_ids is not None and \
+                    np.any(pd.notnull(series.user_ids) & (series.user_ids != user_id)):
+                # Another user's readings are mixed in: aggregate the visible ones on the fly
+                visible = series.owned_by(user_id)
+                columns = aggregate(visible.timestamps, visible.levels, MICROSECONDS[resolution])
+                # Match the stored tiers: drop the buckets straddling the start and end
+                keep = np.ones(len(columns["bucket"]), dtype=bool)
+                if start_us is not None:
+                    keep &= columns["bucket"] >= start_us
+                if end_us is not None:
+                    keep &= columns["bucket"] <= bucket_end(resolution)
+                columns = {name: values[keep] for name, values in columns.items()}
+                frames.append(rollup_to_frame(current, columns))
+            else:
+                frames.append(self.rollups.query(current, resolution, start_us, bucket_end(resolution)))
+
+        if not frames:
+            return resolution, rollup_to_frame(tank_id if isinstance(tank_id, str) else "", empty_columns())
+        return resolution, pd.concat(frames, ignore_index=True)
+
+    def fetch_stats(self, days: Optional[int] = None, tank_id: Optional[str] = None,
+                    start: Optional[datetime] = None, user_id: Optional[str] = None,
+                    end: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Compute /api/stats statistics by merging rollup buckets
+
+        Whole days, hours and minutes of the range come from the per-bucket
+        count/min/max/sum/M2 accumulators; only the sub-minute edges are read
+        raw. Tanks holding readings the user may not see are summarized from
+        their visible raw readings instead.
+
+        Args:
+            days: Optional number of days to analyze
+            tank_id: Optional tank; all tanks if not given
+            start: Optional earliest timestamp (see fetch_tank_frame)
+            user_id: Optional owner; readings owned by other users are skipped
+            end: Optional latest timestamp (inclusive)
+
+        Returns:
+            count, min_level, max_level, avg_level, std_dev, current_level and last_updated
+        """
+        self._refresh(days)
+        cutoff_date = self._history_cutoff(days, start)
+        start_us = to_epoch_us(cutoff_date) if cutoff_date else None
+        end_us = to_epoch_us(end) if end else None
+
+        partials = []
+        for current in self._select_tanks(tank_id):
+            if not self.rollups.visible_to(current, user_id):
+                series = self.query_series(current, cutoff_date, end, user_id)[0]
+                partials.append(aggregate_all(series.timestamps, series.levels))
+                continue
+
+            buckets, gaps = self.rollups.cover(current, start_us, end_us)
+            partials.extend(buckets)
+            for lo_us, hi_us in gaps:
+                series = self.query_series(
+                    current,
+                    from_epoch_us(lo_us) if lo_us is not None else None,
+                    from_epoch_us(hi_us) if hi_us is not None else None,
+                )[0]
+                partials.append(aggregate_all(series.timestamps, series.levels))
+
+        stats = combine_buckets(partials)
+        if stats["last_updated"] is not None:
+            stats["last_updated"] = from_epoch_us(stats["last_updated"]).isoformat()
+        return stats
+
+    def fetch_anomalies(self, days: Optional[int] = None, tank_id: Optional[str] = None,
+                        start: Optional[datetime] = None, user_id: Optional[str] = None,
+                        end: Optional[datetime] = None, sensitivity: float = 0.01,
+                        method: Optional[str] = None) -> pd.DataFrame:
+        """
+        Get the anomalies flagged when readings were stored, less those marked as normal
+
+        Args:
+            days: Optional number of days to search
+            tank_id: Optional tank; all tanks if not given
+            start: Optional earliest timestamp (see fetch_tank_frame)
+            user_id: Optional owner; readings owned by other users are skipped
+            end: Optional latest timestamp (inclusive)
+            sensitivity: Expected proportion of anomalies, at most the configured max_sensitivity
+            method: Optional engine (isolation_forest, ewma, mad or hst); each tank's default if not given
+
+        Returns:
+            DataFrame with timestamp, level, is_anomaly and anomaly_score columns, sorted by timestamp
+        """
+        self._refresh(days)
+        # Flags of readings that were just stored may still be being scored
+        self.anomaly_flags.wait()
+        self.anomaly_detectors.wait()
+        cutoff_date = self._history_cutoff(days, start)
+        start_us = to_epoch_us(cutoff_date) if cutoff_date else None
+        end_us = to_epoch_us(end) if end else None
+
+        frames = []
+        for current in self._select_tanks(tank_id):
+            engine = method or self.anomaly_detectors.method_for(current)
+            if engine == ISOLATION_FOREST:
+                frames.append(self.anomaly_flags.query(current, start_us, end_us, sensitivity, user_id))
+            else:
+                frames.append(self.anomaly_detectors.query(current, engine, start_us, end_us, sensitivity, user_id))
+        if not frames:
+            return pd.DataFrame(columns=["timestamp", "level", "is_anomaly", "anomaly_score"])
+        return pd.concat(frames, ignore_index=True).sort_values("timestamp", kind="stable")
+
+    def rescore_anomalies(self, tank_id: Optional[Union[str, List[str]]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Refit the anomaly models and rescore the history of many tanks in parallel
+
+        Args:
+            tank_id: Optional tank, or list of tanks; all stored tanks if not given
+
+        Returns:
+            Per tank, the readings scored and flagged, or the error
+        """
+        self._refresh()
+        self.anomaly_flags.wait()
+        return self.anomaly_flags.rescore(self._select_tanks(tank_id))
+
+    def fetch_fleet(self, tank_ids: List[str], days: Optional[int] = None, start: Optional[datetime] = None,
+                    user_id: Optional[str] = None, end: Optional[datetime] = None,
+                    resolution: Optional[str] = None, max_points: Optional[int] = None,
+                    lttb_points: Optional[int] = None) -> Tuple[str, pd.DataFrame, Dict[str, Dict[str, Any]]]:
+        """
+        Fetch levels and statistics for many tanks in one pass
+
+        Args:
+            tank_ids: Tanks to fetch; unknown tanks are skipped
+            days: Optional number of days to fetch
+            start: Optional earliest timestamp (see fetch_tank_frame)
+            user_id: Optional owner; readings owned by other users are skipped
+            end: Optional latest timestamp (inclusive)
+            resolution: Optional rollup resolution for the levels (see fetch_rollup_frame)
+            max_points: Optional upper bound on level points per tank
+            lttb_points: Optional number of raw points to keep per tank (LTTB downsampling)
+
+        Returns:
+            Tuple of (resolution used, levels DataFrame for all tanks, stats per tank
+            computed from the raw readings)
+        """
+        if resolution in (None, "raw") and max_points is None:
+            self._refresh(days)
+            cutoff_date = self._history_cutoff(days, start)
+            series_list = self.query_series(tank_ids, start=cutoff_date, end=end, user_id=user_id)
+            levels = [downsample_series(series, lttb_points) for series in series_list] if lttb_points else series_list
+            return "raw", series_to_frame(levels), summarize_series(series_list)
+
+        resolution, frame = self.fetch_rollup_frame(days, tank_ids, start=start, user_id=user_id,
+                                                    resolution=resolution, max_points=max_points, end=end)
+        cutoff_date = self._history_cutoff(days, start)
+        series_list = self.query_series(tank_ids, start=cutoff_date, end=end, user_id=user_id)
+        return resolution, frame, summarize_series(series_list)
+
+    def iter_series_chunks(self, tank_id: Optional[str] = None, start: Optional[datetime] = None,
+                           end: Optional[datetime] = None, user_id: Optional[str] = None,
+                           chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[TankSeries]:
+        """
+        Stream history for one or all tanks in bounded chunks
+
+        With the history cache the chunks are views of the cached arrays;
+        without it the store is read one window of EXPORT_WINDOW_DAYS at a time,
+        so a full export never holds more than one window in memory.
+
+        Args:
+            tank_id: Optional tank to stream; all stored tanks if not given
+            start: Optional inclusive lower bound on timestamp
+            end: Optional inclusive upper bound on timestamp
+            user_id: Optional owner; readings owned by other users are skipped
+            chunk_rows: Maximum readings per chunk
+
+        Returns:
+            Iterator of non-empty TankSeries chunks, in tank then timestamp order
+        """
+        self._refresh()
+        tank_ids = self._select_tanks(tank_id)
+
+        for current in tank_ids:
+            if self.cache is not None:
+                start_us = to_epoch_us(start) if start else None
+                end_us = to_epoch_us(end) if end else None
+                for chunk in self.cache.get_series(current, start_us, end_us).chunks(chunk_rows):
+                    chunk = chunk.owned_by(user_id)
+                    if len(chunk):
+                        yield chunk
+                continue
+
+            first = self.store.first_timestamp(current)
+            last = self.store.last_timestamp(current)
+            if first is None or last is None:
+                continue
+            window_start = max(first, start) if start else first
+            stop = min(last, end) if end else last
+            while window_start <= stop:
+                window_end = min(window_start + timedelta(days=EXPORT_WINDOW_DAYS), stop + timedelta(microseconds=1))
+                # End bounds are inclusive, so stop just short of the next window
+                series = self.store.read_series(current, window_start, window_end - timedelta(microseconds=1), user_id)
+                for chunk in series.chunks(chunk_rows):
+                    yield chunk
+                window_start = window_end
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """
+        Get on-disk size and bytes per point for every tank
+
+        Returns:
+            Dict with the backend name, total bytes and per-tank points, bytes
+            and bytes_per_point
+        """
+        tanks = {}
+        for tank_id in self.store.tank_ids():
+            points = len(self._load_full_series(tank_id))
+            size = self.store.tank_bytes(tank_id)
+            tanks[tank_id] = {
+                "points": points,
+                "bytes": size,
+                "bytes_per_point": round(size / points, 2) if points else None,
+            }
+
+        return {
+            "backend": self.storage_backend,
+            "total_bytes": self.store.storage_bytes(),
+            "tanks": tanks,
+        }
+
     def _get_cached_data(self, days: Optional[int] = None) -> List[Dict[str, Any]]:
-        """Get data from local cache file"""
-        if os.path.exists(TANK_DATA_FILE):
-            try:
-                with open(TANK_DATA_FILE, 'r') as f:
-                    data = json.load(f)
-                    
-                # Convert string timestamps to datetime objects
-                for item in data:
-                    if isinstance(item.get("timestamp"), str):
-                        item["timestamp"] = datetime.fromisoformat(item["timestamp"])
-                
-                # Filter by days if specified
-                if days:
-                    cutoff_date = datetime.now() - timedelta(days=days)
-                    data = [item for item in data if item["timestamp"] >= cutoff_date]
-                    
-                logger.info(f"Loaded {len(data)} readings from cache")
-                return data
-                
-            except json.JSONDecodeError:
-                logger.error("Invalid cache file format")
-        
-        logger.warning("No cached data available")
-        return []
+        """Get data from the local history cache"""
+        cutoff_date = datetime.now() - timedelta(days=days) if days else None
+
+        try:
+            frame = series_to_frame(self.query_series(start=cutoff_date))
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading segment store: {str(e)}")
+            return []
+
+        if frame.empty:
+            logger.warning("No cached data available")
+            return []
+
+        logger.info(f"Loaded {len(frame)} readings from cache")
+        return frame.to_dict('records')
+
+    def _write_readings(self, readings: List[Dict[str, Any]]) -> None:
+        """Hand readings to the ingest buffer, which persists them and folds them into the cache and rollups"""
+        if not readings:
+            return
+
+        by_tank: Dict[str, List[Dict[str, Any]]] = {}
+        for item in readings:
+            by_tank.setdefault(item.get("tank_id", self.tank_id), []).append(item)
+
+        self.ingest.submit_series([TankSeries.from_records(tank_id, items) for tank_id, items in by_tank.items()])
     
     def _save_data(self, data: List[Dict[str, Any]]) -> None:
-        """Save data to local cache file"""
+        """Append readings newer than the stored history to the segment store"""
         try:
-            # Convert datetime objects to ISO format strings for JSON serialization
-            serializable_data = []
+            # last_timestamp only knows about flushed readings
+            self.ingest.flush()
+            new_data = []
             for item in data:
-                serializable_item = item.copy()
-                if isinstance(item.get("timestamp"), datetime):
-                    serializable_item["timestamp"] = item["timestamp"].isoformat()
-                serializable_data.append(serializable_item)
-                
-            with open(TANK_DATA_FILE, 'w') as f:
-                json.dump(serializable_data, f, indent=2)
-                
-            logger.info(f"Saved {len(data)} readings to cache")
+                timestamp = item["timestamp"]
+                if isinstance(timestamp, str):
+                    timestamp = datetime.fromisoformat(timestamp)
+                tank_id = item.get("tank_id", self.tank_id)
+                last_timestamp = self.store.last_timestamp(tank_id)
+                if last_timestamp is None or timestamp > last_timestamp:
+                    new_data.append({**item, "timestamp": timestamp, "tank_id": tank_id})
+
+            self._write_readings(new_data)
+            logger.info(f"Saved {len(new_data)} readings to cache")
             
         except Exception as e:
             logger.error(f"Error saving data to cache: {str(e)}")
     
     def _get_mock_data(self, days: Optional[int] = None) -> List[Dict[str, Any]]:
         """Generate or load mock data for testing"""
-        if os.path.exists(TANK_DATA_FILE):
-            return self._get_cached_data(days)
+        self._ensure_mock_data()
+        return self._get_cached_data(days)
+
+    def _ensure_mock_data(self) -> None:
+        """Generate sample data if the store is empty"""
+        if not self.store.is_empty():
+            return
         
-        # Generate sample data if no cache exists
+        # Generate 12 months of hourly data (seasonal sine, noise and ~1% anomalies)
         logger.info("Generating sample tank level data")
-        tank_data = []
-        now = datetime.now()
-        
-        # Generate 12 months of hourly data
-        for i in range(365 * 24):
-            timestamp = now - timedelta(hours=i)
-            # Base level with some seasonal pattern (higher in summer, lower in winter)
-            base_level = 5.0 + 1.0 * np.sin(2 * np.pi * i / (365 * 24))
-            # Add some random noise
-            noise = np.random.normal(0, 0.2)
-            # Add some random anomalies (about 1%)
-            anomaly = 0
-            if np.random.random() < 0.01:
-                anomaly = np.random.choice([-2, 2]) * np.random.random()
-            level = max(0, min(10, base_level + noise + anomaly))
-            tank_data.append({
-                "timestamp": timestamp,
-                "level": level,
-                "tank_id": self.tank_id
-            })
-        
-        # Save the generated data
-        self._save_data(tank_data)
-        
-        # Filter by days if specified
-        if days:
-            cutoff_date = datetime.now() - timedelta(days=days)
-            tank_data = [item for item in tank_data if item["timestamp"] >= cutoff_date]
-        
-        return tank_data
+        series, _ = generate_tank_series(self.tank_id, datetime.now(), 365 * 24, 3600, np.random.default_rng())
+        self.add_tank_series([series])
     
-    def _add_to_mock_data(self, level: float) -> Dict[str, Any]:
+    def _add_to_mock_data(self, level: float, tank_id: Optional[str] = None,
+                          user_id: Optional[str] = None) -> Dict[str, Any]:
         """Add a new reading to mock data"""
         new_reading = {
             "timestamp": datetime.now(),
             "level": level,
-            "tank_id": self.tank_id
+            "tank_id": tank_id or self.tank_id
         }
+        if user_id is not None:
+            new_reading["user_id"] = user_id
         
-        # Get existing data
-        data = self._get_cached_data()
-        data.append(new_reading)
-        
-        # Save updated data
-        self._save_data(data)
+        # Queue the reading; it reaches its segment and the history cache on the next flush
+        self._write_readings([new_reading])
         
         return new_reading
+
+
+def summarize_series(series_list: List[TankSeries]) -> Dict[str, Dict[str, Any]]:
+    """
+    Compute /api/stats style statistics for several tanks at once
+
+    The series are concatenated and reduced per tank with reduceat, so the cost
+    is a handful of vectorized passes however many tanks there are.
+
+    Args:
+        series_list: Sorted series, one per tank
+
+    Returns:
+        Dict of tank_id to count, min_level, max_level, avg_level, std_dev,
+        current_level and last_updated
+    """
+    stats = {
+        series.tank_id: {
+            "count": 0, "min_level": None, "max_level": None, "avg_level": None,
+            "std_dev": None, "current_level": None, "last_updated": None,
+        }
+        for series in series_list
+    }
+    present = [series for series in series_list if len(series)]
+    if not present:
+        return stats
+
+    counts = np.array([len(series) for series in present])
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    ends = starts + counts - 1
+    levels = np.concatenate([series.levels for series in present]).astype(np.float64)
+    timestamps = np.concatenate([series.timestamps for series in present])
+
+    means = np.add.reduceat(levels, starts) / counts
+    # Two-pass sample standard deviation, like pandas
+    squares = np.add.reduceat((levels - np.repeat(means, counts)) ** 2, starts)
+    stds = np.sqrt(squares / np.maximum(counts - 1, 1))
+    mins = np.minimum.reduceat(levels, starts)
+    maxs = np.maximum.reduceat(levels, starts)
+    last_updated = timestamps[ends].astype("datetime64[us]").astype(datetime)
+
+    for i, series in enumerate(present):
+        stats[series.tank_id] = {
+            "count": int(counts[i]),
+            "min_level": float(mins[i]),
+            "max_level": float(maxs[i]),
+            "avg_level": float(means[i]),
+            "std_dev": float(stds[i]) if counts[i] > 1 else None,
+            "current_level": float(levels[ends[i]]),
+            "last_updated": last_updated[i].isoformat(),
+        }
+    return stats
+
+
+def _cursor_bound(timestamps: np.ndarray, tank_id: str, cursor: Optional[Tuple[int, str, int]]) -> int:
+    """Index one past the last reading of a tank that sorts after the cursor (newest first)"""
+    if cursor is None:
+        return len(timestamps)
+    timestamp_us, cursor_tank, tie = cursor
+    if tank_id < cursor_tank:
+        return int(np.searchsorted(timestamps, timestamp_us, side="right"))
+    if tank_id > cursor_tank:
+        return int(np.searchsorted(timestamps, timestamp_us, side="left"))
+    start = int(np.searchsorted(timestamps, timestamp_us, side="left"))
+    return min(start + tie, int(np.searchsorted(timestamps, timestamp_us, side="right")))
@@ -0,0 +1,206 @@
+import logging
+import threading
+from typing import Dict, List, Optional, Callable, Iterable
+import numpy as np
+from tank_storage import TankSeries
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+INITIAL_CAPACITY = 1024
+
+
+class _CachedSeries:
+    """Growable sorted columns for one tank"""
+
+    def __init__(self, series: TankSeries):
+        size = len(series)
+        capacity = max(INITIAL_CAPACITY, size * 2)
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.levels = np.empty(capacity, dtype=np.float32)
+        self.owners = np.zeros(capacity, dtype=np.int32)
+        self.size = size
+
+        # Owner 0 means "no user_id"; other codes index into owner_names
+        self.owner_names: List[Optional[str]] = [None]
+        self.owner_codes: Dict[str, int] = {}
+
+        self.timestamps[:size] = series.timestamps
+        self.levels[:size] = series.levels
+        if series.user_ids is not None:
+            self.owners[:size] = self._encode_owners(series.user_ids)
+
+    def _encode_owners(self, user_ids: Iterable[Optional[str]]) -> np.ndarray:
+        codes = []
+        for user_id in user_ids:
+            if user_id is None:
+                codes.append(0)
+                continue
+            code = self.owner_codes.get(user_id)
+            if code is None:
+                code = len(self.owner_names)
+                self.owner_codes[user_id] = code
+                self.owner_names.append(user_id)
+            codes.append(code)
+        return np.asarray(codes, dtype=np.int32)
+
+    def _reserve(self, extra: int) -> None:
+        needed = self.size + extra
+        if needed <= len(self.timestamps):
+            return
+        capacity = max(needed, len(self.timestamps) * 2)
+        for name in ("timestamps", "levels", "owners"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, timestamps: np.ndarray, levels: np.ndarray, owners: np.ndarray) -> None:
+        """Append readings, merging them into place if they arrive out of order"""
+        count = len(timestamps)
+        if count == 0:
+            return
+
+        in_order = np.all(np.diff(timestamps) >= 0) and (
+            self.size == 0 or timestamps[0] >= self.timestamps[self.size - 1])
+
+        if in_order:
+            # Fast path: amortized O(1) per reading
+            self._reserve(count)
+            end = self.size + count
+            self.timestamps[self.size:end] = timestamps
+            self.levels[self.size:end] = levels
+            self.owners[self.size:end] = owners
+            self.size = end
+            return
+
+        # Back-filled readings: rebuild the columns in sorted order. Fresh arrays
+        # are allocated so views handed out earlier stay valid.
+        all_timestamps = np.concatenate([self.timestamps[:self.size], timestamps])
+        order = np.argsort(all_timestamps, kind="stable")
+        all_levels = np.concatenate([self.levels[:self.size], levels])
+        all_owners = np.concatenate([self.owners[:self.size], owners])
+
+        capacity = max(INITIAL_CAPACITY, len(order) * 2)
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.levels = np.empty(capacity, dtype=np.float32)
+        self.owners = np.zeros(capacity, dtype=np.int32)
+        self.size = len(order)
+        self.timestamps[:self.size] = all_timestamps[order]
+        self.levels[:self.size] = all_levels[order]
+        self.owners[:self.size] = all_owners[order]
+
+    def replace(self, start_us: int, end_us: int, timestamps: np.ndarray, levels: np.ndarray,
+                owners: np.ndarray) -> None:
+        """Swap the readings within [start_us, end_us] for sorted readings of the same range"""
+        current = self.timestamps[:self.size]
+        lo = int(np.searchsorted(current, start_us, side="left"))
+        hi = int(np.searchsorted(current, end_us, side="right"))
+        size = self.size - (hi - lo) + len(timestamps)
+
+        # Fresh arrays, so views handed out earlier stay valid
+        capacity = max(INITIAL_CAPACITY, size * 2)
+        columns = {}
+        for name, new in (("timestamps", timestamps), ("levels", levels), ("owners", owners)):
+            old = getattr(self, name)
+            column = np.zeros(capacity, dtype=old.dtype)
+            column[:size] = np.concatenate([old[:lo], new.astype(old.dtype), old[hi:self.size]])
+            columns[name] = column
+        for name, column in columns.items():
+            setattr(self, name, column)
+        self.size = size
+
+    def slice(self, tank_id: str, start_us: Optional[int], end_us: Optional[int]) -> TankSeries:
+        """Return views over [start_us, end_us] located by binary search"""
+        timestamps = self.timestamps[:self.size]
+        lo = int(np.searchsorted(timestamps, start_us, side="left")) if start_us is not None else 0
+        hi = int(np.searchsorted(timestamps, end_us, side="right")) if end_us is not None else self.size
+
+        user_ids = None
+        owners = self.owners[lo:hi]
+        if len(self.owner_names) > 1 and owners.any():
+            user_ids = np.asarray(self.owner_names, dtype=object)[owners]
+
+        return TankSeries(tank_id, timestamps[lo:hi], self.levels[lo:hi], user_ids)
+
+
+class TankHistoryCache:
+    """Process-wide columnar cache of tank history
+
+    Each tank's history is loaded once through the loader callable and kept as
+    sorted NumPy arrays. Time ranges are resolved with searchsorted and new
+    readings extend the arrays in place, so reads do not depend on file size.
+    """
+
+    def __init__(self, loader: Callable[[str], TankSeries], lock: Optional[threading.RLock] = None):
+        """Initialize the cache with a function that loads a tank's full history"""
+        self.loader = loader
+        self.lock = lock or threading.RLock()
+        self._series: Dict[str, _CachedSeries] = {}
+
+    def _get(self, tank_id: str) -> _CachedSeries:
+        cached = self._series.get(tank_id)
+        if cached is None:
+            series = self.loader(tank_id)
+            cached = _CachedSeries(series)
+            self._series[tank_id] = cached
+            logger.info(f"Loaded {len(series)} readings for tank {tank_id} into history cache")
+        return cached
+
+    def get_series(self, tank_id: str, start_us: Optional[int] = None,
+                   end_us: Optional[int] = None) -> TankSeries:
+        """
+        Get a tank's history between two epoch-microsecond bounds
+
+        Args:
+            tank_id: Tank to read
+            start_us: Optional inclusive lower bound
+            end_us: Optional inclusive upper bound
+
+        Returns:
+            TankSeries whose arrays are views into the cache
+        """
+        with self.lock:
+            return self._get(tank_id).slice(tank_id, start_us, end_us)
+
+    def append(self, series: TankSeries) -> None:
+        """Extend a tank's cached history with newly written readings"""
+        with self.lock:
+            cached = self._series.get(series.tank_id)
+            if cached is None:
+                # Not loaded yet; the loader will pick the readings up from storage
+                return
+            owners = np.zeros(len(series), dtype=np.int32)
+            if series.user_ids is not None:
+                owners = cached._encode_owners(series.user_ids)
+            cached.append(series.timestamps, series.levels.astype(np.float32), owners)
+
+    def replace_range(self, tank_id: str, start_us: int, end_us: int, series: TankSeries) -> None:
+        """Swap a tank's cached readings within [start_us, end_us] for what is now stored there (e.g. after retention)"""
+        with self.lock:
+            cached = self._series.get(tank_id)
+            if cached is None:
+                return
+            owners = np.zeros(len(series), dtype=np.int32)
+            if series.user_ids is not None:
+                owners = cached._encode_owners(series.user_ids)
+            cached.replace(start_us, end_us, series.timestamps, series.levels, owners)
+
+    def invalidate(self, tank_id: Optional[str] = None) -> None:
+        """Drop one tank, or every tank, so it is reloaded on next access"""
+        with self.lock:
+            if tank_id is None:
+                self._series = {}
+            else:
+                self._series.pop(tank_id, None)
+
+    def is_loaded(self, tank_id: str) -> bool:
+        """Check whether a tank's history is already in the cache"""
+        return tank_id in self._series
+
+    def size(self, tank_id: str) -> int:
+        """Get the number of cached readings for a tank (0 if not loaded)"""
+        cached = self._series.get(tank_id)
+        return cached.size if cached else 0
@@ -0,0 +1,233 @@
+import csv
+import io
+import json
+import logging
+from typing import Callable, Dict, Iterable, Iterator, Optional
+import numpy as np
+import pandas as pd
+from tank_storage import TankSeries
+
+# pyarrow is only needed for the Arrow and Parquet formats
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_TYPE = "application/vnd.apache.parquet"
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": ARROW_STREAM_TYPE,
+    "parquet": PARQUET_TYPE,
+}
+COLUMNAR_FORMATS = ["arrow", "parquet"]
+EXPORT_COLUMNS = ["timestamp", "level", "tank_id", "user_id"]
+
+
+def arrow_available() -> bool:
+    """Check whether pyarrow is installed"""
+    return pa is not None
+
+
+def _chunk_rows(series: TankSeries, default_user_id: Optional[str]) -> Iterator[list]:
+    """Yield [timestamp, level, tank_id, user_id] rows of one chunk"""
+    timestamps = series.timestamps.astype("datetime64[us]").astype(str)
+    # Shortest repr of each float32 level, matching what the store holds
+    levels = [float(level) for level in series.levels.astype(str)]
+    user_ids = series.user_ids if series.user_ids is not None else [None] * len(series)
+    for timestamp, level, user_id in zip(timestamps, levels, user_ids):
+        yield [timestamp, level, series.tank_id, user_id if user_id is not None else default_user_id]
+
+
+def format_ndjson(chunks: Iterable[TankSeries], default_user_id: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Format history chunks as NDJSON, one block per chunk
+
+    Args:
+        chunks: TankSeries chunks to export
+        default_user_id: Owner shown for readings without one
+
+    Returns:
+        Iterator of UTF-8 NDJSON blocks
+    """
+    for series in chunks:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n"
+            for row in _chunk_rows(series, default_user_id)
+        ).encode("utf-8")
+
+
+def format_csv(chunks: Iterable[TankSeries], default_user_id: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Format history chunks as CSV with a single header row, one block per chunk
+
+    Args:
+        chunks: TankSeries chunks to export
+        default_user_id: Owner shown for readings without one
+
+    Returns:
+        Iterator of UTF-8 CSV blocks
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+
+    for series in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(_chunk_rows(series, default_user_id))
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _DrainSink(io.RawIOBase):
+    """Write-only file object whose contents are handed out as they are written"""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("timestamp", pa.timestamp("us")),
+        ("level", pa.float32()),
+        ("tank_id", pa.dictionary(pa.int32(), pa.string())),
+        ("user_id", pa.string()),
+    ])
+
+
+def series_to_record_batch(series: TankSeries, default_user_id: Optional[str] = None):
+    """
+    Convert a tank series to an Arrow record batch
+
+    Timestamps and levels are wrapped without copying; tank_id is a one-entry
+    dictionary column.
+
+    Args:
+        series: Tank series to convert
+        default_user_id: Owner recorded for readings without one
+
+    Returns:
+        pyarrow.RecordBatch with the EXPORT_COLUMNS
+    """
+    count = len(series)
+    if series.user_ids is not None:
+        user_ids = series.user_ids
+        if default_user_id is not None:
+            user_ids = np.where(pd.isnull(user_ids), default_user_id, user_ids)
+        user_column = pa.array(user_ids, type=pa.string())
+    elif default_user_id is not None:
+        user_column = pa.array(np.full(count, default_user_id, dtype=object), type=pa.string())
+    else:
+        user_column = pa.nulls(count, pa.string())
+
+    return pa.record_batch([
+        pa.array(series.timestamps.view("datetime64[us]")),
+        pa.array(series.levels),
+        pa.DictionaryArray.from_arrays(pa.array(np.zeros(count, dtype=np.int32)), pa.array([series.tank_id])),
+        user_column,
+    ], schema=_arrow_schema())
+
+
+def _format_columnar(chunks: Iterable[TankSeries], default_user_id: Optional[str], writer_factory) -> Iterator[bytes]:
+    """Write chunks through an Arrow IPC or Parquet writer, yielding bytes as they are produced"""
+    sink = _DrainSink()
+    writer = writer_factory(sink, _arrow_schema())
+    for series in chunks:
+        writer.write_batch(series_to_record_batch(series, default_user_id))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+def format_arrow(chunks: Iterable[TankSeries], default_user_id: Optional[str] = None) -> Iterator[bytes]:
+    """Format history chunks as an Arrow IPC stream, one record batch per chunk"""
+    return _format_columnar(chunks, default_user_id, pa.ipc.new_stream)
+
+
+def format_parquet(chunks: Iterable[TankSeries], default_user_id: Optional[str] = None) -> Iterator[bytes]:
+    """Format history chunks as a Parquet file, one row group per chunk"""
+    return _format_columnar(chunks, default_user_id, pq.ParquetWriter)
+
+
+FORMATTERS: Dict[str, Callable[[Iterable[TankSeries], Optional[str]], Iterator[bytes]]] = {
+    "ndjson": format_ndjson,
+    "csv": format_csv,
+    "arrow": format_arrow,
+    "parquet": format_parquet,
+}
+
+
+def export_stream(chunks: Iterable[TankSeries], export_format: str,
+                  default_user_id: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Encode history chunks in an export format
+
+    Args:
+        chunks: TankSeries chunks to export
+        export_format: One of EXPORT_FORMATS
+        default_user_id: Owner shown for readings without one
+
+    Returns:
+        Iterator of encoded blocks for a streaming response
+    """
+    if export_format not in FORMATTERS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if export_format in COLUMNAR_FORMATS and not arrow_available():
+        raise RuntimeError("pyarrow is required for Arrow and Parquet export")
+
+    exported = 0
+
+    def counted() -> Iterator[TankSeries]:
+        nonlocal exported
+        for series in chunks:
+            exported += len(series)
+            yield series
+
+    yield from FORMATTERS[export_format](counted(), default_user_id)
+    logger.info(f"Exported {exported} readings as {export_format}")
+
+
+def frame_to_arrow(df: pd.DataFrame) -> bytes:
+    """
+    Serialize a query result DataFrame as a single Arrow IPC stream
+
+    Args:
+        df: Frame returned by a tank level query (raw, downsampled or rollup)
+
+    Returns:
+        Arrow IPC stream bytes
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,426 @@
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Callable, Set, Tuple
+import numpy as np
+import pandas as pd
+from tank_storage import TankSeries
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+MICROSECONDS = {"1m": 60 * 10**6, "1h": 3600 * 10**6, "1d": 86400 * 10**6}
+RESOLUTIONS = ["raw", "1m", "1h", "1d"]  # finest to coarsest
+INITIAL_CAPACITY = 256
+ALL_TIME_US = 1 << 62  # a bucket width no timestamp range reaches
+COVER_ORDER = ["1d", "1h", "1m"]  # coarsest first
+
+# Per-bucket aggregate columns and their dtypes
+COLUMNS = {
+    "bucket": np.int64,     # bucket start, epoch microseconds
+    "count": np.int64,
+    "min": np.float32,
+    "max": np.float32,
+    "sum": np.float64,
+    "m2": np.float64,       # sum of squared deviations from the bucket mean (Welford/Chan)
+    "last_ts": np.int64,
+    "last": np.float32,
+}
+
+
+def empty_columns() -> Dict[str, np.ndarray]:
+    """Get zero-length aggregate columns"""
+    return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+
+def aggregate(timestamps: np.ndarray, levels: np.ndarray, width_us: int) -> Dict[str, np.ndarray]:
+    """
+    Aggregate sorted readings into fixed-width time buckets in one vectorized pass
+
+    Args:
+        timestamps: Sorted int64 epoch microseconds
+        levels: Levels aligned with timestamps
+        width_us: Bucket width in microseconds
+
+    Returns:
+        Dict of COLUMNS arrays, one entry per non-empty bucket
+    """
+    if len(timestamps) == 0:
+        return empty_columns()
+
+    buckets = timestamps // width_us * width_us
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    last_index = np.r_[starts[1:], len(timestamps)] - 1
+    values = np.asarray(levels, dtype=np.float64)
+    counts = np.diff(np.r_[starts, len(timestamps)]).astype(np.int64)
+    sums = np.add.reduceat(values, starts)
+    deviations = values - np.repeat(sums / counts, counts)
+
+    return {
+        "bucket": buckets[starts],
+        "count": counts,
+        "min": np.minimum.reduceat(values, starts).astype(np.float32),
+        "max": np.maximum.reduceat(values, starts).astype(np.float32),
+        "sum": sums,
+        "m2": np.add.reduceat(deviations * deviations, starts),
+        "last_ts": timestamps[last_index],
+        "last": values[last_index].astype(np.float32),
+    }
+
+
+def aggregate_all(timestamps: np.ndarray, levels: np.ndarray) -> Dict[str, np.ndarray]:
+    """Aggregate sorted readings into a single partial, e.g. the raw edges of a range"""
+    return aggregate(timestamps, levels, ALL_TIME_US)
+
+
+def merge_m2(count_a: np.ndarray, sum_a: np.ndarray, m2_a: np.ndarray,
+             count_b: np.ndarray, sum_b: np.ndarray, m2_b: np.ndarray) -> np.ndarray:
+    """
+    Combine the M2 of two sets of partial aggregates pairwise (Chan et al.)
+
+    Args:
+        count_a, sum_a, m2_a: First partials
+        count_b, sum_b, m2_b: Second partials, aligned with the first
+
+    Returns:
+        M2 of each combined pair
+    """
+    total = count_a + count_b
+    delta = sum_b / np.maximum(count_b, 1) - sum_a / np.maximum(count_a, 1)
+    return m2_a + m2_b + delta * delta * count_a * count_b / np.maximum(total, 1)
+
+
+def combine_buckets(partials: List[Dict[str, np.ndarray]]) -> Dict[str, Any]:
+    """
+    Merge any number of partial aggregates into overall statistics
+
+    Partials can be buckets of different widths, tanks or raw edges of a
+    range; the result is exact, not an average of averages.
+
+    Args:
+        partials: Dicts of COLUMNS arrays (the bucket column is not used)
+
+    Returns:
+        count, min_level, max_level, avg_level, std_dev (sample, None for fewer
+        than two readings), current_level and last_updated (epoch microseconds)
+    """
+    counts = np.concatenate([part["count"] for part in partials]) if partials else np.empty(0, dtype=np.int64)
+    count = int(counts.sum())
+    if count == 0:
+        return {"count": 0, "min_level": None, "max_level": None, "avg_level": None,
+                "std_dev": None, "current_level": None, "last_updated": None}
+
+    nonempty = counts > 0
+    counts = counts[nonempty]
+    sums = np.concatenate([part["sum"] for part in partials])[nonempty]
+    m2s = np.concatenate([part["m2"] for part in partials])[nonempty]
+    last_ts = np.concatenate([part["last_ts"] for part in partials])[nonempty]
+    mean = float(sums.sum() / count)
+    deviations = sums / counts - mean
+    m2 = float(m2s.sum() + (counts * deviations * deviations).sum())
+    newest = int(np.argmax(last_ts))
+
+    return {
+        "count": count,
+        "min_level": float(np.concatenate([part["min"] for part in partials])[nonempty].min()),
+        "max_level": float(np.concatenate([part["max"] for part in partials])[nonempty].max()),
+        "avg_level": mean,
+        "std_dev": float(np.sqrt(m2 / (count - 1))) if count > 1 else None,
+        "current_level": float(np.concatenate([part["last"] for part in partials])[nonempty][newest]),
+        "last_updated": int(last_ts[newest]),
+    }
+
+
+class RollupTier:
+    """Growable, bucket-sorted aggregate columns for one tank at one resolution"""
+
+    def __init__(self, width_us: int):
+        self.width_us = width_us
+        self.size = 0
+        self.columns = {name: np.empty(INITIAL_CAPACITY, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    def _view(self, name: str) -> np.ndarray:
+        return self.columns[name][:self.size]
+
+    def _reserve(self, extra: int) -> None:
+        needed = self.size + extra
+        capacity = len(self.columns["bucket"])
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        for name, old in self.columns.items():
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            self.columns[name] = new
+
+    def merge(self, new: Dict[str, np.ndarray]) -> None:
+        """Fold freshly aggregated buckets into the tier"""
+        if len(new["bucket"]) == 0:
+            return
+
+        buckets = self._view("bucket")
+        positions = np.searchsorted(buckets, new["bucket"])
+        matched = positions < self.size
+        matched[matched] = buckets[positions[matched]] == new["bucket"][matched]
+
+        # Readings that land in buckets we already have: combine in place
+        if matched.any():
+            at = positions[matched]
+            self.columns["m2"][at] = merge_m2(self.columns["count"][at], self.columns["sum"][at],
+                                              self.columns["m2"][at], new["count"][matched],
+                                              new["sum"][matched], new["m2"][matched])
+            self.columns["count"][at] += new["count"][matched]
+            self.columns["min"][at] = np.minimum(self.columns["min"][at], new["min"][matched])
+            self.columns["max"][at] = np.maximum(self.columns["max"][at], new["max"][matched])
+            self.columns["sum"][at] += new["sum"][matched]
+            newer = new["last_ts"][matched] >= self.columns["last_ts"][at]
+            self.columns["last_ts"][at[newer]] = new["last_ts"][matched][newer]
+            self.columns["last"][at[newer]] = new["last"][matched][newer]
+
+        fresh = ~matched
+        if not fresh.any():
+            return
+
+        count = int(fresh.sum())
+        if self.size == 0 or new["bucket"][fresh][0] > buckets[-1]:
+            # Common case: new buckets extend the end of the tier
+            self._reserve(count)
+            for name in COLUMNS:
+                self.columns[name][self.size:self.size + count] = new[name][fresh]
+            self.size += count
+            return
+
+        # Back-filled buckets: rebuild sorted columns
+        merged = {name: np.concatenate([self._view(name), new[name][fresh]]) for name in COLUMNS}
+        order = np.argsort(merged["bucket"], kind="stable")
+        total = len(order)
+        self.columns = {
+            name: np.empty(max(INITIAL_CAPACITY, total * 2), dtype=dtype) for name, dtype in COLUMNS.items()
+        }
+        for name in COLUMNS:
+            self.columns[name][:total] = merged[name][order]
+        self.size = total
+
+    def drop(self, start_us: int, end_us: int) -> None:
+        """Remove the buckets starting within [start_us, end_us]"""
+        lo, hi = self.bounds(start_us, end_us)
+        if lo == hi:
+            return
+        # Fresh arrays, so slices handed out earlier stay valid
+        keep = np.r_[0:lo, hi:self.size]
+        total = len(keep)
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            columns[name] = np.empty(max(INITIAL_CAPACITY, total * 2), dtype=dtype)
+            columns[name][:total] = self.columns[name][keep]
+        self.columns = columns
+        self.size = total
+
+    def bounds(self, start_us: Optional[int], end_us: Optional[int]) -> Tuple[int, int]:
+        """Locate buckets starting within [start_us, end_us] by binary search
+
+        A bucket that straddles start_us is left out, so a rollup never carries
+        readings from before the requested (or subscription-limited) start.
+        """
+        buckets = self._view("bucket")
+        lo = int(np.searchsorted(buckets, start_us, side="left")) if start_us is not None else 0
+        hi = int(np.searchsorted(buckets, end_us, side="right")) if end_us is not None else self.size
+        return lo, hi
+
+    def covered(self, start_us: Optional[int], end_us: Optional[int]) -> Tuple[int, int]:
+        """Locate buckets lying entirely within [start_us, end_us]"""
+        bucket_end = end_us - self.width_us + 1 if end_us is not None else None
+        return self.bounds(start_us, bucket_end)
+
+    def slice(self, start_us: Optional[int], end_us: Optional[int]) -> Dict[str, np.ndarray]:
+        lo, hi = self.bounds(start_us, end_us)
+        return {name: self.columns[name][lo:hi] for name in COLUMNS}
+
+
+def rollup_to_frame(tank_id: str, columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Convert aggregate columns to the API's rollup row shape"""
+    count = columns["count"]
+    return pd.DataFrame({
+        "timestamp": columns["bucket"].astype("datetime64[us]"),
+        "level": columns["sum"] / np.maximum(count, 1),
+        "tank_id": np.full(len(count), tank_id, dtype=object),
+        "min_level": columns["min"].astype(np.float64),
+        "max_level": columns["max"].astype(np.float64),
+        "last_level": columns["last"].astype(np.float64),
+        "count": count,
+    })
+
+
+class RollupStore:
+    """Per-tank 1-minute, hourly and daily rollups maintained on ingest
+
+    Each tank's tiers are built from its full history on first use (one
+    vectorized pass per tier) and then folded forward as readings are written,
+    so long-range queries read a few hundred pre-aggregated buckets.
+    """
+
+    def __init__(self, loader: Callable[[str], TankSeries], lock: Optional[threading.RLock] = None):
+        """Initialize with a function that returns a tank's full history"""
+        self.loader = loader
+        self.lock = lock or threading.RLock()
+        self._tiers: Dict[str, Dict[str, RollupTier]] = {}
+        self._owners: Dict[str, Set[str]] = {}  # tank_id -> user IDs owning any of its readings
+
+    def _get(self, tank_id: str) -> Dict[str, RollupTier]:
+        tiers = self._tiers.get(tank_id)
+        if tiers is None:
+            series = self.loader(tank_id)
+            tiers = {name: RollupTier(width) for name, width in MICROSECONDS.items()}
+            for name, tier in tiers.items():
+                tier.merge(aggregate(series.timestamps, series.levels, tier.width_us))
+            self._tiers[tank_id] = tiers
+            self._owners[tank_id] = _owner_set(series)
+            logger.info(f"Built rollups for tank {tank_id} from {len(series)} readings")
+        return tiers
+
+    def ingest(self, series: TankSeries) -> None:
+        """Fold newly written readings into a tank's tiers"""
+        with self.lock:
+            tiers = self._tiers.get(series.tank_id)
+            if tiers is None:
+                # Not built yet; the loader will include these readings
+                return
+            order = np.argsort(series.timestamps, kind="stable")
+            timestamps = series.timestamps[order]
+            levels = series.levels[order]
+            for tier in tiers.values():
+                tier.merge(aggregate(timestamps, levels, tier.width_us))
+            self._owners[series.tank_id] |= _owner_set(series)
+
+    def replace_range(self, tank_id: str, start_us: int, end_us: int, series: TankSeries) -> None:
+        """
+        Re-aggregate the buckets of a range whose readings were replaced (e.g. by retention)
+
+        Args:
+            tank_id: Tank whose history changed
+            start_us: First microsecond of a whole day
+            end_us: Last microsecond of a whole day
+            series: Sorted readings now stored within the range
+        """
+        with self.lock:
+            tiers = self._tiers.get(tank_id)
+            if tiers is None:
+                return
+            # Every tier's buckets nest within days, so whole days re-aggregate exactly.
+            # The owner set may keep users whose readings were dropped, which only
+            # makes visible_to() more cautious.
+            for tier in tiers.values():
+                tier.drop(start_us, end_us)
+                tier.merge(aggregate(series.timestamps, series.levels, tier.width_us))
+
+    def invalidate(self, tank_id: Optional[str] = None) -> None:
+        """Drop one tank's rollups, or all of them, so they are rebuilt on next use"""
+        with self.lock:
+            if tank_id is None:
+                self._tiers = {}
+                self._owners = {}
+            else:
+                self._tiers.pop(tank_id, None)
+                self._owners.pop(tank_id, None)
+
+    def bucket_count(self, tank_id: str, resolution: str, start_us: Optional[int], end_us: Optional[int]) -> int:
+        """Count the buckets a query would return"""
+        with self.lock:
+            lo, hi = self._get(tank_id)[resolution].bounds(start_us, end_us)
+            return hi - lo
+
+    def visible_to(self, tank_id: str, user_id: Optional[str]) -> bool:
+        """Check whether every reading of a tank is visible to a user, so its rollups can be served as-is"""
+        if user_id is None:
+            return True
+        with self.lock:
+            self._get(tank_id)
+            return self._owners[tank_id] <= {user_id}
+
+    def cover(self, tank_id: str, start_us: Optional[int] = None,
+              end_us: Optional[int] = None) -> Tuple[List[Dict[str, np.ndarray]], List[Tuple[Optional[int], Optional[int]]]]:
+        """
+        Cover a time range with as few whole buckets as possible
+
+        Daily buckets inside the range are used first, then hourly and
+        1-minute buckets for the partial days and hours at its edges. What is
+        left are at most two sub-minute gaps that the caller reads raw.
+
+        Args:
+            tank_id: Tank to cover
+            start_us: Optional inclusive lower bound (epoch microseconds)
+            end_us: Optional inclusive upper bound (epoch microseconds)
+
+        Returns:
+            Tuple of (bucket partials, [(start_us, end_us)] gaps to read raw)
+        """
+        partials: List[Dict[str, np.ndarray]] = []
+        gaps: List[Tuple[Optional[int], Optional[int]]] = []
+
+        def walk(lo_us: Optional[int], hi_us: Optional[int], level: int) -> None:
+            if lo_us is not None and hi_us is not None and lo_us > hi_us:
+                return
+            if level == len(COVER_ORDER):
+                gaps.append((lo_us, hi_us))
+                return
+            tier = tiers[COVER_ORDER[level]]
+            lo, hi = tier.covered(lo_us, hi_us)
+            if lo >= hi:
+                walk(lo_us, hi_us, level + 1)
+                return
+            partials.append({name: tier.columns[name][lo:hi].copy() for name in COLUMNS})
+            if lo_us is not None:
+                walk(lo_us, int(tier.columns["bucket"][lo]) - 1, level + 1)
+            if hi_us is not None:
+                walk(int(tier.columns["bucket"][hi - 1]) + tier.width_us, hi_us, level + 1)
+
+        with self.lock:
+            tiers = self._get(tank_id)
+            walk(start_us, end_us, 0)
+        return partials, gaps
+
+    def query(self, tank_id: str, resolution: str, start_us: Optional[int] = None,
+              end_us: Optional[int] = None) -> pd.DataFrame:
+        """
+        Read pre-aggregated buckets for a tank
+
+        Args:
+            tank_id: Tank to read
+            resolution: "1m", "1h" or "1d"
+            start_us: Optional inclusive lower bound (epoch microseconds)
+            end_us: Optional inclusive upper bound (epoch microseconds)
+
+        Returns:
+            DataFrame of rollup rows (timestamp is the bucket start)
+        """
+        with self.lock:
+            columns = self._get(tank_id)[resolution].slice(start_us, end_us)
+            columns = {name: values.copy() for name, values in columns.items()}
+        return rollup_to_frame(tank_id, columns)
+
+
+def _owner_set(series: TankSeries) -> Set[str]:
+    if series.user_ids is None:
+        return set()
+    return {user_id for user_id in pd.unique(series.user_ids) if pd.notnull(user_id)}
+
+
+def choose_resolution(raw_count: int, bucket_counts: Dict[str, int], max_points: int) -> str:
+    """
+    Pick the finest resolution whose point count fits in max_points
+
+    Args:
+        raw_count: Number of raw readings in the range
+        bucket_counts: Number of buckets in the range for each rollup tier
+        max_points: Upper bound on returned points
+
+    Returns:
+        One of RESOLUTIONS (falls back to the coarsest tier)
+    """
+    if raw_count <= max_points:
+        return "raw"
+    for resolution in RESOLUTIONS[1:]:
+        if bucket_counts.get(resolution, 0) <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
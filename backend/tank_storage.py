@@ -0,0 +1,1121 @@
+import calendar
+import json
+import os
+import shutil
+import logging
+import threading
+from datetime import datetime, date
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Callable, List, Optional, Iterable, Iterator, Set, Tuple
+from urllib.parse import quote, unquote
+from gorilla_codec import encode_block, decode_block
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Constants
+DATA_DIR = "data"
+SEGMENTS_DIR = os.path.join(DATA_DIR, "segments")
+SEGMENT_SUFFIX = ".ndjson"
+COLD_SUFFIX = ".gorilla"      # compressed monthly block, see gorilla_codec
+PARTIAL_SUFFIX = ".partial"   # compaction output still being written
+COMPLETE_SUFFIX = ".tmp"      # compaction output fully written, sources not yet removed
+REWRITE_SUFFIX = ".rewrite"   # replacement tank directory being built
+OLD_SUFFIX = ".old"           # tank directory being replaced
+
+
+def to_epoch_us(timestamp: datetime) -> int:
+    """Convert a (naive, local) datetime to integer microseconds since the epoch"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return int(np.datetime64(timestamp, 'us').astype(np.int64))
+
+
+def to_epoch_us_array(timestamps: Iterable[Any]) -> np.ndarray:
+    """Vectorized to_epoch_us for datetimes or naive ISO-8601 strings"""
+    values = [
+        ts.astimezone().replace(tzinfo=None) if isinstance(ts, datetime) and ts.tzinfo is not None else ts
+        for ts in timestamps
+    ]
+    return np.array(values, dtype="datetime64[us]").astype(np.int64)
+
+
+def from_epoch_us(value: int) -> datetime:
+    """Convert integer microseconds since the epoch back to a naive datetime"""
+    return np.datetime64(int(value), 'us').astype(datetime)
+
+
+class TankSeries:
+    """Columnar history of a single tank, sorted by timestamp
+
+    Timestamps are int64 microseconds since the epoch, levels are float32 and
+    user_ids is either None (no reading has an owner) or an object array.
+    """
+
+    __slots__ = ("tank_id", "timestamps", "levels", "user_ids")
+
+    def __init__(self, tank_id: str, timestamps: np.ndarray, levels: np.ndarray,
+                 user_ids: Optional[np.ndarray] = None):
+        self.tank_id = tank_id
+        self.timestamps = timestamps
+        self.levels = levels
+        self.user_ids = user_ids
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def empty(cls, tank_id: str) -> "TankSeries":
+        return cls(tank_id, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+
+    @classmethod
+    def from_records(cls, tank_id: str, records: List[Dict[str, Any]]) -> "TankSeries":
+        """Build a sorted series from reading dicts"""
+        timestamps = to_epoch_us_array([item["timestamp"] for item in records])
+        levels = np.fromiter((item["level"] for item in records), dtype=np.float32, count=len(records))
+        user_ids = None
+        if any(item.get("user_id") is not None for item in records):
+            user_ids = np.array([item.get("user_id") for item in records], dtype=object)
+
+        order = np.argsort(timestamps, kind="stable")
+        return cls(tank_id, timestamps[order], levels[order], user_ids[order] if user_ids is not None else None)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Convert to reading dicts with datetime timestamps"""
+        timestamps = self.timestamps.astype("datetime64[us]").astype(object)
+        user_ids = self.user_ids if self.user_ids is not None else [None] * len(self)
+        records = []
+        for timestamp, level, user_id in zip(timestamps, self.levels.tolist(), user_ids):
+            record = {"timestamp": timestamp, "level": level, "tank_id": self.tank_id}
+            if user_id is not None:
+                record["user_id"] = user_id
+            records.append(record)
+        return records
+
+    def chunks(self, size: int) -> Iterator["TankSeries"]:
+        """Split into consecutive views of at most `size` readings"""
+        for offset in range(0, len(self), size):
+            end = offset + size
+            yield TankSeries(
+                self.tank_id,
+                self.timestamps[offset:end],
+                self.levels[offset:end],
+                self.user_ids[offset:end] if self.user_ids is not None else None,
+            )
+
+    def owned_by(self, user_id: Optional[str]) -> "TankSeries":
+        """Keep readings that belong to a user or have no owner"""
+        if user_id is None or self.user_ids is None:
+            return self
+        mask = pd.isnull(self.user_ids) | (self.user_ids == user_id)
+        if mask.all():
+            return self
+        return TankSeries(self.tank_id, self.timestamps[mask], self.levels[mask], self.user_ids[mask])
+
+    def contains(self, timestamps: np.ndarray, levels: np.ndarray) -> np.ndarray:
+        """Check which (timestamp, level) readings are part of this series"""
+        if not len(timestamps):
+            return np.zeros(0, dtype=bool)
+        stored = pd.MultiIndex.from_arrays([self.timestamps, self.levels.astype(np.float32)])
+        return pd.MultiIndex.from_arrays([timestamps, levels.astype(np.float32)]).isin(stored)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Convert to a DataFrame with timestamp, level and tank_id columns"""
+        columns = {
+            "timestamp": self.timestamps.astype("datetime64[us]"),
+            "level": self.levels.astype(np.float64),
+            "tank_id": np.full(len(self), self.tank_id, dtype=object),
+        }
+        if self.user_ids is not None:
+            # Keep missing owners as None rather than NaN
+            columns["user_id"] = pd.Series(self.user_ids, dtype=object)
+        return pd.DataFrame(columns)
+
+
+def series_to_frame(series_list: List[TankSeries]) -> pd.DataFrame:
+    """Concatenate several tank series into one DataFrame"""
+    frames = [series.to_frame() for series in series_list if len(series)]
+    if not frames:
+        return pd.DataFrame({
+            "timestamp": np.empty(0, dtype="datetime64[us]"),
+            "level": np.empty(0, dtype=np.float64),
+            "tank_id": np.empty(0, dtype=object),
+        })
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
+
+
+def encode_tank_id(tank_id: str) -> str:
+    """Encode a tank ID into a safe directory name (percent-encoded UTF-8)"""
+    # quote() never escapes "." or "~"; escape them too so no name can be "." or ".." or hidden
+    return quote(str(tank_id), safe="-_").replace(".", "%2E").replace("~", "%7E")
+
+
+def decode_tank_id(name: str) -> str:
+    """Decode a directory name created by encode_tank_id"""
+    return unquote(name)
+
+
+def rename_legacy_names(root: str, suffix: str = "") -> None:
+    """
+    Rename entries named by the old encoder, which kept non-ASCII letters as they were
+
+    Names whose escapes came from the old encoder cannot be decoded reliably
+    and are left alone.
+
+    Args:
+        root: Directory holding one entry per tank
+        suffix: File suffix after the encoded tank ID
+    """
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        if name.startswith(".") or not name.endswith(suffix) or name.isascii():
+            continue
+        stem = name[:len(name) - len(suffix)]
+        if "%" in stem:
+            continue
+        target = os.path.join(root, encode_tank_id(stem) + suffix)
+        if not os.path.exists(target):
+            os.replace(os.path.join(root, name), target)
+            logger.info(f"Renamed {name} to {os.path.basename(target)}")
+
+
+class TankStorage:
+    """Interface implemented by tank history backends
+
+    Backends store readings ({timestamp, level, tank_id, user_id}) and serve
+    per-tank time ranges as TankSeries. TankAPIService only talks to this
+    interface, so backends can be swapped through config.json.
+    """
+
+    def tank_ids(self) -> List[str]:
+        """Get the IDs of all tanks with stored history"""
+        raise NotImplementedError
+
+    def is_empty(self) -> bool:
+        """Check whether any readings have been stored"""
+        raise NotImplementedError
+
+    def last_timestamp(self, tank_id: str) -> Optional[datetime]:
+        """Get the timestamp of the newest reading stored for a tank"""
+        raise NotImplementedError
+
+    def first_timestamp(self, tank_id: str) -> Optional[datetime]:
+        """Get the timestamp of the oldest reading stored for a tank"""
+        raise NotImplementedError
+
+    def append(self, readings: Iterable[Dict[str, Any]]) -> int:
+        """Persist readings and return how many were written"""
+        raise NotImplementedError
+
+    def append_series(self, series_list: List[TankSeries]) -> int:
+        """
+        Append columnar batches, one per tank, as a single group commit
+
+        Backends with a columnar layout override this to skip building dicts.
+
+        Args:
+            series_list: Readings to append
+
+        Returns:
+            Number of readings written
+        """
+        records = []
+        for series in series_list:
+            records.extend(series.to_records())
+        return self.append(records)
+
+    def sync(self) -> None:
+        """
+        Force readings appended so far to stable storage
+
+        Appends only reach the OS page cache; the ingest buffer calls this
+        according to its fsync policy.
+        """
+
+    def read_series(self, tank_id: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, user_id: Optional[str] = None) -> TankSeries:
+        """
+        Read one tank's history within a time range
+
+        Args:
+            tank_id: Tank to read
+            start: Optional inclusive lower bound on timestamp
+            end: Optional inclusive upper bound on timestamp
+            user_id: Optional owner; readings of other users are skipped
+
+        Returns:
+            TankSeries sorted by timestamp
+        """
+        raise NotImplementedError
+
+    def read(self, tank_id: Optional[str] = None, start: Optional[datetime] = None,
+             end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Read readings as dicts sorted by timestamp"""
+        data = []
+        for current_tank in ([tank_id] if tank_id else self.tank_ids()):
+            data.extend(self.read_series(current_tank, start, end).to_frame().to_dict('records'))
+        data.sort(key=lambda item: item["timestamp"])
+        return data
+
+    def rewrite(self, tank_id: str, series: TankSeries) -> None:
+        """
+        Replace the entire history of a tank (used by retention)
+
+        Args:
+            tank_id: Tank to rewrite
+            series: The readings to keep, sorted by timestamp
+        """
+        raise NotImplementedError
+
+    def expire(self, tank_id: str, before: datetime,
+               retain: Callable[[TankSeries], Optional[TankSeries]]) -> Optional[Tuple[int, int, int, TankSeries]]:
+        """
+        Apply retention to the part of a tank's history that can hold expired readings
+
+        Backends that can replace part of a tank's history override this; by
+        default the whole history is read and rewritten.
+
+        Args:
+            tank_id: Tank to process
+            before: No reading at or after this time can be expired
+            retain: Returns the retained readings of a sorted series, or None if none expired
+
+        Returns:
+            (first, last) epoch microseconds of the whole days replaced, the number
+            of readings they held and the sorted readings now stored in them; None
+            if nothing changed
+        """
+        series = self.read_series(tank_id)
+        retained = retain(series)
+        if retained is None:
+            return None
+        self.rewrite(tank_id, retained)
+        return _day_start_us(series.timestamps[0]), _day_end_us(series.timestamps[-1]), len(series), retained
+
+    def compact(self, before: datetime) -> int:
+        """
+        Merge small files holding history older than a timestamp
+
+        Args:
+            before: Only history older than this is compacted
+
+        Returns:
+            Number of files merged away
+        """
+        return 0
+
+    def encode_cold(self, before: datetime) -> int:
+        """
+        Re-encode history older than a timestamp in a compressed cold format
+
+        Args:
+            before: Only history older than this is re-encoded
+
+        Returns:
+            Number of blocks encoded
+        """
+        return 0
+
+    def storage_bytes(self) -> int:
+        """Get the number of bytes the backend occupies on disk"""
+        raise NotImplementedError
+
+    def tank_bytes(self, tank_id: str) -> int:
+        """Get the number of bytes one tank's history occupies on disk"""
+        raise NotImplementedError
+
+    def import_legacy_file(self, path: str) -> int:
+        """
+        Import a legacy tank_levels.json file and rename it to *.migrated
+
+        Args:
+            path: Path to the JSON array file
+
+        Returns:
+            Number of readings imported
+        """
+        with open(path, 'r') as f:
+            data = json.load(f)
+
+        count = self.append(data)
+        os.replace(path, path + ".migrated")
+        logger.info(f"Migrated {count} readings from {path} into {type(self).__name__}")
+        return count
+
+    def close(self) -> None:
+        """Release files or connections held by the backend"""
+
+
+class SegmentedTankStore(TankStorage):
+    """Append-only tank history stored as one NDJSON segment per tank per day
+
+    Each reading is written as a single line to
+    data/segments/<tank_id>/<YYYY-MM-DD>.ndjson, so the cost of a write does
+    not depend on how much history already exists.
+    """
+
+    def __init__(self, root: str = SEGMENTS_DIR):
+        """Initialize the store and recover the tail segment of every tank"""
+        self.root = root
+        self._lock = threading.RLock()
+        self._handles: Dict[str, Tuple[str, Any]] = {}  # tank_id -> (segment path, open file)
+        self._unsynced: Set[str] = set()  # segment paths appended to since the last sync
+        self._last_timestamp: Dict[str, datetime] = {}
+
+        os.makedirs(self.root, exist_ok=True)
+        rename_legacy_names(self.root)
+        self._recover()
+
+    # Layout helpers
+
+    def _tank_dir(self, tank_id: str) -> str:
+        return os.path.join(self.root, encode_tank_id(tank_id))
+
+    def _segment_path(self, tank_id: str, day: date) -> str:
+        return os.path.join(self._tank_dir(tank_id), f"{day.isoformat()}{SEGMENT_SUFFIX}")
+
+    def _segments(self, tank_id: str) -> List[Tuple[date, date, str]]:
+        """List the segments of a tank as (first day, last day, path), sorted by last day
+
+        Daily segments are named YYYY-MM-DD; compacted monthly segments YYYY-MM,
+        either as NDJSON or as a compressed cold block.
+        """
+        tank_dir = self._tank_dir(tank_id)
+        if not os.path.isdir(tank_dir):
+            return []
+
+        segments = []
+        for name in os.listdir(tank_dir):
+            stem = _segment_stem(name)
+            if stem is None:
+                continue
+            try:
+                first_day, last_day = _segment_days(stem)
+            except ValueError:
+                logger.warning(f"Ignoring unexpected file in segment directory: {name}")
+                continue
+            segments.append((first_day, last_day, os.path.join(tank_dir, name)))
+
+        return sorted(segments, key=lambda segment: (segment[1], segment[0]))
+
+    def tank_ids(self) -> List[str]:
+        """Get the IDs of all tanks with stored history"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            decode_tank_id(name) for name in os.listdir(self.root)
+            if not name.startswith(".") and os.path.isdir(os.path.join(self.root, name))
+        )
+
+    def is_empty(self) -> bool:
+        """Check whether any readings have been stored"""
+        return not any(self._segments(tank_id) for tank_id in self.tank_ids())
+
+    def last_timestamp(self, tank_id: str) -> Optional[datetime]:
+        """Get the timestamp of the newest reading stored for a tank"""
+        return self._last_timestamp.get(tank_id)
+
+    def first_timestamp(self, tank_id: str) -> Optional[datetime]:
+        """Get the timestamp of the oldest reading, reading only the earliest segments"""
+        first = None
+        with self._lock:
+            for first_day, _, path in sorted(self._segments(tank_id)):
+                if first is not None and first_day > first.date():
+                    break
+                timestamps = _read_segment(tank_id, path).timestamps
+                if len(timestamps):
+                    candidate = from_epoch_us(timestamps.min())
+                    if first is None or candidate < first:
+                        first = candidate
+        return first
+
+    # Recovery
+
+    def _recover(self) -> None:
+        """Finish interrupted rewrites and compactions, then replay the tail
+        segment of each tank, dropping a torn final line
+
+        Other segments are repaired when they are next opened for append.
+        """
+        self._recover_rewrites()
+        for tank_id in self.tank_ids():
+            self._recover_compaction(tank_id)
+            segments = self._segments(tank_id)
+            if not segments:
+                continue
+
+            _, _, path = segments[-1]
+            if path.endswith(COLD_SUFFIX):
+                # Cold blocks are written whole and renamed into place
+                self._last_timestamp[tank_id] = from_epoch_us(_read_segment(tank_id, path).timestamps.max())
+                continue
+
+            last_timestamp = None
+            good_offset = 0
+
+            with open(path, 'rb') as f:
+                for raw_line in f:
+                    if not raw_line.endswith(b"\n"):
+                        break
+                    good_offset += len(raw_line)
+                    try:
+                        item = json.loads(raw_line)
+                        timestamp = datetime.fromisoformat(item["timestamp"])
+                    except (ValueError, KeyError, TypeError):
+                        # A complete but damaged line; readers skip it, later lines are kept
+                        continue
+                    if last_timestamp is None or timestamp > last_timestamp:
+                        last_timestamp = timestamp
+
+            if good_offset < os.path.getsize(path):
+                logger.warning(f"Truncating incomplete write at offset {good_offset} in segment {path}")
+                with open(path, 'r+b') as f:
+                    f.truncate(good_offset)
+
+            if last_timestamp is not None:
+                self._last_timestamp[tank_id] = last_timestamp
+
+        logger.info(f"Recovered segment store with {len(self._last_timestamp)} tanks")
+
+    def _recover_rewrites(self) -> None:
+        """Roll tank directory swaps forward or back"""
+        for name in os.listdir(self.root):
+            if not name.startswith("."):
+                continue
+            path = os.path.join(self.root, name)
+            if name.endswith(REWRITE_SUFFIX):
+                target = os.path.join(self.root, name[1:-len(REWRITE_SUFFIX)])
+                old = os.path.join(self.root, name[:-len(REWRITE_SUFFIX)] + OLD_SUFFIX)
+                if not os.path.exists(target) and os.path.exists(old):
+                    # Crashed between moving the old directory away and the new one in
+                    os.replace(path, target)
+                    logger.warning(f"Completed interrupted rewrite of {target}")
+                else:
+                    shutil.rmtree(path, ignore_errors=True)
+            elif name.endswith(OLD_SUFFIX):
+                target = os.path.join(self.root, name[1:-len(OLD_SUFFIX)])
+                if os.path.exists(target):
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def _recover_compaction(self, tank_id: str) -> None:
+        """Finish merges whose output was fully written; discard partial output"""
+        tank_dir = self._tank_dir(tank_id)
+        for name in os.listdir(tank_dir):
+            path = os.path.join(tank_dir, name)
+            if name.endswith(PARTIAL_SUFFIX):
+                os.remove(path)
+            elif name.endswith(COLD_SUFFIX):
+                # A cold block is only renamed into place once complete
+                source = path[:-len(COLD_SUFFIX)] + SEGMENT_SUFFIX
+                if os.path.exists(source):
+                    os.remove(source)
+                    logger.warning(f"Completed interrupted cold encoding of {path}")
+            elif name.endswith(SEGMENT_SUFFIX + COMPLETE_SUFFIX):
+                month = name[:-len(SEGMENT_SUFFIX + COMPLETE_SUFFIX)]
+                for first_day, last_day, source in self._segments(tank_id):
+                    if first_day.strftime("%Y-%m") == month and last_day.strftime("%Y-%m") == month:
+                        os.remove(source)
+                os.replace(path, path[:-len(COMPLETE_SUFFIX)])
+                logger.warning(f"Completed interrupted compaction of {path}")
+
+    # Writes
+
+    def _get_handle(self, tank_id: str, day: date):
+        """Get an append handle for a segment, keeping the newest one open per tank"""
+        path = self._segment_path(tank_id, day)
+        cached = self._handles.get(tank_id)
+        if cached and cached[0] == path:
+            return cached[1], False
+
+        os.makedirs(self._tank_dir(tank_id), exist_ok=True)
+        # Recovery only replays tail segments; a crash may have torn a back-filled day too
+        _truncate_torn_line(path)
+        handle = open(path, 'a', encoding='utf-8')
+
+        # Only keep the tail segment open; back-filled days are written and closed
+        last_timestamp = self._last_timestamp.get(tank_id)
+        if last_timestamp is None or day >= last_timestamp.date():
+            if cached:
+                cached[1].close()
+            self._handles[tank_id] = (path, handle)
+            return handle, False
+
+        return handle, True
+
+    def append(self, readings: Iterable[Dict[str, Any]]) -> int:
+        """
+        Append readings to their tank/day segments
+
+        Args:
+            readings: Readings with 'timestamp', 'level' and 'tank_id' keys
+
+        Returns:
+            Number of readings written
+        """
+        # Group lines by segment so each file is written once per call
+        grouped: Dict[Tuple[str, date], List[str]] = {}
+        newest: Dict[str, datetime] = {}
+        for item in readings:
+            timestamp = item["timestamp"]
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            tank_id = str(item.get("tank_id", "tank1"))
+
+            record = {"timestamp": timestamp.isoformat(), "level": float(item["level"]), "tank_id": tank_id}
+            if item.get("user_id") is not None:
+                record["user_id"] = item["user_id"]
+
+            grouped.setdefault((tank_id, timestamp.date()), []).append(json.dumps(record) + "\n")
+            if tank_id not in newest or timestamp > newest[tank_id]:
+                newest[tank_id] = timestamp
+
+        written = 0
+        with self._lock:
+            for (tank_id, day), lines in sorted(grouped.items()):
+                handle, close_after = self._get_handle(tank_id, day)
+                try:
+                    handle.write("".join(lines))
+                    handle.flush()
+                    self._unsynced.add(handle.name)
+                finally:
+                    if close_after:
+                        handle.close()
+                written += len(lines)
+
+            for tank_id, timestamp in newest.items():
+                last_timestamp = self._last_timestamp.get(tank_id)
+                if last_timestamp is None or timestamp > last_timestamp:
+                    self._last_timestamp[tank_id] = timestamp
+
+        return written
+
+    def append_series(self, series_list: List[TankSeries]) -> int:
+        """
+        Append columnar batches, one per tank, writing each day segment once
+
+        Args:
+            series_list: Sorted readings to append
+
+        Returns:
+            Number of readings written
+        """
+        written = 0
+        with self._lock:
+            for series in series_list:
+                if not len(series):
+                    continue
+                lines = _series_lines(series)
+                days = series.timestamps.astype("datetime64[us]").astype("datetime64[D]")
+                starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+                ends = np.r_[starts[1:], len(days)]
+                for lo, hi in zip(starts, ends):
+                    handle, close_after = self._get_handle(series.tank_id, days[lo].astype(date))
+                    try:
+                        handle.write("".join(lines[lo:hi]))
+                        handle.flush()
+                        self._unsynced.add(handle.name)
+                    finally:
+                        if close_after:
+                            handle.close()
+                written += len(series)
+
+                newest = from_epoch_us(series.timestamps[-1])
+                last_timestamp = self._last_timestamp.get(series.tank_id)
+                if last_timestamp is None or newest > last_timestamp:
+                    self._last_timestamp[series.tank_id] = newest
+
+        return written
+
+    def sync(self) -> None:
+        """Fsync every segment appended to since the last sync"""
+        with self._lock:
+            paths, self._unsynced = self._unsynced, set()
+            for path in paths:
+                fsync_path(path)
+
+    def close(self) -> None:
+        """Close any open segment handles"""
+        with self._lock:
+            for _, handle in self._handles.values():
+                handle.close()
+            self._handles = {}
+
+    # Reads
+
+    def read(self, tank_id: Optional[str] = None, start: Optional[datetime] = None,
+             end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Read readings from the store, skipping segments outside the time range
+
+        Args:
+            tank_id: Optional tank to read; all tanks if not given
+            start: Optional inclusive lower bound on timestamp
+            end: Optional inclusive upper bound on timestamp
+
+        Returns:
+            List of readings sorted by timestamp
+        """
+        tank_ids = [tank_id] if tank_id else self.tank_ids()
+        data = []
+
+        with self._lock:
+            for current_tank in tank_ids:
+                for first_day, last_day, path in self._segments(current_tank):
+                    if (start and last_day < start.date()) or (end and first_day > end.date()):
+                        continue
+
+                    for item in _segment_items(current_tank, path):
+                        if start and item["timestamp"] < start:
+                            continue
+                        if end and item["timestamp"] > end:
+                            continue
+                        data.append(item)
+
+        data.sort(key=lambda item: item["timestamp"])
+        return data
+
+    def read_series(self, tank_id: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, user_id: Optional[str] = None) -> TankSeries:
+        """Read the history of one tank as a columnar series"""
+        chunks = []
+
+        with self._lock:
+            for first_day, last_day, path in self._segments(tank_id):
+                if (start and last_day < start.date()) or (end and first_day > end.date()):
+                    continue
+                chunks.append(_read_segment(tank_id, path))
+
+        chunks = [chunk for chunk in chunks if len(chunk)]
+        if not chunks:
+            return TankSeries.empty(tank_id)
+        combined = _concat_series(tank_id, chunks)
+        series_timestamps, series_levels, series_user_ids = combined.timestamps, combined.levels, combined.user_ids
+
+        # Segments are appended in arrival order, so sort and trim the edge days
+        order = np.argsort(series_timestamps, kind="stable")
+        series_timestamps = series_timestamps[order]
+        lo = int(np.searchsorted(series_timestamps, to_epoch_us(start), side="left")) if start else 0
+        hi = int(np.searchsorted(series_timestamps, to_epoch_us(end), side="right")) if end else len(order)
+        order = order[lo:hi]
+
+        return TankSeries(
+            tank_id,
+            series_timestamps[lo:hi],
+            series_levels[order],
+            series_user_ids[order] if series_user_ids is not None else None,
+        ).owned_by(user_id)
+
+    # Maintenance
+
+    def _close_handle(self, tank_id: str) -> None:
+        cached = self._handles.pop(tank_id, None)
+        if cached:
+            cached[1].close()
+
+    def rewrite(self, tank_id: str, series: TankSeries) -> None:
+        """Replace a tank's segments by building a new directory and swapping it in"""
+        encoded = encode_tank_id(tank_id)
+        target = self._tank_dir(tank_id)
+        staging = os.path.join(self.root, f".{encoded}{REWRITE_SUFFIX}")
+        old = os.path.join(self.root, f".{encoded}{OLD_SUFFIX}")
+
+        with self._lock:
+            self._close_handle(tank_id)
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+
+            lines = _series_lines(series)
+            days = series.timestamps.astype("datetime64[us]").astype("datetime64[D]")
+            if len(days):
+                starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+                ends = np.r_[starts[1:], len(days)]
+                for lo, hi in zip(starts, ends):
+                    path = os.path.join(staging, f"{days[lo]}{SEGMENT_SUFFIX}")
+                    _write_durably(path, "".join(lines[lo:hi]))
+
+            if os.path.exists(target):
+                os.replace(target, old)
+            os.replace(staging, target)
+            shutil.rmtree(old, ignore_errors=True)
+
+            if len(series):
+                self._last_timestamp[tank_id] = from_epoch_us(series.timestamps[-1])
+            else:
+                self._last_timestamp.pop(tank_id, None)
+
+    def expire(self, tank_id: str, before: datetime,
+               retain: Callable[[TankSeries], Optional[TankSeries]]) -> Optional[Tuple[int, int, int, TankSeries]]:
+        """Replace only the segments that lose readings to retention
+
+        Segments starting after `before` are not read. Each changed segment is
+        rewritten in place in its own format (daily, monthly or cold), or
+        removed once empty, so a run costs in proportion to the expiring
+        history rather than to all of it.
+        """
+        with self._lock:
+            segments = self._segments(tank_id)
+            read: Dict[str, TankSeries] = {}
+            changed: Dict[str, TankSeries] = {}
+            for first_day, _, path in segments:
+                if first_day > before.date():
+                    continue
+                series = _sorted_series(_read_segment(tank_id, path))
+                read[path] = series
+                retained = retain(series)
+                if retained is not None:
+                    changed[path] = retained
+            if not changed:
+                return None
+
+            # Report whole days, including unchanged segments that overlap them
+            first = min(first_day for first_day, _, path in segments if path in changed)
+            last = max(last_day for _, last_day, path in segments if path in changed)
+            self._close_handle(tank_id)
+            before_parts, after_parts = [], []
+            for first_day, last_day, path in segments:
+                if last_day < first or first_day > last:
+                    continue
+                series = read.get(path)
+                if series is None:
+                    series = _read_segment(tank_id, path)
+                before_parts.append(series)
+                if path in changed:
+                    self._replace_segment(path, changed[path])
+                    after_parts.append(changed[path])
+                else:
+                    after_parts.append(series)
+
+            if segments[-1][2] in changed:
+                remaining = self._segments(tank_id)
+                if remaining:
+                    last_series = _read_segment(tank_id, remaining[-1][2])
+                    self._last_timestamp[tank_id] = from_epoch_us(last_series.timestamps.max())
+                else:
+                    self._last_timestamp.pop(tank_id, None)
+
+        readings_before = sum(len(part) for part in before_parts)
+        retained = _sorted_series(_concat_series(tank_id, after_parts))
+        start_us = to_epoch_us(datetime.combine(first, datetime.min.time()))
+        end_us = to_epoch_us(datetime.combine(last, datetime.max.time()))
+        return start_us, end_us, readings_before, retained
+
+    def _replace_segment(self, path: str, series: TankSeries) -> None:
+        """Atomically replace one segment file with sorted readings, removing it if there are none"""
+        if not len(series):
+            os.remove(path)
+            return
+        partial = path + PARTIAL_SUFFIX
+        if path.endswith(COLD_SUFFIX):
+            with open(partial, 'wb') as f:
+                f.write(encode_block(series.timestamps, series.levels, series.user_ids))
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            _write_durably(partial, "".join(_series_lines(series)))
+        os.replace(partial, path)
+
+    def compact(self, before: datetime) -> int:
+        """Merge the segments of each month that ended before `before` into one YYYY-MM file"""
+        merged = 0
+        with self._lock:
+            for tank_id in self.tank_ids():
+                months: Dict[str, List[Tuple[date, date, str]]] = {}
+                for segment in self._segments(tank_id):
+                    first_day, last_day, _ = segment
+                    month_end = date(first_day.year, first_day.month,
+                                     calendar.monthrange(first_day.year, first_day.month)[1])
+                    if month_end < before.date():
+                        months.setdefault(first_day.strftime("%Y-%m"), []).append(segment)
+
+                for month, segments in sorted(months.items()):
+                    if len(segments) == 1 and segments[0][0] != segments[0][1]:
+                        continue  # already a single monthly segment (NDJSON or cold)
+                    self._close_handle(tank_id)
+                    self._merge_month(tank_id, month, [path for _, _, path in segments])
+                    merged += len(segments) - 1
+
+        if merged:
+            logger.info(f"Compacted {merged} segments into monthly segments")
+        return merged
+
+    def _merge_month(self, tank_id: str, month: str, sources: List[str]) -> None:
+        """Write one sorted monthly segment, then remove its sources"""
+        lines = []
+        for path in sources:
+            if path.endswith(COLD_SUFFIX):
+                lines.extend(_series_lines(_read_segment(tank_id, path)))
+                continue
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                lines.extend(line for line in f if line.endswith("\n"))
+
+        stamps = []
+        for line in lines:
+            try:
+                stamps.append(json.loads(line)["timestamp"])
+            except (ValueError, KeyError, TypeError):
+                # Damaged by a crash; _parse_lines skips these too
+                stamps.append(None)
+        if None in stamps:
+            logger.warning(f"Dropping {stamps.count(None)} unreadable lines while compacting {tank_id} {month}")
+            lines = [line for line, stamp in zip(lines, stamps) if stamp is not None]
+            stamps = [stamp for stamp in stamps if stamp is not None]
+        timestamps = to_epoch_us_array(stamps)
+        order = np.argsort(timestamps, kind="stable")
+
+        target = os.path.join(self._tank_dir(tank_id), f"{month}{SEGMENT_SUFFIX}")
+        partial = target + PARTIAL_SUFFIX
+        _write_durably(partial, "".join(lines[i] for i in order))
+
+        # Once renamed to .tmp the merged file is complete; recovery finishes from here
+        os.replace(partial, target + COMPLETE_SUFFIX)
+        for path in sources:
+            os.remove(path)
+        os.replace(target + COMPLETE_SUFFIX, target)
+
+    def encode_cold(self, before: datetime) -> int:
+        """Compact months that ended before `before`, then compress their monthly segments"""
+        encoded = 0
+        with self._lock:
+            self.compact(before)
+            for tank_id in self.tank_ids():
+                for first_day, last_day, path in self._segments(tank_id):
+                    if first_day == last_day or last_day >= before.date() or not path.endswith(SEGMENT_SUFFIX):
+                        continue
+                    series = _read_segment(tank_id, path)
+                    order = np.argsort(series.timestamps, kind="stable")
+                    block = encode_block(
+                        series.timestamps[order], series.levels[order],
+                        series.user_ids[order] if series.user_ids is not None else None,
+                    )
+
+                    target = path[:-len(SEGMENT_SUFFIX)] + COLD_SUFFIX
+                    partial = target + PARTIAL_SUFFIX
+                    with open(partial, 'wb') as f:
+                        f.write(block)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(partial, target)
+                    os.remove(path)
+                    encoded += 1
+
+        if encoded:
+            logger.info(f"Encoded {encoded} monthly segments as cold blocks")
+        return encoded
+
+    def storage_bytes(self) -> int:
+        """Get the total size of all segment files"""
+        return directory_size(self.root)
+
+    def tank_bytes(self, tank_id: str) -> int:
+        """Get the total size of one tank's segment files"""
+        return directory_size(self._tank_dir(tank_id))
+
+
+def _segment_stem(name: str) -> Optional[str]:
+    """Get the date part of a segment file name, or None for other files"""
+    for suffix in (SEGMENT_SUFFIX, COLD_SUFFIX):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
+
+
+def _read_segment(tank_id: str, path: str) -> TankSeries:
+    """Read one segment file as an (unsorted, for NDJSON) series"""
+    if path.endswith(COLD_SUFFIX):
+        with open(path, 'rb') as f:
+            timestamps, levels, user_ids = decode_block(f.read())
+        return TankSeries(tank_id, timestamps, levels, user_ids)
+
+    timestamps, levels, user_ids = [], [], []
+    for item in _parse_lines(path):
+        timestamps.append(item["timestamp"])
+        levels.append(item["level"])
+        user_ids.append(item.get("user_id"))
+
+    return TankSeries(
+        tank_id,
+        to_epoch_us_array(timestamps),
+        np.asarray(levels, dtype=np.float32),
+        np.asarray(user_ids, dtype=object) if any(u is not None for u in user_ids) else None,
+    )
+
+
+def _concat_series(tank_id: str, chunks: List[TankSeries]) -> TankSeries:
+    """Concatenate series, filling in missing owners, without sorting"""
+    if not chunks:
+        return TankSeries.empty(tank_id)
+    user_ids = None
+    if any(chunk.user_ids is not None for chunk in chunks):
+        user_ids = np.concatenate([
+            chunk.user_ids if chunk.user_ids is not None else np.full(len(chunk), None, dtype=object)
+            for chunk in chunks
+        ])
+    return TankSeries(
+        tank_id,
+        np.concatenate([chunk.timestamps for chunk in chunks]),
+        np.concatenate([chunk.levels for chunk in chunks]),
+        user_ids,
+    )
+
+
+def _sorted_series(series: TankSeries) -> TankSeries:
+    """Sort a series read from a segment by timestamp"""
+    order = np.argsort(series.timestamps, kind="stable")
+    return TankSeries(
+        series.tank_id,
+        series.timestamps[order],
+        series.levels[order],
+        series.user_ids[order] if series.user_ids is not None else None,
+    )
+
+
+def _day_start_us(timestamp_us: int) -> int:
+    """Get the first microsecond of the day a timestamp falls on"""
+    return to_epoch_us(datetime.combine(from_epoch_us(timestamp_us).date(), datetime.min.time()))
+
+
+def _day_end_us(timestamp_us: int) -> int:
+    """Get the last microsecond of the day a timestamp falls on"""
+    return to_epoch_us(datetime.combine(from_epoch_us(timestamp_us).date(), datetime.max.time()))
+
+
+def _segment_items(tank_id: str, path: str) -> Iterable[Dict[str, Any]]:
+    """Yield the readings of one segment file as dicts"""
+    if path.endswith(COLD_SUFFIX):
+        series = _read_segment(tank_id, path)
+        for i, (timestamp, level) in enumerate(zip(series.timestamps.tolist(), series.levels.tolist())):
+            item = {"timestamp": from_epoch_us(timestamp), "level": level, "tank_id": tank_id}
+            if series.user_ids is not None and series.user_ids[i] is not None:
+                item["user_id"] = series.user_ids[i]
+            yield item
+        return
+
+    for item in _parse_lines(path):
+        item["timestamp"] = datetime.fromisoformat(item["timestamp"])
+        yield item
+
+
+def _parse_lines(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the complete readings of an NDJSON segment, skipping lines a crash left damaged"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for number, line in enumerate(f, 1):
+            if not line.endswith("\n"):
+                continue
+            try:
+                item = json.loads(line)
+                if "timestamp" not in item or "level" not in item:
+                    raise ValueError("missing timestamp or level")
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Skipping unreadable line {number} in segment {path}: {str(e)}")
+                continue
+            yield item
+
+
+def _truncate_torn_line(path: str) -> None:
+    """Cut an incomplete final line off a segment so appends start on a fresh line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the last complete line
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        logger.warning(f"Truncating incomplete write at offset {end} in segment {path}")
+        f.truncate(end)
+
+
+def _segment_days(stem: str) -> Tuple[date, date]:
+    """Get the first and last day covered by a daily or monthly segment name"""
+    if len(stem) == 7:
+        first_day = date.fromisoformat(f"{stem}-01")
+        return first_day, date(first_day.year, first_day.month,
+                               calendar.monthrange(first_day.year, first_day.month)[1])
+    day = date.fromisoformat(stem)
+    return day, day
+
+
+def _series_lines(series: TankSeries) -> List[str]:
+    """Format a series as NDJSON segment lines
+
+    The lines are compatible with those append() writes, not byte-identical:
+    timestamps always carry microseconds (".000000") and levels use the
+    shortest float32 repr. Readers parse both forms the same way.
+    """
+    timestamps = series.timestamps.astype("datetime64[us]").astype(str).tolist()
+    # Shortest repr of each float32 level, so rewritten lines stay compact
+    levels = series.levels.astype(str).tolist()
+    tank = json.dumps(series.tank_id)
+    if series.user_ids is None:
+        return [f'{{"timestamp": "{timestamp}", "level": {level}, "tank_id": {tank}}}\n'
+                for timestamp, level in zip(timestamps, levels)]
+
+    # Escape each distinct owner once
+    owners: Dict[Any, str] = {None: ""}
+    for user_id in pd.unique(series.user_ids):
+        if user_id is not None and user_id not in owners:
+            owners[user_id] = f', "user_id": {json.dumps(user_id)}'
+    return [f'{{"timestamp": "{timestamp}", "level": {level}, "tank_id": {tank}{owners[user_id]}}}\n'
+            for timestamp, level, user_id in zip(timestamps, levels, series.user_ids)]
+
+
+def _write_durably(path: str, content: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def fsync_path(path: str) -> None:
+    """Flush a file written through another handle to stable storage"""
+    if not os.path.exists(path):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def directory_size(path: str) -> int:
+    """Get the total size of the files under a directory"""
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
+def create_storage(backend: str = "segments") -> TankStorage:
+    """
+    Create the history backend named in config.json
+
+    Args:
+        backend: "segments" (NDJSON, the default), "binary" or "sqlite"
+
+    Returns:
+        TankStorage instance
+    """
+    if backend == "binary":
+        from binary_history import BinaryHistoryStore
+        return BinaryHistoryStore()
+    if backend == "sqlite":
+        from sqlite_storage import SQLiteTankStorage
+        return SQLiteTankStorage()
+    if backend != "segments":
+        logger.warning(f"Unknown storage backend '{backend}', using segments")
+    return SegmentedTankStore()
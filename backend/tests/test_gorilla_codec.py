@@ -0,0 +1,42 @@
+import numpy as np
+
+from gorilla_codec import decode_block, encode_block
+
+
+def test_block_round_trips_bit_for_bit():
+    rng = np.random.default_rng(7)
+    # Hourly readings with jitter, duplicated timestamps and a gap
+    steps = rng.choice([3_600_000_000, 3_600_000_000, 3_599_999_000, 0, 86_400_000_000], size=5000)
+    timestamps = 1_767_225_600_000_000 + np.cumsum(steps).astype(np.int64)
+    levels = (50 + np.cumsum(rng.normal(0, 0.5, size=5000))).astype(np.float32)
+    levels[100:200] = levels[99]  # unchanged levels
+    levels[300] = np.nan
+    levels[301] = -0.0
+    levels[302] = np.inf
+
+    decoded_timestamps, decoded_levels, user_ids = decode_block(encode_block(timestamps, levels))
+
+    assert decoded_timestamps.dtype == np.int64
+    assert np.array_equal(decoded_timestamps, timestamps)
+    assert np.array_equal(decoded_levels.view(np.uint32), levels.view(np.uint32))
+    assert user_ids is None
+
+
+def test_owner_runs_round_trip():
+    timestamps = np.arange(6, dtype=np.int64) * 60_000_000
+    levels = np.arange(6, dtype=np.float32)
+    owners = np.array(["alice", "alice", None, None, "bob", "alice"], dtype=object)
+
+    _, _, user_ids = decode_block(encode_block(timestamps, levels, owners))
+
+    assert user_ids.tolist() == owners.tolist()
+
+
+def test_single_reading_round_trips():
+    timestamps = np.array([1_767_225_600_000_000], dtype=np.int64)
+    levels = np.array([12.5], dtype=np.float32)
+
+    decoded_timestamps, decoded_levels, _ = decode_block(encode_block(timestamps, levels))
+
+    assert decoded_timestamps.tolist() == timestamps.tolist()
+    assert decoded_levels.tolist() == [12.5]
@@ -0,0 +1,80 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from pagination import KeysetIndex, decode_cursor, encode_cursor
+from tank_api_service import TankAPIService
+from tank_cache import TankHistoryCache
+from tank_storage import SegmentedTankStore, TankSeries, to_epoch_us
+
+
+def make_service(root, cached):
+    """A service over a local segment store, without the external API or background workers"""
+    service = TankAPIService.__new__(TankAPIService)
+    service.store = SegmentedTankStore(root)
+    service.cache = TankHistoryCache(service.store.read_series, lock=threading.RLock()) if cached else None
+    service._refresh = lambda days=None: None
+    return service
+
+
+def walk(service, limit, **kwargs):
+    rows, cursor = [], None
+    while True:
+        frame, last_key = service.fetch_tank_page(limit=limit, cursor=cursor, **kwargs)
+        assert len(frame) <= limit
+        rows.extend(zip(frame["timestamp"], frame["tank_id"], frame["level"]))
+        if last_key is None:
+            return rows
+        # Cursors go out to clients and come back as strings
+        cursor = decode_cursor(encode_cursor(last_key))
+
+
+def test_cursor_round_trips():
+    key = (1_767_225_600_000_000, "tank/€", 3)
+    assert decode_cursor(encode_cursor(key)) == key
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+@pytest.mark.parametrize("cached", [True, False])
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 100])
+def test_pages_cover_tied_timestamps_exactly_once(tmp_path, cached, limit):
+    service = make_service(str(tmp_path / "segments"), cached)
+    base = datetime(2026, 3, 1, 8, 0)
+    # Three readings share a timestamp within tank1, and both tanks share timestamps
+    stamps = [base, base + timedelta(hours=1), base + timedelta(hours=1), base + timedelta(hours=1),
+              base + timedelta(days=1)]
+    series_list = []
+    for offset, tank_id in enumerate(["tank1", "tank2"]):
+        series_list.append(TankSeries(
+            tank_id,
+            np.array([to_epoch_us(stamp) for stamp in stamps], dtype=np.int64),
+            np.arange(len(stamps), dtype=np.float32) + 10 * offset,
+            None,
+        ))
+    service.store.append_series(series_list)
+
+    rows = walk(service, limit)
+
+    assert len(rows) == 10
+    assert len(set((tank_id, level) for _, tank_id, level in rows)) == 10
+    keys = [(timestamp, tank_id) for timestamp, tank_id, _ in rows]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_keyset_index_pages_tied_timestamps_newest_first():
+    index = KeysetIndex()
+    for position, (timestamp, tank_id) in enumerate([(5, "a"), (5, "a"), (5, "b"), (3, "a"), (5, "a")]):
+        index.add(timestamp, tank_id, position)
+
+    pages, cursor = [], None
+    while True:
+        positions, cursor = index.page(2, cursor)
+        pages.append(positions)
+        if cursor is None:
+            break
+
+    assert [position for page in pages for position in page] == [2, 4, 1, 0, 3]
+    assert all(len(page) <= 2 for page in pages)
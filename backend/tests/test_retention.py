@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from retention_service import apply_retention
+from tank_rollups import MICROSECONDS
+from tank_storage import SegmentedTankStore, TankSeries, from_epoch_us, to_epoch_us
+
+
+def make_history(tank_id, start, hours):
+    stamps = [start + timedelta(hours=hour) for hour in range(hours)]
+    return TankSeries(
+        tank_id,
+        np.array([to_epoch_us(stamp) for stamp in stamps], dtype=np.int64),
+        np.arange(hours, dtype=np.float32),
+        np.array([("alice", "bob", None)[hour % 3] for hour in range(hours)], dtype=object),
+    )
+
+
+@pytest.mark.parametrize("mode", ["drop", "downsample"])
+def test_expire_matches_retention_over_the_whole_history(tmp_path, mode):
+    store = SegmentedTankStore(str(tmp_path / "segments"))
+    # January is merged into a monthly segment and encoded cold; March stays in daily segments
+    history = make_history("tank1", datetime(2026, 1, 20), 24 * 60)
+    store.append_series([history])
+    store.compact(datetime(2026, 3, 1))
+    store.encode_cold(datetime(2026, 2, 1))
+
+    cutoffs = {
+        "alice": to_epoch_us(datetime(2026, 2, 10)),
+        "bob": None,  # kept forever
+        None: to_epoch_us(datetime(2026, 3, 5)),
+    }
+    width_us = MICROSECONDS["1d"]
+
+    def retain(series):
+        return apply_retention(series, cutoffs, mode, width_us)
+
+    expected = apply_retention(history, cutoffs, mode, width_us)
+    replaced = store.expire("tank1", from_epoch_us(cutoffs[None]), retain)
+
+    assert replaced is not None
+    start_us, end_us, readings_before, retained = replaced
+    stored = store.read_series("tank1")
+    assert np.array_equal(stored.timestamps, expected.timestamps)
+    assert np.array_equal(stored.levels, expected.levels)
+    assert stored.user_ids.tolist() == expected.user_ids.tolist()
+
+    # The reported days hold exactly the retained readings
+    inside = (stored.timestamps >= start_us) & (stored.timestamps <= end_us)
+    assert np.array_equal(retained.timestamps, stored.timestamps[inside])
+    assert readings_before == int(((history.timestamps >= start_us) & (history.timestamps <= end_us)).sum())
+
+    # A second pass finds nothing left to expire
+    assert store.expire("tank1", from_epoch_us(cutoffs[None]), retain) is None
+
+
+def test_unowned_cutoff_applies_to_unknown_owners():
+    history = make_history("tank1", datetime(2026, 3, 1), 6)
+    cutoff = to_epoch_us(datetime(2026, 3, 1, 3, 0))
+
+    retained = apply_retention(history, {None: cutoff}, "drop")
+
+    assert retained.timestamps.tolist() == history.timestamps[3:].tolist()
+    assert apply_retention(retained, {None: cutoff}, "drop") is None
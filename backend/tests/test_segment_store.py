@@ -0,0 +1,78 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from tank_storage import SegmentedTankStore, TankSeries, to_epoch_us
+
+
+def make_series(tank_id, timestamps, levels, user_ids=None):
+    return TankSeries(
+        tank_id,
+        np.array([to_epoch_us(timestamp) for timestamp in timestamps], dtype=np.int64),
+        np.array(levels, dtype=np.float32),
+        np.array(user_ids, dtype=object) if user_ids is not None else None,
+    )
+
+
+def test_torn_backfilled_segment_is_repaired_before_append(tmp_path):
+    root = str(tmp_path / "segments")
+    store = SegmentedTankStore(root)
+    today = datetime(2026, 3, 10, 12, 0)
+    backfill = datetime(2026, 3, 1, 8, 0)
+    store.append_series([make_series("tank1", [today], [5.0])])
+    store.append_series([make_series("tank1", [backfill], [4.0])])
+    store.close()
+
+    # A crash while writing the back-filled (non-tail) day leaves half a line behind
+    with open(store._segment_path("tank1", backfill.date()), "a", encoding="utf-8") as f:
+        f.write('{"timestamp": "2026-03-01T09:00:00", "lev')
+
+    store = SegmentedTankStore(root)
+    store.append_series([make_series("tank1", [backfill + timedelta(hours=2)], [4.5])])
+    series = store.read_series("tank1")
+
+    assert series.levels.tolist() == [4.0, 4.5, 5.0]
+    with open(store._segment_path("tank1", backfill.date()), encoding="utf-8") as f:
+        assert all(line.endswith("}\n") for line in f)
+
+
+def test_unreadable_lines_are_skipped_instead_of_failing_the_tank(tmp_path):
+    store = SegmentedTankStore(str(tmp_path / "segments"))
+    day = datetime(2026, 3, 1, 8, 0)
+    store.append_series([make_series("tank1", [day, day + timedelta(hours=1)], [1.0, 2.0])])
+    store.close()
+
+    # A damaged line from before the repair existed, already followed by good ones
+    path = store._segment_path("tank1", day.date())
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"timestamp": "2026-03-01T1{"timestamp": "2026-03-01T11:00:00", "level": 3.0}\n')
+        f.write('{"timestamp": "2026-03-01T12:00:00", "level": 4.0, "tank_id": "tank1"}\n')
+
+    store = SegmentedTankStore(str(tmp_path / "segments"))
+    assert store.read_series("tank1").levels.tolist() == [1.0, 2.0, 4.0]
+    assert [item["level"] for item in store.read("tank1")] == [1.0, 2.0, 4.0]
+    assert store.compact(datetime(2026, 5, 1)) == 0
+
+
+def test_tank_ids_round_trip_through_directory_names(tmp_path):
+    store = SegmentedTankStore(str(tmp_path / "segments"))
+    tank_ids = ["tank1", "Tank°3", "tank/€", "..", "a.b~c", "x y%z"]
+    day = datetime(2026, 3, 1, 8, 0)
+    store.append_series([make_series(tank_id, [day], [float(i)]) for i, tank_id in enumerate(tank_ids)])
+
+    assert store.tank_ids() == sorted(tank_ids)
+    for i, tank_id in enumerate(tank_ids):
+        assert store.read_series(tank_id).levels.tolist() == [float(i)]
+    assert all(not name.startswith(".") for name in os.listdir(store.root))
+
+
+def test_legacy_unicode_directories_are_renamed(tmp_path):
+    root = tmp_path / "segments"
+    (root / "Tankö").mkdir(parents=True)
+    (root / "Tankö" / "2026-03-01.ndjson").write_text(
+        '{"timestamp": "2026-03-01T08:00:00", "level": 1.5, "tank_id": "Tankö"}\n', encoding="utf-8")
+
+    store = SegmentedTankStore(str(root))
+    assert store.tank_ids() == ["Tankö"]
+    assert store.read_series("Tankö").levels.tolist() == [1.5]